@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+长文字自动排版基准测试
+
+对比二分查找（fit_text）和逐个字号线性扫描两种方式:
+排版次数、实际测量宽度的次数、耗时。
+
+用法:
+    python scripts/benchmark_caption_fit.py
+    python scripts/benchmark_caption_fit.py --font assets/fonts/Impact.ttf --width 1000 --height 1250
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme import text_layout, text_render
+from src.meme.caption_meme import CaptionMeme
+
+CAPTIONS = [
+    "GM BUILDERS",
+    "WHEN YOU FINALLY SHIP THE FEATURE AND PROD IS STILL UP ON FRIDAY AFTERNOON",
+    "when the bear market ends and everyone suddenly remembers they were always bullish about the tech",
+    "当你终于在周五下午上线了新功能而且生产环境到现在都还没有挂掉的时候",
+    "GM 中文梗图测试 WAGMI 我们都会成功的 NOBODY TAKES MEMES AS SERIOUSLY AS US",
+    "SUPERCALIFRAGILISTICEXPIALIDOCIOUS " * 4,
+]
+
+
+def clear_caches():
+    text_render.load_font.cache_clear()
+    text_layout.measure.cache_clear()
+    text_layout.line_height.cache_clear()
+    text_layout.fit_text.cache_clear()
+
+
+def linear_fit(text, font_path, max_width, max_height, min_size, max_size):
+    """对照组: 从最大字号开始逐个尝试"""
+    for size in range(max_size, min_size - 1, -1):
+        layout = text_layout.layout_text(text, font_path, size, max_width, max_height)
+        if layout.fits:
+            return layout
+    return layout
+
+
+def run(name, fit, caption, args):
+    clear_caches()
+    calls = {"layouts": 0}
+    original = text_layout.layout_text
+
+    def counting_layout(*a, **kw):
+        calls["layouts"] += 1
+        return original(*a, **kw)
+
+    text_layout.layout_text = counting_layout
+    try:
+        start = time.perf_counter()
+        layout = fit(
+            caption, args.font,
+            int(args.width * CaptionMeme.CAPTION_BOX_RATIO[0]),
+            int(args.height * CaptionMeme.CAPTION_BOX_RATIO[1]),
+            max(12, args.width // 50), max(12, args.width // 10)
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        text_layout.layout_text = original
+
+    measurements = text_layout.measure.cache_info().misses
+    print(f"   {name:<8} 字号 {layout.font_size:>3}  {len(layout.lines)} 行  "
+          f"排版 {calls['layouts']:>3} 次  测量 {measurements:>5} 次  {elapsed * 1000:>7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="长文字自动排版基准测试")
+    parser.add_argument("--font", help="字体文件路径（默认使用 CaptionMeme 找到的 Impact 字体）")
+    parser.add_argument("--width", type=int, default=1000, help="图片宽度")
+    parser.add_argument("--height", type=int, default=1250, help="图片高度")
+    args = parser.parse_args()
+
+    if args.font is None:
+        font_file = CaptionMeme().font_path
+        args.font = str(font_file) if font_file else None
+    print(f"\n🔤 字体: {args.font or 'PIL 默认字体'}")
+
+    for caption in CAPTIONS:
+        print(f"\n📝 {caption[:50]}{'...' if len(caption) > 50 else ''} ({len(caption)} 字符)")
+        run("二分", text_layout.fit_text.__wrapped__, caption, args)
+        run("线性", linear_fit, caption, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+输出编码预设基准测试
+
+对同一张 1000x1250 的梗图，测量每个输出预设的编码耗时和文件大小。
+
+用法:
+    python scripts/benchmark_encoders.py
+    python scripts/benchmark_encoders.py --image output/memes/milady_meme_123.png --repeat 10
+"""
+
+import io
+import sys
+import time
+import argparse
+from pathlib import Path
+
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.image_io import OUTPUT_PRESETS, encode_image
+from src.meme.milady_composer import MiladyComposer
+from src.meme.caption_meme import CaptionMeme
+
+
+def build_sample() -> Image.Image:
+    """用图层合成一张带文字的样例梗图"""
+    composer = MiladyComposer()
+    layers = {}
+    for category in ("Hair", "Hat", "Glasses", "Shirt"):
+        available = composer.get_available_layers(category)
+        if available:
+            layers[category] = available[0]
+
+    img = composer.compose_from_scratch(layers=layers)
+    return CaptionMeme().add_caption(img, "GM BUILDERS", "LFG")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="输出编码预设基准测试")
+    parser.add_argument("--image", help="测试图片路径（默认用图层合成一张）")
+    parser.add_argument("--repeat", type=int, default=5, help="每个预设重复编码的次数")
+    args = parser.parse_args()
+
+    img = Image.open(args.image) if args.image else build_sample()
+    img.load()
+    print(f"\n🖼️  测试图片: {img.size[0]}x{img.size[1]} {img.mode}")
+
+    # 参考: 原来的 img.save(path) 默认 PNG 设置（RGBA，compress_level=6）
+    cases = [("legacy_png", None)] + [(name, name) for name in OUTPUT_PRESETS]
+
+    print(f"\n{'预设':<12} {'格式':<6} {'耗时(ms)':>10} {'大小(KB)':>10}")
+    print("-" * 42)
+
+    for name, preset in cases:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            if preset is None:
+                buffer = io.BytesIO()
+                img.save(buffer, format="PNG")
+                data = buffer.getvalue()
+            else:
+                data = encode_image(img, preset)
+            timings.append(time.perf_counter() - start)
+
+        image_format = OUTPUT_PRESETS[preset]["format"] if preset else "PNG"
+        print(f"{name:<12} {image_format:<6} {min(timings) * 1000:>10.1f} {len(data) / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
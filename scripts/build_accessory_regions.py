@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+预计算所有 NFT 的配饰区域表
+
+每个 Milady 都由已知图层合成，配饰（帽子、眼镜、耳环、项链、脸部装饰）的位置就是对应图层
+alpha 通道的包围盒。这里按本地属性索引找到每个 token 的配饰图层，一次性算出所有区域，
+写入 cache/accessory_regions。之后替换原版 NFT 的配饰时直接查表，不再调用 SAM-2。
+
+需要先构建属性索引（build_nft_attribute_index.py）；图层从 LayerStore 读取（build_layer_store.py 可预先构建）。
+
+用法:
+    python scripts/build_accessory_regions.py
+    python scripts/build_accessory_regions.py --token 5050 --token 1234
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.accessory_regions import AccessoryRegionTable
+from src.meme.local_detector import LocalAccessoryDetector
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预计算所有 NFT 的配饰区域表")
+    parser.add_argument("--table-dir", default="cache/accessory_regions", help="区域表目录")
+    parser.add_argument("--token", type=int, action="append", default=None, help="只计算指定 token（可重复）")
+    args = parser.parse_args()
+
+    detector = LocalAccessoryDetector()
+    index = detector.attribute_index
+    if len(index) == 0:
+        print("❌ 本地属性索引为空，请先运行 scripts/build_nft_attribute_index.py")
+        sys.exit(1)
+
+    table = AccessoryRegionTable(table_dir=args.table_dir, max_tokens=index.max_tokens)
+    nft_ids = args.token or [nft_id for nft_id in range(index.max_tokens) if nft_id in index]
+
+    print(f"🚀 计算 {len(nft_ids)} 个 token 的配饰区域...")
+    start = time.time()
+    stats = table.build(detector, nft_ids)
+    table.save()
+
+    for accessory_type, count in stats.items():
+        print(f"   {accessory_type}: {count}")
+    print(f"✅ 完成，用时 {time.time() - start:.1f}s，共 {len(table)} 个 token 有配饰 → {table.table_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+构建图层名搜索索引
+
+读取 assets/milady_layers/layer_config.json，写入 cache/layer_index/index.json。
+PromptParser 首次使用时也会自动构建，配置变化后自动重建。
+
+用法:
+    python scripts/build_layer_index.py
+    python scripts/build_layer_index.py --query "brown cowboy hat" --query 粉色蝴蝶结
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.layer_index import LayerIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建图层名搜索索引")
+    parser.add_argument("--config", default="assets/milady_layers/layer_config.json", help="图层配置文件")
+    parser.add_argument("--cache", default="cache/layer_index/index.json", help="索引缓存文件")
+    parser.add_argument("--query", action="append", default=[], help="构建后测试查询（可重复）")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = LayerIndex.build(args.config)
+    index.save(args.cache)
+    print(f"✅ 索引了 {len(index)} 个图层 ({(time.perf_counter() - start) * 1000:.1f} ms) → {args.cache}")
+
+    for query in args.query:
+        start = time.perf_counter()
+        matches = index.search(query)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"\n🔍 {query} ({elapsed:.3f} ms)")
+        for match in matches:
+            print(f"   {match.score:.2f}  {match.key}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+构建预缩放图层存储
+
+把 layer_config.json 中列出的所有图层（以及 UnclothedBase）缩放到 NFT 尺寸，
+以预乘 RGBA 的形式写入 cache/layer_store，之后合成时无需再解码和缩放原图。
+
+用法:
+    python scripts/build_layer_store.py          # 增量构建（只处理新增/更新的图层）
+    python scripts/build_layer_store.py --force  # 全部重建
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.layer_store import LayerStore
+
+LAYER_DIR = Path("assets/milady_layers")
+CONFIG_PATH = LAYER_DIR / "layer_config.json"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建预缩放图层存储")
+    parser.add_argument("--force", action="store_true", help="忽略已有文件，全部重建")
+    parser.add_argument("--store-dir", default="cache/layer_store", help="存储目录")
+    args = parser.parse_args()
+
+    layer_config = LayerStore.load_layer_config(str(CONFIG_PATH))
+
+    # UnclothedBase 不在 layer_config.json 中，但重组模式会用到
+    for category_dir in sorted(LAYER_DIR.iterdir()):
+        if category_dir.is_dir() and category_dir.name not in layer_config:
+            layer_config[category_dir.name] = sorted(p.name for p in category_dir.glob("*.png"))
+
+    store = LayerStore(layer_dir=str(LAYER_DIR), store_dir=args.store_dir)
+
+    print(f"🚀 构建图层存储 → {store.store_dir}")
+    start = time.time()
+    stats = store.build(layer_config, force=args.force)
+    elapsed = time.time() - start
+
+    print()
+    print(f"✅ 完成！耗时 {elapsed:.1f}s")
+    print(f"   新生成: {stats['built']}")
+    print(f"   已是最新: {stats['skipped']}")
+    print(f"   源文件缺失: {stats['missing']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+构建本地 NFT 属性索引
+
+从 assets/milady_nfts/metadata/*.json 和 assets/milady_nfts/milady_*_info.json 读取属性，
+写入 cache/nft_attributes。合成时查本地索引，不再每次请求 miladymaker.net。
+
+用法:
+    python scripts/build_nft_attribute_index.py
+    python scripts/build_nft_attribute_index.py --fetch-missing   # 从官方 API 补全缺失的 token
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.nft_attributes import NFTAttributeIndex
+
+NFT_DIR = Path("assets/milady_nfts")
+METADATA_DIR = NFT_DIR / "metadata"
+ATTRIBUTES_API = "https://www.miladymaker.net/milady/json/"
+
+
+def fetch_missing(index: NFTAttributeIndex, delay: float = 0.1):
+    """从官方 API 补全索引中缺失的 token"""
+    session = requests.Session()
+    missing = [nft_id for nft_id in range(index.max_tokens) if nft_id not in index]
+    print(f"⬇️  需要补全 {len(missing)} 个 token")
+
+    for i, nft_id in enumerate(missing, 1):
+        try:
+            response = session.get(f"{ATTRIBUTES_API}{nft_id}", timeout=10)
+            if response.status_code == 200:
+                attributes = index.extract_attributes(response.json())
+                if attributes:
+                    index.put(nft_id, attributes)
+        except Exception as e:
+            print(f"⚠️  获取 #{nft_id} 失败: {e}")
+
+        # 定期落盘，中断后可以续跑
+        if i % 200 == 0:
+            index.save()
+            print(f"   [{i}/{len(missing)}] 已保存")
+
+        time.sleep(delay)
+
+    index.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建本地 NFT 属性索引")
+    parser.add_argument("--index-dir", default="cache/nft_attributes", help="索引目录")
+    parser.add_argument("--fetch-missing", action="store_true", help="从官方 API 补全缺失的 token")
+    args = parser.parse_args()
+
+    index = NFTAttributeIndex(index_dir=args.index_dir)
+
+    metadata_files = sorted(METADATA_DIR.glob("*.json")) if METADATA_DIR.exists() else []
+    metadata_files += sorted(NFT_DIR.glob("milady_*_info.json"))
+
+    print(f"🚀 从 {len(metadata_files)} 个 metadata 文件构建索引...")
+    count = index.build(metadata_files)
+    index.save()
+    print(f"✅ 从本地文件写入 {count} 个 token")
+
+    if args.fetch_missing:
+        fetch_missing(index)
+
+    print(f"📊 索引共收录 {len(index)}/{index.max_tokens} 个 token → {index.index_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+预先下载 memegen 空白模板（本地渲染用）
+
+下载 LocalMemegenRenderer.TEMPLATE_GEOMETRY 中所有模板的空白底图到 cache/memegen/blanks。
+之后 /memegen 命令的常用模板完全在本地渲染，不再请求 api.memegen.link。
+
+用法:
+    python scripts/prefetch_memegen_blanks.py
+    python scripts/prefetch_memegen_blanks.py --template drake --template fine
+"""
+
+import sys
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.memegen_api import MemegenAPI
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预先下载 memegen 空白模板")
+    parser.add_argument("--template", action="append", default=None, help="只下载指定模板（可重复）")
+    args = parser.parse_args()
+
+    renderer = MemegenAPI(local_render=True).local_renderer
+    result = renderer.prefetch(args.template)
+
+    ready = sum(result.values())
+    print(f"✅ {ready}/{len(result)} 个空白模板可用 → {renderer.blank_dir}")
+    if ready < len(result):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
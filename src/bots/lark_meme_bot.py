@@ -7,17 +7,22 @@ Lark/飞书 Meme Bot
 import os
 import json
 import re
+import threading
+import time
 from pathlib import Path
-from typing import Dict, Optional
+from typing import BinaryIO, Dict, Optional, Union
 import requests
 
 from src.meme.meme_generator_v2 import MemeGeneratorV2
 from src.meme.prompt_parser import PromptParser
-from src.meme.mcdonald_background import create_mcdonald_background
+from src.meme.backgrounds import BackgroundRegistry
 from src.meme.memegen_api import MemegenAPI
 from src.meme.illusion_diffusion import IllusionDiffusion
 from src.meme.replicate_illusion import ReplicateIllusion
 from src.meme.flux_fill_pro import FluxFillPro
+from src.meme.image_io import (
+    EXTENSIONS, MIME_TYPES, OUTPUT_PRESETS, detect_format, encode_image, resolve_preset, save_image
+)
 
 # 导入 Replicate 配置
 try:
@@ -46,7 +51,9 @@ class LarkMemeBot:
         self,
         app_id: str,
         app_secret: str,
-        verification_token: Optional[str] = None
+        verification_token: Optional[str] = None,
+        save_outputs: Optional[bool] = None,
+        output_preset: Optional[str] = None
     ):
         """
         初始化飞书机器人
@@ -55,17 +62,29 @@ class LarkMemeBot:
             app_id: 飞书应用 ID
             app_secret: 飞书应用密钥
             verification_token: 事件验证 token（可选）
+            save_outputs: Milady 梗图是否先保存到 output/lark 再上传，
+                          None 使用环境变量 LARK_SAVE_OUTPUTS（默认不保存，内存中直接上传）
+            output_preset: 输出编码预设（fast_png / png / webp / jpeg），
+                           None 使用环境变量 LARK_OUTPUT_PRESET（默认 fast_png）
         """
         self.app_id = app_id
         self.app_secret = app_secret
         self.verification_token = verification_token
         self.access_token = None
+        # 当前线程处理的消息是否已经回复过（处理函数没有返回图片时据此判断是否需要兜底回复）
+        self._replies = threading.local()
+
+        if save_outputs is None:
+            save_outputs = os.getenv("LARK_SAVE_OUTPUTS", "false").lower() in ("1", "true", "yes")
+        self.save_outputs = save_outputs
+        self.output_preset = resolve_preset(output_preset or os.getenv("LARK_OUTPUT_PRESET", "fast_png"))
 
         # 初始化 Meme Generator V2
         self.meme_generator = MemeGeneratorV2()
 
         # 初始化自然语言解析器
         self.prompt_parser = PromptParser()
+        self.backgrounds = BackgroundRegistry.shared()
 
         # 初始化 Memegen.link API
         self.memegen_api = MemegenAPI()
@@ -111,12 +130,17 @@ class LarkMemeBot:
         else:
             raise Exception(f"获取 access_token 失败: {data}")
 
-    def upload_image(self, image_path: str) -> str:
+    def upload_image(
+        self,
+        image: Union[str, bytes, BinaryIO],
+        filename: Optional[str] = None
+    ) -> str:
         """
         上传图片到飞书
 
         Args:
-            image_path: 本地图片路径
+            image: 本地图片路径、图片 bytes 或已打开的文件对象
+            filename: 上传时使用的文件名（bytes / 文件对象时可选）
 
         Returns:
             image_key
@@ -130,15 +154,26 @@ class LarkMemeBot:
             "Authorization": f"Bearer {self.access_token}"
         }
 
-        files = {
-            "image": open(image_path, "rb")
-        }
-
         data = {
             "image_type": "message"
         }
 
-        response = requests.post(url, headers=headers, files=files, data=data)
+        if isinstance(image, (str, Path)):
+            with open(image, "rb") as f:
+                files = {"image": (filename or Path(image).name, f)}
+                response = requests.post(url, headers=headers, files=files, data=data)
+        else:
+            data_bytes = image if isinstance(image, bytes) else image.read()
+            image_format = detect_format(data_bytes) or "PNG"
+            files = {
+                "image": (
+                    filename or f"meme{EXTENSIONS[image_format]}",
+                    data_bytes,
+                    MIME_TYPES[image_format]
+                )
+            }
+            response = requests.post(url, headers=headers, files=files, data=data)
+
         result = response.json()
 
         if result.get("code") == 0:
@@ -146,6 +181,22 @@ class LarkMemeBot:
         else:
             raise Exception(f"上传图片失败: {result}")
 
+    def _output_options(self, output_path: str, preset: Optional[str] = None) -> Dict:
+        """
+        Milady 梗图的输出参数
+
+        默认不落盘：生成器直接返回编码后的 bytes 交给 upload_image，
+        并发请求也不会互相覆盖同一个 output/lark/meme_{chat_id}.png
+
+        Args:
+            output_path: 保存模式下的输出路径
+            preset: 本次命令指定的编码预设（如 preset:webp），None 使用机器人默认预设
+        """
+        preset = resolve_preset(preset or self.output_preset)
+        if self.save_outputs:
+            return {"output_path": output_path, "preset": preset}
+        return {"save": False, "preset": preset}
+
     def send_image_message(
         self,
         receive_id: str,
@@ -204,6 +255,7 @@ class LarkMemeBot:
             content: 卡片内容
             receive_id_type: ID 类型
         """
+        self._replies.sent = True
         if not self.access_token:
             self.get_tenant_access_token()
 
@@ -261,12 +313,13 @@ class LarkMemeBot:
         - /meme crypto 1234
         - /meme gm 1234 Hat:Beret.png
         - /meme gm "Hello World" "Bottom Text" font:glow caps:off
+        - /milady 1234 preset:webp
 
         Args:
             args: 参数列表
 
         Returns:
-            解析后的参数字典
+            解析后的参数字典（参数有误时 "error" 为给用户看的提示）
         """
         params = {
             "template": None,
@@ -275,7 +328,9 @@ class LarkMemeBot:
             "top_text": "",
             "bottom_text": "",
             "font_style": "impact",
-            "all_caps": True
+            "all_caps": True,
+            "preset": None,
+            "error": None
         }
 
         for arg in args:
@@ -301,6 +356,17 @@ class LarkMemeBot:
             elif arg.startswith("caps:"):
                 params["all_caps"] = arg.split(":", 1)[1].lower() != "off"
 
+            # 输出编码预设: preset:webp
+            elif arg.startswith("preset:"):
+                preset = arg.split(":", 1)[1]
+                try:
+                    params["preset"] = resolve_preset(preset)
+                except ValueError:
+                    params["error"] = (
+                        f"❌ 未知的输出格式 `{preset}`\n\n"
+                        f"**支持:** {', '.join(OUTPUT_PRESETS)}（如 `preset:webp`）"
+                    )
+
             # NFT ID: 纯数字
             elif arg.isdigit():
                 params["nft_id"] = int(arg)
@@ -331,7 +397,7 @@ class LarkMemeBot:
             chat_id: 群聊 ID
 
         Returns:
-            生成的图片路径
+            生成的图片路径（不落盘时为图片 bytes）
 
         示例:
             "帮我生成一张 GM 的梗图"
@@ -343,18 +409,21 @@ class LarkMemeBot:
         params = self.prompt_parser.parse(prompt)
 
         output_path = f"output/lark/meme_{chat_id}.png"
+        output_options = self._output_options(output_path)
 
         # 检查是否需要自定义背景（如 McDonald 背景）- 优先级最高
-        if params.get("custom_background") == "mcdonald":
-            print(f"🍔 检测到 McDonald 背景请求")
-            return self._generate_with_mcdonald_background(
+        custom_background = params.get("custom_background")
+        if custom_background in self.backgrounds:
+            print(f"🍔 检测到自定义背景请求: {custom_background}")
+            return self._generate_with_custom_background(
+                custom_background,
                 nft_id=params["nft_id"],
                 layers=params["layers"],
                 top_text=params["top_text"],
                 bottom_text=params["bottom_text"],
                 font_style=params["font_style"],
                 all_caps=params["all_caps"],
-                output_path=output_path
+                **output_options
             )
 
         # 检查是否包含视觉风格描述（如 liminal space illusion）
@@ -382,7 +451,7 @@ class LarkMemeBot:
                     template_name=params["template"],
                     nft_id=params["nft_id"],
                     layers=params["layers"] if params["layers"] else None,
-                    output_path=output_path
+                    **output_options
                 )
             else:
                 return self.meme_generator.generate(
@@ -392,7 +461,7 @@ class LarkMemeBot:
                     bottom_text=params["bottom_text"] or "MEME",
                     font_style=params["font_style"],
                     all_caps=params["all_caps"],
-                    output_path=output_path
+                    **output_options
                 )
 
         # 标准流程：根据解析结果生成
@@ -407,7 +476,7 @@ class LarkMemeBot:
                 bottom_text=params["bottom_text"],
                 font_style=params["font_style"],
                 all_caps=params["all_caps"],
-                output_path=output_path
+                **output_options
             )
 
         # 2. 如果指定了图层，用户想要自定义 NFT + 图层，不要用模板
@@ -420,7 +489,7 @@ class LarkMemeBot:
                 bottom_text=None,
                 font_style=params["font_style"],
                 all_caps=params["all_caps"],
-                output_path=output_path
+                **output_options
             )
 
         # 3. 如果有模板，使用模板
@@ -429,7 +498,7 @@ class LarkMemeBot:
                 template_name=params["template"],
                 nft_id=params["nft_id"],
                 layers=None,  # 模板模式不使用额外图层
-                output_path=output_path
+                **output_options
             )
 
         # 4. 默认：随机 NFT + 默认文字
@@ -439,7 +508,7 @@ class LarkMemeBot:
                 layers=None,
                 top_text="MILADY",
                 bottom_text="MEME",
-                output_path=output_path
+                **output_options
             )
 
     def handle_slash_command(
@@ -457,7 +526,7 @@ class LarkMemeBot:
             chat_id: 群聊 ID
 
         Returns:
-            生成的图片路径
+            生成的图片路径（不落盘时为图片 bytes）
 
         示例:
             /milady 1234                          # 生成 NFT #1234
@@ -490,8 +559,11 @@ class LarkMemeBot:
         elif command == "milady":
             # 解析参数
             params = self.parse_command_args(args)
+            if params["error"]:
+                self.send_card_message(chat_id, "参数错误", params["error"])
+                return ""
 
-            output_path = f"output/lark/meme_{chat_id}.png"
+            output_options = self._output_options(f"output/lark/meme_{chat_id}.png", params["preset"])
 
             # 使用模板或自定义文字
             if params["template"] and params["template"] != "random":
@@ -499,7 +571,7 @@ class LarkMemeBot:
                     template_name=params["template"],
                     nft_id=params["nft_id"],
                     layers=params["layers"] if params["layers"] else None,
-                    output_path=output_path
+                    **output_options
                 )
             else:
                 # 自定义或随机
@@ -510,7 +582,7 @@ class LarkMemeBot:
                     bottom_text=params["bottom_text"],
                     font_style=params["font_style"],
                     all_caps=params["all_caps"],
-                    output_path=output_path
+                    **output_options
                 )
 
         else:
@@ -972,7 +1044,8 @@ positive_prompt: same character, detailed
                 layers=None,
                 top_text=None,
                 bottom_text=None,
-                output_path=base_nft_path
+                output_path=base_nft_path,
+                preset="fast_png"  # AI 输入图保持无损 PNG
             )
         except Exception as e:
             error_msg = f"❌ 生成 NFT #{nft_id} 失败: {str(e)}"
@@ -1191,7 +1264,8 @@ steps: 28
                 top_text="",
                 bottom_text="",
                 output_path=base_image_path,
-                output_size=(500, 500)  # 使用标准 NFT 尺寸
+                output_size=(500, 500),  # 使用标准 NFT 尺寸
+                preset="fast_png"  # AI 输入图保持无损 PNG
             )
 
             if not os.path.exists(base_image_path):
@@ -1206,7 +1280,8 @@ steps: 28
                 new_description=new_description,
                 output_path=output_path,
                 guidance=guidance,
-                num_inference_steps=steps
+                num_inference_steps=steps,
+                nft_id=nft_id
             )
 
             # 3. 发送成功消息
@@ -1435,7 +1510,8 @@ steps: 28
                 top_text="",
                 bottom_text="",
                 output_path=base_image_path,
-                output_size=(500, 500)  # 使用标准 NFT 尺寸
+                output_size=(500, 500),  # 使用标准 NFT 尺寸
+                preset="fast_png"  # AI 输入图保持无损 PNG
             )
 
             if not os.path.exists(base_image_path):
@@ -1452,7 +1528,8 @@ steps: 28
                 output_path=output_path,
                 guidance=guidance,
                 num_inference_steps=steps,
-                force_sam=use_sam_for_this  # 🎯 智能选择
+                force_sam=use_sam_for_this,  # 🎯 智能选择
+                nft_id=nft_id
             )
 
             # 3. 发送成功消息（包含模式信息）
@@ -1635,7 +1712,7 @@ steps: 28
             event_data: 飞书事件数据
 
         Returns:
-            生成的图片路径（如果有）
+            生成的图片路径（如果有；内存上传成功时为 None）
         """
         event = event_data.get("event", {})
         message = event.get("message", {})
@@ -1654,6 +1731,7 @@ steps: 28
         print(f"📩 收到消息: '{text}' (chat_id: {chat_id})")
 
         # 检查是否是斜杠命令或自然语言
+        self._replies.sent = False
         try:
             if text.startswith("/"):
                 # 斜杠命令模式
@@ -1674,18 +1752,30 @@ steps: 28
                             args.append(line)
 
                 print(f"🎯 处理命令: {command}, 参数: {args}")
-                image_path = self.handle_slash_command(command, args, chat_id)
+                image = self.handle_slash_command(command, args, chat_id)
             else:
                 # 自然语言模式
                 print(f"💬 处理自然语言: {text}")
-                image_path = self.handle_natural_language(text, chat_id)
-
-            print(f"✅ 图片生成成功: {image_path}")
+                image = self.handle_natural_language(text, chat_id)
+
+            if not image:
+                # 处理函数已经回复了用户（如帮助信息、参数错误），没有图片要发送；
+                # 没有回复就失败的（如生成器返回 None）给一个通用的失败提示
+                if not self._replies.sent:
+                    self.send_card_message(chat_id, "生成失败", "❌ 没有生成图片，请检查命令格式后重试")
+                return None
+
+            if isinstance(image, bytes):
+                print(f"✅ 图片生成成功（内存中，{len(image) / 1024:.0f} KB）")
+                image_path = None
+            else:
+                print(f"✅ 图片生成成功: {image}")
+                image_path = image
 
             # 尝试上传并发送图片
             try:
                 print(f"📤 尝试上传图片...")
-                image_key = self.upload_image(image_path)
+                image_key = self.upload_image(image)
                 print(f"✅ 图片上传成功: {image_key}")
 
                 print(f"📨 发送消息...")
@@ -1697,8 +1787,15 @@ steps: 28
                 print(f"⚠️ 图片上传失败: {upload_error}")
                 print(f"📝 权限审核中，图片已生成但无法发送到飞书")
 
+                # 内存中的图片上传失败时才落盘，方便之后手动发送
+                if image_path is None:
+                    output_dir = Path("output/lark")
+                    output_dir.mkdir(parents=True, exist_ok=True)
+                    image_path = str(output_dir / f"meme_{chat_id}_{int(time.time() * 1000)}{EXTENSIONS[detect_format(image) or 'PNG']}")
+                    with open(image_path, "wb") as f:
+                        f.write(image)
+
                 # 获取图片文件名
-                from pathlib import Path
                 filename = Path(image_path).name
 
                 # 尝试发送卡片消息告知用户（如果有权限的话）
@@ -1737,94 +1834,96 @@ steps: 28
                 pass
             raise
 
-    def _generate_with_mcdonald_background(
+    def _generate_with_custom_background(
         self,
+        background_name: str = "mcdonald",
         nft_id: Optional[int] = None,
         layers: Optional[Dict] = None,
         top_text: str = "",
         bottom_text: str = "",
         font_style: str = "impact",
         all_caps: bool = True,
-        output_path: str = "output/lark/mcdonald_milady.png"
-    ) -> str:
+        output_path: str = "output/lark/mcdonald_milady.png",
+        save: bool = True,
+        preset: Optional[str] = None
+    ) -> Union[str, bytes]:
         """
-        生成带有 McDonald 背景的 Milady NFT 图片
-        
+        生成带有自定义背景（如 McDonald 背景）的 Milady NFT 图片
+
+        复用生成器的 composer / caption，不在每次请求时重新构建
+
         Args:
+            background_name: 背景名（BackgroundRegistry 中注册的名字）
             nft_id: NFT ID，None 为随机
             layers: 图层配置
             top_text: 顶部文字
             bottom_text: 底部文字
             font_style: 字体风格
             all_caps: 是否全大写
-            output_path: 输出路径
-            
+            output_path: 输出路径（save=True 时）
+            save: 是否保存到文件；False 时不写磁盘，直接返回编码后的 bytes
+            preset: 输出编码预设，None 使用默认预设
+
         Returns:
-            生成的图片路径
+            生成的图片路径（save=False 时为图片 bytes）
         """
         from PIL import Image
-        from pathlib import Path
         import random
-        
-        # 1. 创建 McDonald 背景
-        print("🍔 创建 McDonald 背景...")
-        background = create_mcdonald_background(size=(1000, 1250))
-        
+
+        composer = self.meme_generator.composer
+
+        # 1. 获取背景（每个尺寸只渲染一次，合成时不修改底图）
+        print(f"🍔 使用背景: {background_name}")
+        background = self.backgrounds.get(background_name, (1000, 1250))
+
         # 2. 选择 NFT
         if nft_id is None:
-            nft_dir = Path("assets/milady_nfts/images")
-            nft_files = list(nft_dir.glob("milady_*.png"))
-            if nft_files:
-                nft_file = random.choice(nft_files)
+            if composer.nft_list:
+                nft_file = random.choice(composer.nft_list)
                 nft_id = int(nft_file.stem.split('_')[1])
             else:
                 nft_id = random.randint(0, 9999)
-        
+
         print(f"🎨 使用 NFT #{nft_id}")
-        
+
         # 3. 加载 NFT
-        nft_path = Path(f"assets/milady_nfts/images/milady_{nft_id}.png")
+        nft_path = composer.nft_dir / f"milady_{nft_id}.png"
         if not nft_path.exists():
             raise FileNotFoundError(f"NFT #{nft_id} 不存在: {nft_path}")
-        
-        nft_img = Image.open(nft_path).convert('RGBA')
-        
+
+        with Image.open(nft_path) as img:
+            nft_img = img.convert('RGBA')
+
         # 4. 合成 NFT 到背景上
         print("🖼️  合成 NFT 和背景...")
         composite = Image.alpha_composite(background, nft_img)
-        
+
         # 5. 叠加图层（如果有）
         if layers:
-            from src.meme.milady_composer import MiladyComposer
-            composer = MiladyComposer()
-            
             for category, image_names in layers.items():
                 if isinstance(image_names, str):
                     image_names = [image_names]
                 elif not isinstance(image_names, list):
                     continue
-                
+
                 for image_name in image_names:
-                    layer_img = composer.load_layer(category, image_name)
-                    if layer_img:
-                        composite = Image.alpha_composite(composite, layer_img)
+                    if composer.blend_layer(composite, category, image_name):
                         print(f"✅ 叠加 {category}: {image_name}")
-        
+
         # 6. 添加文字（如果有）
         if top_text or bottom_text:
-            from src.meme.caption_meme import CaptionMeme
-            caption = CaptionMeme()
-            composite = caption.add_caption(
+            composite = self.meme_generator.caption.add_caption(
                 composite, top_text, bottom_text,
                 all_caps=all_caps,
                 font_style=font_style
             )
-        
-        # 7. 保存
-        output_dir = Path(output_path).parent
-        output_dir.mkdir(parents=True, exist_ok=True)
-        composite.save(output_path)
-        
+
+        # 7. 不落盘时直接返回编码结果
+        if not save:
+            return encode_image(composite, preset)
+
+        # 8. 保存
+        output_path = save_image(composite, output_path, preset)
         print(f"✅ 图片已保存: {output_path}")
         return output_path
 
@@ -0,0 +1,180 @@
+"""
+Precomputed per-NFT accessory regions
+
+Every Milady is composed from known layer files, so the bounding box of each
+accessory of each token is fixed: it is the alpha bbox of the token's layer.
+The table is built once (scripts/build_accessory_regions.py) from the
+attribute index and the LayerStore, and lookups replace a SAM-2 round-trip
+with an array index.
+
+Storage:
+    cache/accessory_regions/regions.npy  (tokens, types, 4) int16 (x, y, width, height)
+                                         in canvas pixels, -1 = no such accessory
+    cache/accessory_regions/meta.json    {"types": [...], "size": [width, height]}
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+
+# SAMDetector accessory types stored in the table
+REGION_TYPES = ("hat", "glasses", "earrings", "necklace", "face_accessories")
+
+NO_REGION = -1
+
+
+class AccessoryRegionTable:
+    """
+    Accessory bbox of every token, indexed by (token id, accessory type).
+
+    Usage:
+        table = AccessoryRegionTable.shared()
+        region = table.get(5050, "hat", image_size=(1000, 1250))
+    """
+
+    _shared: Dict[str, "AccessoryRegionTable"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, table_dir: str = "cache/accessory_regions", max_tokens: int = 10000,
+                 types: Iterable[str] = REGION_TYPES, canvas_size: Tuple[int, int] = (1000, 1250)):
+        """
+        Args:
+            table_dir: Directory holding regions.npy / meta.json
+            max_tokens: Number of tokens (10,000 for Milady)
+            types: Accessory types of an empty table (a stored table keeps its own)
+            canvas_size: (width, height) the regions of an empty table are measured in
+        """
+        self.table_dir = Path(table_dir)
+        self.max_tokens = max_tokens
+        self.types = list(types)
+        self.canvas_size = (int(canvas_size[0]), int(canvas_size[1]))
+        self.regions = np.full((max_tokens, len(self.types), 4), NO_REGION, dtype=np.int16)
+        self._columns = {accessory_type: col for col, accessory_type in enumerate(self.types)}
+
+        self._load()
+
+    @classmethod
+    def shared(cls, table_dir: str = "cache/accessory_regions") -> "AccessoryRegionTable":
+        """Process-wide table (loaded once)."""
+        key = str(Path(table_dir))
+        with cls._shared_lock:
+            table = cls._shared.get(key)
+            if table is None:
+                table = cls(table_dir)
+                cls._shared[key] = table
+            return table
+
+    @property
+    def regions_path(self) -> Path:
+        return self.table_dir / "regions.npy"
+
+    @property
+    def meta_path(self) -> Path:
+        return self.table_dir / "meta.json"
+
+    def _load(self):
+        """Load the stored table (an absent or damaged table stays empty)."""
+        if not (self.regions_path.exists() and self.meta_path.exists()):
+            return
+
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            regions = np.load(self.regions_path)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  配饰区域表损坏，忽略: {e}")
+            return
+
+        if regions.shape != (self.max_tokens, len(meta["types"]), 4):
+            print(f"⚠️  配饰区域表尺寸不匹配 {regions.shape}，忽略")
+            return
+
+        self.types = list(meta["types"])
+        self.canvas_size = tuple(meta["size"])
+        self.regions = regions
+        self._columns = {accessory_type: col for col, accessory_type in enumerate(self.types)}
+
+    def save(self):
+        """Write the table atomically."""
+        self.table_dir.mkdir(parents=True, exist_ok=True)
+        tmp_regions = self.table_dir / f".regions.{os.getpid()}.tmp.npy"
+        tmp_meta = self.table_dir / f".meta.{os.getpid()}.tmp.json"
+        np.save(tmp_regions, self.regions)
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"types": self.types, "size": list(self.canvas_size)}, f)
+        os.replace(tmp_meta, self.meta_path)
+        os.replace(tmp_regions, self.regions_path)
+
+    def __len__(self) -> int:
+        """Number of tokens with at least one region."""
+        return int(np.count_nonzero((self.regions[:, :, 2] > 0).any(axis=1)))
+
+    def get(self, nft_id: int, accessory_type: str,
+            image_size: Optional[Tuple[int, int]] = None) -> Optional[Tuple[int, int, int, int]]:
+        """
+        Region of one accessory of one token.
+
+        Args:
+            nft_id: Token id
+            accessory_type: SAMDetector accessory type
+            image_size: (width, height) to scale the region to (default: canvas size)
+
+        Returns:
+            (x, y, width, height), or None if unknown or the token has no such accessory
+        """
+        col = self._columns.get(accessory_type)
+        if col is None or not 0 <= nft_id < self.max_tokens:
+            return None
+
+        x, y, w, h = (int(v) for v in self.regions[nft_id, col])
+        if w <= 0:
+            return None
+        if image_size is None or tuple(image_size) == self.canvas_size:
+            return (x, y, w, h)
+
+        sx = image_size[0] / self.canvas_size[0]
+        sy = image_size[1] / self.canvas_size[1]
+        return (round(x * sx), round(y * sy), round(w * sx), round(h * sy))
+
+    def build(self, detector, nft_ids: Iterable[int]) -> Dict[str, int]:
+        """
+        Fill the table from layer alpha.
+
+        Each layer file's bbox is measured once; a token's region is the union of
+        the bboxes of its accessory layers.
+
+        Args:
+            detector: LocalAccessoryDetector (attribute index + LayerStore)
+            nft_ids: Tokens to (re)compute
+
+        Returns:
+            Number of regions found per accessory type
+        """
+        self.canvas_size = tuple(detector.layer_store.target_size)
+        layer_bboxes = {}
+        stats = {accessory_type: 0 for accessory_type in self.types}
+
+        for nft_id in nft_ids:
+            for col, accessory_type in enumerate(self.types):
+                boxes = []
+                for layer in detector.accessory_layers(nft_id, accessory_type):
+                    if layer not in layer_bboxes:
+                        layer_bboxes[layer] = detector.layer_bbox(*layer)
+                    if layer_bboxes[layer] is not None:
+                        boxes.append(layer_bboxes[layer])
+
+                if not boxes:
+                    self.regions[nft_id, col] = NO_REGION
+                    continue
+                boxes = np.array(boxes)
+                x1, y1 = boxes[:, 0].min(), boxes[:, 1].min()
+                x2, y2 = (boxes[:, 0] + boxes[:, 2]).max(), (boxes[:, 1] + boxes[:, 3]).max()
+                self.regions[nft_id, col] = (x1, y1, x2 - x1, y2 - y1)
+                stats[accessory_type] += 1
+
+        return stats
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+异步 Prompt Enhancer - 合并重复请求 + 并发上限 + 截止时间
+
+PromptEnhancer 的 API 调用是阻塞的，直接在飞书请求路径里调用时，
+LLM 一慢整个梗图生成就跟着卡住。这里基于 asyncio 重新封装:
+
+- 合并: 同一个提示词（规范化后相同）的并发请求共用一个进行中的 API 调用
+- 并发上限: asyncio.Semaphore 限制同时进行的 API 调用数量
+- 截止时间: 超过截止时间直接返回原始提示词；进行中的调用不会被取消，
+  完成后写入缓存，下一次请求直接命中
+- 同步调用: 在后台线程里运行一个事件循环，同步代码通过 enhance_sync() 使用
+- 缓存读写: SQLite 查询在线程池中执行，磁盘慢时不会阻塞事件循环上的其他请求
+
+环境变量:
+    PROMPT_ENHANCER_DEADLINE     截止时间（秒，默认 5）
+    PROMPT_ENHANCER_CONCURRENCY  最多同时进行的 API 调用（默认 4）
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import threading
+from typing import Dict, Optional
+
+from anthropic import AsyncAnthropic
+
+from .prompt_enhancer import PromptEnhancer
+
+
+DEFAULT_DEADLINE = float(os.getenv("PROMPT_ENHANCER_DEADLINE", "5"))
+DEFAULT_CONCURRENCY = int(os.getenv("PROMPT_ENHANCER_CONCURRENCY", "4"))
+
+# 单次 API 调用的硬超时（截止时间之后调用仍在后台继续，最多到这个时间）
+API_TIMEOUT = 30.0
+
+
+class AsyncPromptEnhancer:
+    """
+    异步提示词增强客户端
+
+    用法:
+        enhancer = AsyncPromptEnhancer()
+        enhanced = await enhancer.enhance("milady celebrating thanksgiving")
+        # 同步代码中:
+        enhanced = enhancer.enhance_sync("milady celebrating thanksgiving")
+    """
+
+    def __init__(
+        self,
+        enhancer: Optional[PromptEnhancer] = None,
+        client: Optional[AsyncAnthropic] = None,
+        max_concurrency: int = DEFAULT_CONCURRENCY,
+        deadline: float = DEFAULT_DEADLINE,
+    ):
+        """
+        Args:
+            enhancer: 提供系统提示词、模型、缓存的同步增强器（None 时新建一个）
+            client: 异步 Anthropic 客户端（None 时用 enhancer 的 API key 创建；
+                    测试时可以传入指向本地假服务的客户端）
+            max_concurrency: 最多同时进行的 API 调用
+            deadline: 默认截止时间（秒）
+        """
+        self.enhancer = enhancer if enhancer is not None else PromptEnhancer()
+        if client is None and self.enhancer.api_key:
+            client = AsyncAnthropic(api_key=self.enhancer.api_key, timeout=API_TIMEOUT)
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.deadline = deadline
+
+        self.calls = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.failures = 0
+
+        # 以下对象属于运行它们的事件循环，只能在该循环中访问
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+
+    def is_available(self) -> bool:
+        """是否可以调用 API（不可用时只会返回缓存结果或原始提示词）"""
+        return self.client is not None
+
+    async def enhance(
+        self,
+        prompt: str,
+        bypass: bool = False,
+        context: str = "milady meme",
+        deadline: Optional[float] = None
+    ) -> str:
+        """
+        增强提示词（失败或超时返回原始提示词，不抛出异常）
+
+        Args:
+            prompt: 原始用户输入
+            bypass: 是否跳过增强（对应 -raw 标志）
+            context: 上下文类型
+            deadline: 截止时间（秒，None 使用默认值）
+
+        Returns:
+            增强后的提示词
+        """
+        if self.enhancer.should_skip(prompt, bypass):
+            return prompt
+
+        key, cached = await asyncio.to_thread(self.enhancer.lookup_cache, prompt, context)
+        if cached is not None:
+            print(f"⚡ 命中提示词缓存: '{prompt}'")
+            return cached
+
+        if self.client is None:
+            print("⚠️ Prompt Enhancer 不可用，返回原始提示词")
+            return prompt
+
+        # 没有启用缓存时用 (context, prompt) 作为合并的键
+        inflight_key = key or f"{context}\0{prompt}"
+        task = self._inflight.get(inflight_key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, prompt, context))
+            self._inflight[inflight_key] = task
+            task.add_done_callback(lambda done: self._finish(inflight_key, done))
+        else:
+            self.coalesced += 1
+            print(f"🔗 合并进行中的增强请求: '{prompt}'")
+
+        timeout = self.deadline if deadline is None else deadline
+        try:
+            # shield: 某个等待者超时不会取消共享的调用
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            print(f"⏱️ 提示词增强超过 {timeout:.1f}s，使用原始提示词（增强结果稍后写入缓存）")
+            return prompt
+        except Exception as e:
+            print(f"⚠️ 提示词增强失败: {e}")
+            print(f"🔄 返回原始提示词")
+            return prompt
+
+    async def _fetch(self, key: Optional[str], prompt: str, context: str) -> str:
+        """受并发上限约束的一次 API 调用，成功后写入缓存"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self._semaphore:
+            self.calls += 1
+            print(f"🚀 正在增强提示词: '{prompt}'")
+            response = await self.client.messages.create(**self.enhancer.request_params(prompt, context))
+
+        enhanced = response.content[0].text.strip()
+        # 写完缓存才移出进行中的表，之后的请求一定能命中缓存
+        await asyncio.to_thread(self.enhancer.store_cache, key, enhanced, prompt, context)
+        print(f"✅ 增强完成: {enhanced[:100]}...")
+        return enhanced
+
+    def _finish(self, inflight_key: str, task: asyncio.Future):
+        """调用结束: 移出进行中的表，并取走异常（所有等待者都超时后不会再有人读取）"""
+        if self._inflight.get(inflight_key) is task:
+            del self._inflight[inflight_key]
+        if not task.cancelled() and task.exception() is not None:
+            self.failures += 1
+
+    # ------------------------------------------------------------------
+    # 同步调用
+    # ------------------------------------------------------------------
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """启动（只启动一次）运行事件循环的后台线程"""
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever, name="prompt-enhancer-loop", daemon=True
+                )
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+    def enhance_sync(
+        self,
+        prompt: str,
+        bypass: bool = False,
+        context: str = "milady meme",
+        deadline: Optional[float] = None
+    ) -> str:
+        """
+        同步版本的 enhance()，可以在任意线程中调用
+
+        多个线程同时请求同一个提示词时同样只会调用一次 API。
+        """
+        timeout = self.deadline if deadline is None else deadline
+        future = asyncio.run_coroutine_threadsafe(
+            self.enhance(prompt, bypass=bypass, context=context, deadline=timeout),
+            self._ensure_loop()
+        )
+        try:
+            # enhance() 自己会在截止时间返回，这里多留一点余量
+            return future.result(timeout + 1.0)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            self.timeouts += 1
+            return prompt
+
+    def stats(self) -> Dict[str, int]:
+        """API 调用、合并、超时次数"""
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "inflight": len(self._inflight),
+        }
+
+    def close(self):
+        """停止后台事件循环"""
+        with self._loop_lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop = None
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+自定义背景注册表 - 每个尺寸只渲染一次
+
+品牌背景（如 McDonald Logo 平铺）与 NFT、文字无关，只由背景类型和尺寸决定。
+原来每次请求都重新加载 Logo、LANCZOS 缩放再平铺；这里按 (背景, 尺寸) 渲染一次，
+缓存在内存（ByteBudgetLRU）和磁盘（cache/backgrounds）中，之后直接返回同一个底图。
+
+- 注册: register() 把背景名映射到渲染函数，背景名与 PromptParser.BACKGROUND_KEYWORDS 的键一致
+- 失效: 渲染函数版本号或素材文件（路径、大小、修改时间）变化后自动重新渲染
+- 不可变: get() 返回共享的 RGBA 底图，调用方用 Image.alpha_composite() 合成（返回新图），
+          需要原地修改时先 copy()
+
+存储结构:
+    cache/backgrounds/<背景名>/<宽>x<高>-<指纹>.npy  (RGBA uint8)
+"""
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from .cache_utils import ByteBudgetLRU
+from .text_render import load_font
+
+
+ASSET_DIR = Path(__file__).parent.parent.parent / "assets" / "backgrounds"
+
+# 默认内存预算（MB），可通过环境变量调整
+DEFAULT_CACHE_MB = int(os.getenv("MEME_BACKGROUND_CACHE_MB", "64"))
+
+Renderer = Callable[[Tuple[int, int]], Image.Image]
+
+
+class BackgroundSpec:
+    """
+    已注册的背景
+
+    Attributes:
+        name: 背景名（如 "mcdonald"）
+        render: 渲染函数 size -> Image
+        sources: 渲染用到的素材文件（变化后缓存失效）
+        version: 渲染函数的版本号（修改渲染逻辑时递增）
+    """
+
+    __slots__ = ("name", "render", "sources", "version")
+
+    def __init__(self, name: str, render: Renderer, sources: Iterable[Path] = (), version: int = 1):
+        self.name = name
+        self.render = render
+        self.sources = tuple(Path(source) for source in sources)
+        self.version = version
+
+    def fingerprint(self) -> str:
+        """版本号 + 素材文件状态的摘要"""
+        parts = [self.name, str(self.version)]
+        for source in self.sources:
+            try:
+                stat = source.stat()
+                parts.append(f"{source}:{stat.st_size}:{stat.st_mtime_ns}")
+            except OSError:
+                parts.append(f"{source}:missing")
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class BackgroundRegistry:
+    """
+    背景注册表
+
+    用法:
+        registry = BackgroundRegistry.shared()
+        base = registry.get("mcdonald", (1000, 1250))
+        composite = Image.alpha_composite(base, nft_img)
+    """
+
+    _shared: Optional["BackgroundRegistry"] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, cache_dir: str = "cache/backgrounds", max_cache_bytes: Optional[int] = None):
+        """
+        Args:
+            cache_dir: 磁盘缓存目录（None 禁用磁盘缓存）
+            max_cache_bytes: 内存 LRU 的字节预算，None 使用 MEME_BACKGROUND_CACHE_MB
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if max_cache_bytes is None:
+            max_cache_bytes = DEFAULT_CACHE_MB * 1024 * 1024
+        self.cache = ByteBudgetLRU(max_cache_bytes)
+
+        self._specs: Dict[str, BackgroundSpec] = {}
+        self._render_lock = threading.Lock()
+        self.renders = 0
+
+    @classmethod
+    def shared(cls) -> "BackgroundRegistry":
+        """进程内共享的注册表（已注册内置背景）"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                registry = cls()
+                register_builtin_backgrounds(registry)
+                cls._shared = registry
+            return cls._shared
+
+    def register(self, name: str, render: Renderer, sources: Iterable[Path] = (), version: int = 1):
+        """
+        注册背景（同名背景会被替换，旧的内存缓存随之失效）
+
+        Args:
+            name: 背景名，与 PromptParser.BACKGROUND_KEYWORDS 的键一致
+            render: 渲染函数，接收 (width, height)，返回该尺寸的图片
+            sources: 渲染用到的素材文件
+            version: 渲染逻辑的版本号
+        """
+        self._specs[name] = BackgroundSpec(name, render, sources, version)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._specs
+
+    def names(self) -> List[str]:
+        return list(self._specs)
+
+    def get(self, name: str, size: Tuple[int, int] = (1000, 1250)) -> Image.Image:
+        """
+        获取背景底图（内存 → 磁盘 → 渲染）
+
+        Args:
+            name: 背景名
+            size: 尺寸 (width, height)
+
+        Returns:
+            RGBA 底图（共享对象，调用方不要修改）
+        """
+        spec = self._specs.get(name)
+        if spec is None:
+            raise ValueError(f"未知的背景: {name}。支持: {self.names()}")
+
+        size = (int(size[0]), int(size[1]))
+        key = (name, size, spec.fingerprint())
+        img = self.cache.get(key)
+        if img is not None:
+            return img
+
+        with self._render_lock:
+            # 等锁期间其他线程可能已经渲染好了
+            img = self.cache.get(key)
+            if img is not None:
+                return img
+
+            img = self._load(key)
+            if img is None:
+                img = spec.render(size).convert("RGBA")
+                if img.size != size:
+                    img = img.resize(size, Image.Resampling.LANCZOS)
+                self.renders += 1
+                self._save(key, img)
+
+            self.cache.put(key, img, size[0] * size[1] * 4)
+            return img
+
+    def _path(self, key: Tuple) -> Optional[Path]:
+        if self.cache_dir is None:
+            return None
+        name, (width, height), fingerprint = key
+        return self.cache_dir / name / f"{width}x{height}-{fingerprint}.npy"
+
+    def _load(self, key: Tuple) -> Optional[Image.Image]:
+        path = self._path(key)
+        if path is None or not path.exists():
+            return None
+        try:
+            pixels = np.load(path)
+            if pixels.shape != (key[1][1], key[1][0], 4):
+                return None
+            return Image.fromarray(pixels, "RGBA")
+        except (OSError, ValueError) as e:
+            print(f"⚠️  背景缓存损坏，重新渲染: {e}")
+            return None
+
+    def _save(self, key: Tuple, img: Image.Image):
+        """原子写入磁盘缓存，并删除同一尺寸的旧版本"""
+        path = self._path(key)
+        if path is None:
+            return
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.tmp.npy")
+            np.save(tmp_path, np.asarray(img))
+            os.replace(tmp_path, path)
+
+            width, height = key[1]
+            for old in path.parent.glob(f"{width}x{height}-*.npy"):
+                if old != path:
+                    old.unlink()
+        except OSError as e:
+            print(f"⚠️  无法写入背景缓存: {e}")
+
+    def stats(self) -> Dict:
+        """内存缓存的命中率、渲染次数等统计"""
+        stats = self.cache.stats()
+        stats["renders"] = self.renders
+        return stats
+
+
+# ==================== 内置背景 ====================
+
+MCDONALD_LOGO = ASSET_DIR / "mcdonalds_logo.png"
+MCDONALD_RED = (218, 2, 14)
+MCDONALD_YELLOW = (255, 199, 44)
+FALLBACK_FONTS = ("/System/Library/Fonts/Helvetica.ttc", "/System/Library/Fonts/Arial.ttf")
+
+
+def render_mcdonald(size: Tuple[int, int]) -> Image.Image:
+    """
+    McDonald Logo 平铺背景（2 列 x 3 行）
+
+    没有 Logo 素材时退回红底 + 黄色 "M" 平铺。
+    """
+    width, height = size
+
+    if MCDONALD_LOGO.exists():
+        background = Image.new("RGBA", size, (255, 255, 255, 255))
+        tile_width, tile_height = width // 2, height // 3
+        with Image.open(MCDONALD_LOGO) as logo:
+            tile = logo.convert("RGBA").resize((tile_width, tile_height), Image.Resampling.LANCZOS)
+        for row in range(3):
+            for col in range(2):
+                background.alpha_composite(tile, (col * tile_width, row * tile_height))
+        return background
+
+    # 回退方案：红色背景 + 黄色 "M"（字体只加载一次）
+    background = Image.new("RGB", size, MCDONALD_RED)
+    draw = ImageDraw.Draw(background)
+
+    m_width, m_height = width // 3, height // 3
+    font_path = next((path for path in FALLBACK_FONTS if Path(path).exists()), None)
+    font = load_font(font_path, min(m_width, m_height) // 2)
+
+    for x in range(0, width + m_width, m_width):
+        for y in range(0, height + m_height, m_height):
+            draw.text((x + m_width // 2, y + m_height // 2), "M", fill=MCDONALD_YELLOW, font=font, anchor="mm")
+
+    return background.convert("RGBA")
+
+
+def register_builtin_backgrounds(registry: BackgroundRegistry):
+    """注册内置背景（新增品牌背景时在这里注册，并在 PromptParser.BACKGROUND_KEYWORDS 中添加关键词）"""
+    registry.register("mcdonald", render_mcdonald, sources=[MCDONALD_LOGO])
+
+
+def get_background(name: str, size: Tuple[int, int] = (1000, 1250)) -> Image.Image:
+    """从共享注册表获取背景底图（共享对象，调用方不要修改）"""
+    return BackgroundRegistry.shared().get(name, size)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+缓存工具 - 按字节预算淘汰的 LRU 缓存
+供图层缓存、合成中间结果缓存等内存缓存共用
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+
+class ByteBudgetLRU:
+    """
+    按字节预算淘汰的 LRU 缓存（线程安全）
+
+    与 functools.lru_cache 按条目数量限制不同，这里按条目占用的字节数限制，
+    适合缓存大小差异很大的图片数组。
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Args:
+            max_bytes: 缓存总字节上限（<= 0 表示禁用缓存）
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """读取缓存，命中时把条目移到最近使用的位置"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_first(self, keys: Iterable[Hashable]) -> Tuple[Optional[Hashable], Optional[Any]]:
+        """
+        按顺序查找第一个存在的键（只计一次命中或未命中）
+
+        用于"最长前缀"一类的查询：调用方按优先级给出候选键。
+
+        Returns:
+            (命中的键, 值)，全部未命中时返回 (None, None)
+        """
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return key, entry[0]
+            self.misses += 1
+            return None, None
+
+    def put(self, key: Hashable, value: Any, nbytes: int):
+        """
+        写入缓存，超出预算时从最久未使用的条目开始淘汰
+
+        Args:
+            key: 缓存键
+            value: 缓存值
+            nbytes: 该条目占用的字节数
+        """
+        if nbytes > self.max_bytes:
+            # 单个条目超过整个预算，不缓存
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+
+            while self.current_bytes > self.max_bytes and self._entries:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        """清空缓存（保留命中统计）"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        """返回命中率等统计信息"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
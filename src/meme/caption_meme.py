@@ -4,9 +4,30 @@ Caption Meme Generator - 文字梗图生成器
 在图片上添加经典的 meme 文字（上下文字格式）
 """
 
-from PIL import Image, ImageDraw, ImageFont
+import os
+from functools import lru_cache
+from PIL import Image
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Dict, Optional, Tuple
+
+from .cache_utils import ByteBudgetLRU
+from .image_io import save_image
+from .text_layout import TextLayout, fit_text
+from .text_render import draw_sprite, load_font, render_glow_text, render_outlined_text, text_bbox
+
+
+# 文字贴图缓存预算（MB），可通过环境变量调整
+CAPTION_CACHE_MB = int(os.getenv("CAPTION_CACHE_MB", "64"))
+
+
+@lru_cache(maxsize=None)
+def _first_existing_font(font_paths: Tuple[str, ...]) -> Optional[Path]:
+    """按顺序查找第一个存在的字体文件（每组候选路径在进程内只探测一次）"""
+    for font_path in font_paths:
+        font_file = Path(font_path)
+        if font_file.exists():
+            return font_file
+    return None
 
 
 class CaptionMeme:
@@ -62,6 +83,10 @@ class CaptionMeme:
     DEFAULT_FONTS = FONTS["impact"]["paths"]
     CHINESE_FONTS = FONTS["chinese"]["paths"]
 
+    # 进程内共享的文字贴图缓存: (文字, 字体, 字号, 效果参数, 图片宽度) → 贴图
+    # 模板文字（如 "GM BUILDERS / LFG"）重复出现时直接复用
+    caption_cache = ByteBudgetLRU(CAPTION_CACHE_MB * 1024 * 1024)
+
     def __init__(self, font_path: Optional[str] = None, chinese_font_path: Optional[str] = None):
         """
         初始化文字梗图生成器
@@ -101,12 +126,7 @@ class CaptionMeme:
         if font_list is None:
             font_list = self.DEFAULT_FONTS
 
-        for font_path in font_list:
-            font_file = Path(font_path)
-            if font_file.exists():
-                return font_file
-
-        return None
+        return _first_existing_font(tuple(font_list))
 
     def _has_chinese(self, text: str) -> bool:
         """检测文本是否包含中文字符"""
@@ -115,130 +135,95 @@ class CaptionMeme:
                 return True
         return False
 
-    def _calculate_font_size(
+    # 每段文字（顶部 / 底部）可占用的区域，相对图片宽、高
+    CAPTION_BOX_RATIO = (0.9, 0.25)
+
+    def _fit_caption(
         self,
         text: str,
+        font_path: Optional[Path],
         image_width: int,
-        max_width_ratio: float = 0.9
-    ) -> int:
+        image_height: int
+    ) -> TextLayout:
         """
-        根据图片宽度和文字长度计算合适的字体大小
+        自动换行并找到能放进文字框的最大字号（二分查找）
+
+        最大字号为图片宽度的 1/10（短文字保持原来的大小），长文字自动换行、缩小。
 
         Args:
             text: 文字内容
+            font_path: 字体文件路径
             image_width: 图片宽度
-            max_width_ratio: 文字最大占图片宽度的比例
+            image_height: 图片高度
 
         Returns:
-            字体大小（像素）
-        """
-        # 基础字体大小
-        base_size = int(image_width / 10)
-
-        # 根据文字长度调整
-        if len(text) > 20:
-            base_size = int(base_size * 0.8)
-        elif len(text) > 30:
-            base_size = int(base_size * 0.6)
-
-        return max(30, base_size)  # 最小 30px
-
-    def _draw_text_with_outline(
-        self,
-        draw: ImageDraw.ImageDraw,
-        text: str,
-        position: Tuple[int, int],
-        font: ImageFont.FreeTypeFont,
-        text_color: str = "white",
-        outline_color: str = "black",
-        outline_width: int = 3
-    ):
+            TextLayout（换行后的文字和字号）
         """
-        绘制带描边的文字
+        box_width = int(image_width * self.CAPTION_BOX_RATIO[0])
+        box_height = int(image_height * self.CAPTION_BOX_RATIO[1])
+        return fit_text(
+            text,
+            str(font_path) if font_path else None,
+            box_width,
+            box_height,
+            min_size=max(12, image_width // 50),
+            max_size=max(12, image_width // 10)
+        )
 
-        Args:
-            draw: ImageDraw 对象
-            text: 文字内容
-            position: 文字位置 (x, y)
-            font: 字体对象
-            text_color: 文字颜色
-            outline_color: 描边颜色
-            outline_width: 描边宽度
-        """
-        x, y = position
-
-        # 绘制描边（在多个方向绘制黑色文字）
-        for offset_x in range(-outline_width, outline_width + 1):
-            for offset_y in range(-outline_width, outline_width + 1):
-                if offset_x != 0 or offset_y != 0:
-                    draw.text(
-                        (x + offset_x, y + offset_y),
-                        text,
-                        font=font,
-                        fill=outline_color
-                    )
-
-        # 绘制主文字
-        draw.text(position, text, font=font, fill=text_color)
-
-    def _draw_text_with_glow(
+    def _render_caption(
         self,
-        draw: ImageDraw.ImageDraw,
         text: str,
-        position: Tuple[int, int],
-        font: ImageFont.FreeTypeFont,
-        text_color: str = "white",
-        glow_color: str = "#00FFFF",  # 青色发光
-        glow_width: int = 8
-    ):
+        font_path: Optional[Path],
+        font_size: int,
+        use_glow: bool,
+        text_color: str,
+        outline_color: str,
+        outline_width: int,
+        image_width: int,
+        spacing: int = 4
+    ) -> Tuple[Image.Image, int, int, int]:
         """
-        绘制带发光效果的文字
+        渲染一段文字（可以是多行）的贴图（带缓存）
 
-        Args:
-            draw: ImageDraw 对象
-            text: 文字内容
-            position: 文字位置 (x, y)
-            font: 字体对象
-            text_color: 文字颜色
-            glow_color: 发光颜色
-            glow_width: 发光宽度
+        Returns:
+            (RGBA 贴图, padding, 文字宽度, 文字高度)
         """
-        x, y = position
-
-        # Convert glow_color hex to RGB tuple
-        glow_rgb = tuple(int(glow_color.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
-
-        # 1. 先绘制深色阴影（提供对比度）
-        shadow_color = (0, 0, 0, 200)  # 半透明黑色
-        for offset_x in range(-3, 4):
-            for offset_y in range(-3, 4):
-                if offset_x != 0 or offset_y != 0:
-                    draw.text(
-                        (x + offset_x, y + offset_y),
-                        text,
-                        font=font,
-                        fill=shadow_color
-                    )
-
-        # 2. 绘制发光效果（多层渐变）
-        for i in range(glow_width, 0, -1):
-            # 计算透明度（越外层越透明）
-            alpha = int(255 * (1 - i / glow_width))  # 完全不透明到透明的渐变
-            glow_with_alpha = glow_rgb + (alpha,)  # RGBA tuple
-
-            for offset_x in range(-i, i + 1):
-                for offset_y in range(-i, i + 1):
-                    if offset_x != 0 or offset_y != 0:
-                        draw.text(
-                            (x + offset_x, y + offset_y),
-                            text,
-                            font=font,
-                            fill=glow_with_alpha
-                        )
-
-        # 3. 绘制主文字 - 使用发光颜色（完全不透明）
-        main_text_color = glow_rgb + (255,)  # 使用发光颜色作为主文字颜色
-        draw.text(position, text, font=font, fill=main_text_color)
+        font_key = str(font_path) if font_path else None
+        effect = ("glow",) if use_glow else ("outline", text_color, outline_color, outline_width)
+        key = (text, font_key, font_size, effect, image_width, spacing)
+
+        cached = self.caption_cache.get(key)
+        if cached is not None:
+            return cached
+
+        font = load_font(font_key, font_size)
+        bbox = text_bbox(text, font, spacing=spacing)
+
+        if use_glow:
+            # 发光宽度随字号缩放（100px 字号对应 8px 光晕）
+            sprite, padding = render_glow_text(
+                text, font,
+                glow_width=max(2, round(font_size * 0.08)),
+                shadow_width=max(1, round(font_size * 0.03)),
+                spacing=spacing
+            )
+        else:
+            sprite, padding = render_outlined_text(
+                text, font,
+                text_color=text_color,
+                outline_color=outline_color,
+                outline_width=outline_width,
+                spacing=spacing
+            )
+
+        result = (sprite, padding, int(bbox[2] - bbox[0]), int(bbox[3] - bbox[1]))
+        self.caption_cache.put(key, result, sprite.width * sprite.height * 4)
+        return result
+
+    @classmethod
+    def caption_cache_stats(cls) -> Dict:
+        """文字贴图缓存的统计信息（命中率、占用字节等）"""
+        return cls.caption_cache.stats()
 
     def add_caption(
         self,
@@ -271,7 +256,6 @@ class CaptionMeme:
         """
         # 复制图像以避免修改原图
         img = image.copy()
-        draw = ImageDraw.Draw(img)
 
         width, height = img.size
 
@@ -297,67 +281,24 @@ class CaptionMeme:
             selected_font_path = self.font_path
             use_glow = False
 
-        # 处理顶部文字
-        if top_text:
-            font_size = self._calculate_font_size(top_text, width)
-            try:
-                if selected_font_path:
-                    font = ImageFont.truetype(str(selected_font_path), font_size)
-                else:
-                    font = ImageFont.load_default()
-            except Exception as e:
-                font = ImageFont.load_default()
-
-            # 计算文字位置（居中，顶部）
-            bbox = draw.textbbox((0, 0), top_text, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
+        for text, position in ((top_text, "top"), (bottom_text, "bottom")):
+            if not text:
+                continue
 
-            x = (width - text_width) // 2
-            y = height // 20  # 距离顶部 5%
-
-            # 根据字体风格选择绘制方法
-            if use_glow:
-                self._draw_text_with_glow(
-                    draw, top_text, (x, y), font,
-                    text_color=text_color
-                )
-            else:
-                self._draw_text_with_outline(
-                    draw, top_text, (x, y), font,
-                    text_color, outline_color, outline_width
-                )
-
-        # 处理底部文字
-        if bottom_text:
-            font_size = self._calculate_font_size(bottom_text, width)
-            try:
-                if selected_font_path:
-                    font = ImageFont.truetype(str(selected_font_path), font_size)
-                else:
-                    font = ImageFont.load_default()
-            except Exception:
-                font = ImageFont.load_default()
-
-            # 计算文字位置（居中，底部）
-            bbox = draw.textbbox((0, 0), bottom_text, font=font)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
+            layout = self._fit_caption(text, selected_font_path, width, height)
+            sprite, padding, text_width, text_height = self._render_caption(
+                layout.text, selected_font_path, layout.font_size, use_glow,
+                text_color, outline_color, outline_width, width, layout.spacing
+            )
 
+            # 计算文字位置（居中，顶部 / 底部各留 5%）
             x = (width - text_width) // 2
-            y = height - text_height - (height // 20)  # 距离底部 5%
-
-            # 根据字体风格选择绘制方法
-            if use_glow:
-                self._draw_text_with_glow(
-                    draw, bottom_text, (x, y), font,
-                    text_color=text_color
-                )
+            if position == "top":
+                y = height // 20
             else:
-                self._draw_text_with_outline(
-                    draw, bottom_text, (x, y), font,
-                    text_color, outline_color, outline_width
-                )
+                y = height - text_height - (height // 20)
+
+            draw_sprite(img, sprite, (x - padding, y - padding))
 
         return img
 
@@ -367,6 +308,7 @@ class CaptionMeme:
         top_text: str = "",
         bottom_text: str = "",
         output_path: str = "output/meme.png",
+        preset: Optional[str] = None,
         **kwargs
     ) -> str:
         """
@@ -377,6 +319,7 @@ class CaptionMeme:
             top_text: 顶部文字
             bottom_text: 底部文字
             output_path: 输出路径
+            preset: 输出编码预设（fast_png / png / webp / jpeg），None 使用默认预设
             **kwargs: 其他参数传递给 add_caption
 
         Returns:
@@ -389,12 +332,10 @@ class CaptionMeme:
         meme = self.add_caption(img, top_text, bottom_text, **kwargs)
 
         # 保存
-        output_file = Path(output_path)
-        output_file.parent.mkdir(parents=True, exist_ok=True)
-        meme.save(output_file, 'PNG')
+        output_file = save_image(meme, output_path, preset)
 
         print(f"✅ 梗图已保存: {output_file}")
-        return str(output_file)
+        return output_file
 
 
 # 便捷函数
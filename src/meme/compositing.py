@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+NumPy 合成引擎 - 一次性计算整个图层栈的 Porter-Duff "over"
+
+PIL 路径对 N 个图层做 N 次 alpha_composite，每次都生成一张中间画布。
+这里把同一次请求的所有预乘图层叠成一个数组，用一次向量化计算得到结果:
+
+    out = Σ_i C_i · Π_{j>i} (1 - α_j)
+
+其中 C_i 是第 i 层的预乘颜色（含 alpha 通道本身），Π 用逆序累乘一次算出。
+为了控制内存，按行分块计算，并且只计算图层包围盒的并集区域。
+"""
+
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .layer_store import LayerEntry
+
+
+# 每块处理的行数（块越大越快，但内存占用越高）
+BAND_ROWS = 128
+
+
+def image_to_premultiplied(img: Image.Image) -> np.ndarray:
+    """PIL RGBA Image → 预乘 RGBA 数组 (H, W, 4) uint8"""
+    return np.array(img.convert("RGBA").convert("RGBa"))
+
+
+def premultiplied_to_image(pixels: np.ndarray) -> Image.Image:
+    """预乘 RGBA 数组 → 普通 RGBA 的 PIL Image"""
+    height, width = pixels.shape[:2]
+    return Image.frombytes("RGBa", (width, height), np.ascontiguousarray(pixels).tobytes()).convert("RGBA")
+
+
+def _union_bbox(layers: Sequence[LayerEntry]) -> Optional[Tuple[int, int, int, int]]:
+    boxes = [layer.bbox for layer in layers if layer.bbox is not None]
+    if not boxes:
+        return None
+    return (
+        min(box[0] for box in boxes),
+        min(box[1] for box in boxes),
+        max(box[2] for box in boxes),
+        max(box[3] for box in boxes),
+    )
+
+
+def composite_over(
+    base: np.ndarray,
+    layers: Sequence[LayerEntry],
+    band_rows: int = BAND_ROWS,
+) -> np.ndarray:
+    """
+    把图层按顺序 "over" 合成到底图上
+
+    Args:
+        base: 底图，预乘 RGBA (H, W, 4) uint8
+        layers: 从下到上的裁剪图层（LayerEntry，完整尺寸需与底图一致）
+        band_rows: 分块行数
+
+    Returns:
+        合成结果，预乘 RGBA (H, W, 4) uint8（新数组，不修改 base）
+    """
+    result = np.array(base, dtype=np.uint8, copy=True)
+    height, width = result.shape[:2]
+
+    union = _union_bbox(layers)
+    if union is None:
+        return result
+
+    left, top, right, bottom = union
+    right = min(right, width)
+    bottom = min(bottom, height)
+    region_width = right - left
+
+    for band_top in range(top, bottom, band_rows):
+        band_bottom = min(band_top + band_rows, bottom)
+
+        # 只把与当前块相交的图层放进栈（底图永远是第 0 层）
+        band_layers = [
+            layer for layer in layers
+            if layer.bbox is not None
+            and layer.bbox[1] < band_bottom and layer.bbox[3] > band_top
+        ]
+        if not band_layers:
+            continue
+
+        stack = np.zeros((len(band_layers) + 1, band_bottom - band_top, region_width, 4), dtype=np.float32)
+        stack[0] = result[band_top:band_bottom, left:right]
+
+        for i, layer in enumerate(band_layers, start=1):
+            x0, y0, x1, y1 = layer.bbox
+            # 图层与当前块/区域的交集（画布坐标）
+            cy0, cy1 = max(y0, band_top), min(y1, band_bottom)
+            cx0, cx1 = max(x0, left), min(x1, right)
+            stack[i, cy0 - band_top:cy1 - band_top, cx0 - left:cx1 - left] = \
+                layer.pixels[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+
+        # transmittance[i] = Π_{j>i} (1 - α_j)
+        one_minus_alpha = 1.0 - stack[..., 3:4] / 255.0
+        through = np.cumprod(one_minus_alpha[::-1], axis=0)[::-1]
+        transmittance = np.empty_like(through)
+        transmittance[:-1] = through[1:]
+        transmittance[-1] = 1.0
+
+        stack *= transmittance
+        out = stack.sum(axis=0)
+        np.clip(out + 0.5, 0, 255, out=out)
+        result[band_top:band_bottom, left:right] = out.astype(np.uint8)
+
+    return result
+
+
+def composite_image(canvas: Image.Image, layers: Sequence[LayerEntry]) -> Image.Image:
+    """
+    PIL 画布版本的 composite_over
+
+    Args:
+        canvas: 底图（RGBA）
+        layers: 从下到上的裁剪图层
+
+    Returns:
+        新的 RGBA 画布
+    """
+    if not layers:
+        return canvas
+    base = image_to_premultiplied(canvas)
+    return premultiplied_to_image(composite_over(base, layers))
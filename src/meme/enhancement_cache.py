@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+提示词增强结果缓存 - SQLite 持久化
+
+PromptEnhancer 每次调用都要请求 Claude API（几百毫秒到几秒），
+而用户经常发送相同或几乎相同的 prompt（"milady celebrating thanksgiving"）。
+这里按内容寻址缓存增强结果:
+
+    键 = sha256(规范化后的 prompt, context, 模型, 系统提示词的哈希)
+
+- 规范化: Unicode NFKC、忽略大小写、合并空白、去掉首尾标点
+- 过期: 超过 TTL 的条目视为未命中并删除
+- 淘汰: 条目数超过上限时淘汰最久未访问的条目
+- 持久化: 存在 SQLite 文件里，webhook 服务重启后仍然有效
+
+存储位置:
+    cache/prompt_enhancer/cache.sqlite3（环境变量 PROMPT_ENHANCER_CACHE_DB）
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Dict, Optional
+
+
+DEFAULT_DB_PATH = os.getenv("PROMPT_ENHANCER_CACHE_DB", "cache/prompt_enhancer/cache.sqlite3")
+DEFAULT_TTL_HOURS = float(os.getenv("PROMPT_ENHANCER_CACHE_TTL_HOURS", "168"))
+DEFAULT_MAX_ENTRIES = int(os.getenv("PROMPT_ENHANCER_CACHE_MAX_ENTRIES", "10000"))
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# 首尾的标点 / 空白（"gm builders!!" 与 "gm builders" 视为同一个 prompt）
+_EDGE_PUNCTUATION_RE = re.compile(r"^[\W_]+|[\W_]+$")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    规范化 prompt，让几乎相同的输入命中同一个缓存条目
+
+    "  Milady   celebrating Thanksgiving!! " → "milady celebrating thanksgiving"
+    """
+    text = unicodedata.normalize("NFKC", prompt).casefold()
+    text = _WHITESPACE_RE.sub(" ", text)
+    stripped = _EDGE_PUNCTUATION_RE.sub("", text)
+    # 全是标点的 prompt（如 "???"）保留原样
+    return stripped or text.strip()
+
+
+def cache_key(prompt: str, context: str, model: str, system_prompt: str) -> str:
+    """内容寻址的缓存键（系统提示词变化后旧条目自然失效）"""
+    system_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    payload = json.dumps([normalize_prompt(prompt), context, model, system_hash], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class EnhancementCache:
+    """
+    提示词增强结果的 SQLite 缓存（线程安全，多进程共享同一个文件也安全）
+
+    用法:
+        cache = EnhancementCache()
+        key = cache_key(prompt, context, model, system_prompt)
+        enhanced = cache.get(key)
+        if enhanced is None:
+            enhanced = call_api(...)
+            cache.put(key, enhanced, prompt=prompt, context=context, model=model)
+    """
+
+    def __init__(
+        self,
+        db_path: str = DEFAULT_DB_PATH,
+        ttl_hours: float = DEFAULT_TTL_HOURS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        """
+        Args:
+            db_path: SQLite 文件路径（":memory:" 为纯内存缓存）
+            ttl_hours: 条目有效期（小时，<= 0 表示永不过期）
+            max_entries: 最多保留的条目数
+        """
+        self.db_path = db_path
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        if db_path != ":memory:":
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        # webhook 服务在多个线程里调用，用一个连接 + 锁串行化访问
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL 下 NORMAL 不会损坏数据库，只可能丢失最近的少量写入，对缓存足够
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS enhancements (
+                key TEXT PRIMARY KEY,
+                prompt TEXT NOT NULL,
+                context TEXT NOT NULL,
+                model TEXT NOT NULL,
+                enhanced TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_enhancements_accessed ON enhancements (accessed_at)"
+        )
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        读取缓存，命中时更新访问时间
+
+        Returns:
+            增强后的提示词，未命中或已过期时返回 None
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT enhanced, created_at FROM enhancements WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            enhanced, created_at = row
+            if self._is_expired(created_at, now):
+                self._conn.execute("DELETE FROM enhancements WHERE key = ?", (key,))
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE enhancements SET accessed_at = ?, hits = hits + 1 WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+            return enhanced
+
+    def put(self, key: str, enhanced: str, prompt: str = "", context: str = "", model: str = ""):
+        """
+        写入缓存，超过条目上限时淘汰最久未访问的条目
+
+        Args:
+            key: cache_key() 生成的键
+            enhanced: 增强后的提示词
+            prompt / context / model: 原始信息（只用于排查，不参与查找）
+        """
+        if self.max_entries <= 0:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO enhancements
+                    (key, prompt, context, model, enhanced, created_at, accessed_at, hits)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+                """,
+                (key, prompt, context, model, enhanced, now, now),
+            )
+
+            count = self._conn.execute("SELECT COUNT(*) FROM enhancements").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    """
+                    DELETE FROM enhancements WHERE key IN (
+                        SELECT key FROM enhancements ORDER BY accessed_at LIMIT ?
+                    )
+                    """,
+                    (overflow,),
+                )
+                self.evictions += overflow
+
+    def purge_expired(self) -> int:
+        """删除所有过期条目，返回删除数量"""
+        if self.ttl_seconds <= 0:
+            return 0
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM enhancements WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            )
+            self.expired += cursor.rowcount
+            return cursor.rowcount
+
+    def clear(self):
+        """清空缓存（保留命中统计）"""
+        with self._lock:
+            self._conn.execute("DELETE FROM enhancements")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM enhancements").fetchone()[0]
+
+    def stats(self) -> Dict[str, float]:
+        """
+        返回命中率等统计信息
+
+        hits / misses / hit_rate 是本进程的统计，lifetime_hits 是数据库中所有条目累计的命中次数
+        """
+        with self._lock:
+            entries, lifetime_hits = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM enhancements"
+            ).fetchone()
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+            "lifetime_hits": lifetime_hits,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -11,13 +11,19 @@ import requests
 from io import BytesIO
 from typing import Optional, Dict, Tuple
 
-from .sam_detector import SAMDetector
+from .accessory_regions import AccessoryRegionTable
+from .local_detector import LocalAccessoryDetector
+from .sam_detector import SAMDetector, mask_image
+from .sam_mask_cache import nft_id_from_path
 
 
 class FluxFillPro:
     """FLUX Fill Pro 配饰替换引擎"""
 
-    # 预定义配饰区域（基于标准 Milady NFT 结构）
+    # ACCESSORY_REGIONS 的坐标系（宽 500 的 Milady，NFT 原图是 1000x1250）
+    REGION_BASE_SIZE = (500, 625)
+
+    # 预定义配饰区域（基于标准 Milady NFT 结构，坐标见 REGION_BASE_SIZE）
     ACCESSORY_REGIONS = {
         "hat": {
             "region": (100, 30, 300, 180),  # (x, y, width, height)
@@ -68,6 +74,10 @@ class FluxFillPro:
         # 设置环境变量
         os.environ["REPLICATE_API_TOKEN"] = self.api_token
 
+        # 预计算的每个 NFT 的配饰区域（scripts/build_accessory_regions.py）
+        self.region_table = AccessoryRegionTable.shared()
+        self._local_detector = None
+
         # SAM 检测器
         self.use_sam = use_sam
         self.sam_detector = SAMDetector() if use_sam else None
@@ -91,6 +101,26 @@ class FluxFillPro:
         self.use_sam = False
         print("ℹ️  SAM 自动检测已禁用（但检测器仍保留）")
 
+    @property
+    def local_detector(self) -> LocalAccessoryDetector:
+        """图层 alpha 检测器（预计算区域的像素级遮罩；有 SAM 检测器时共用同一个）"""
+        if self.sam_detector is not None:
+            return self.sam_detector.local_detector
+        if self._local_detector is None:
+            self._local_detector = LocalAccessoryDetector()
+        return self._local_detector
+
+    def predefined_region(
+        self,
+        accessory_type: str,
+        image_size: Tuple[int, int]
+    ) -> Optional[Tuple[int, int, int, int]]:
+        """预定义区域换算到图片尺寸后的 (x, y, width, height)，未知类型返回 None"""
+        config = self.ACCESSORY_REGIONS.get(accessory_type)
+        if config is None:
+            return None
+        return self._scale_region(config["region"], self.REGION_BASE_SIZE, image_size)
+
     def create_mask(
         self,
         image_size: Tuple[int, int],
@@ -124,6 +154,36 @@ class FluxFillPro:
 
         return mask
 
+    def create_pixel_mask(
+        self,
+        pixel_mask: Image.Image,
+        grow: int = 6,
+        feather: int = 3
+    ) -> Image.Image:
+        """
+        由 SAM 的像素级遮罩创建 FLUX 遮罩
+
+        向外扩张 grow 像素（覆盖抗锯齿边缘和阴影），再羽化边缘。
+        比矩形遮罩更贴合配饰轮廓，周围的头发、皮肤不会被重绘。
+
+        Args:
+            pixel_mask: 'L' 遮罩（255=配饰）
+            grow: 向外扩张的像素
+            feather: 羽化边缘像素
+
+        Returns:
+            遮罩图像（白色=要修改的区域，黑色=保留的区域）
+        """
+        from PIL import ImageFilter
+
+        mask = pixel_mask.convert('L')
+        if grow > 0:
+            # 最大值滤波 = 膨胀 grow 像素
+            mask = mask.filter(ImageFilter.MaxFilter(2 * grow + 1))
+        if feather > 0:
+            mask = mask.filter(ImageFilter.GaussianBlur(radius=feather))
+        return mask
+
     def replace_accessory(
         self,
         image_path: str,
@@ -133,7 +193,8 @@ class FluxFillPro:
         guidance: float = 30.0,
         num_inference_steps: int = 28,
         custom_region: Optional[Tuple[int, int, int, int]] = None,
-        force_sam: Optional[bool] = None
+        force_sam: Optional[bool] = None,
+        nft_id: Optional[int] = None
     ) -> str:
         """
         替换配饰
@@ -146,7 +207,10 @@ class FluxFillPro:
             guidance: 引导强度 (推荐 20-40)
             num_inference_steps: 推理步数 (推荐 20-40)
             custom_region: 自定义区域 (x, y, width, height)
+                          （优先级: 自定义区域 → 预计算区域表 → SAM → 预定义区域）
             force_sam: 强制使用/不使用 SAM（None=使用初始化设置）
+            nft_id: 图片对应的 NFT 编号（未修改过的原版 NFT 才传；用于预计算区域表、
+                    SAM 缓存和离线检测，None 时从 milady_<id>.png 文件名推断）
 
         Returns:
             生成图片的路径
@@ -171,29 +235,43 @@ class FluxFillPro:
         # 决定是否使用 SAM
         use_sam_for_this_call = force_sam if force_sam is not None else self.use_sam
 
-        # 获取区域
+        # 获取区域（预计算区域、SAM 检测到时还有像素级遮罩）
+        pixel_mask = None
+        if nft_id is None:
+            nft_id = nft_id_from_path(image_path)
+        precomputed = self.region_table.get(nft_id, accessory_type, image_size) if nft_id is not None else None
         if custom_region:
             region = custom_region
             print(f"   使用自定义区域: {region}")
+        elif precomputed is not None:
+            # 原版 NFT：直接查表，遮罩取配饰图层的 alpha，不需要 SAM
+            region = precomputed
+            pixel_mask = mask_image(self.local_detector.pixels(nft_id, accessory_type, image_size))
+            print(f"   使用预计算区域 (NFT #{nft_id}): {region}")
         elif use_sam_for_this_call and self.sam_detector:
             # 使用 SAM 自动检测
             print(f"   🔍 使用 SAM 自动检测配饰区域...")
-            predefined = self.ACCESSORY_REGIONS.get(accessory_type, {}).get("region")
-            region = self.sam_detector.detect_accessory(
+            predefined = self.predefined_region(accessory_type, image_size)
+            region, pixel_mask = self.sam_detector.detect_accessory_mask(
                 image_path=image_path,
                 accessory_type=accessory_type,
-                predefined_region=predefined
+                predefined_region=predefined,
+                nft_id=nft_id
             )
             if region is None:
                 raise ValueError(f"SAM 未能检测到 {accessory_type}，且无预定义区域")
         elif accessory_type in self.ACCESSORY_REGIONS:
-            region = self.ACCESSORY_REGIONS[accessory_type]["region"]
+            region = self.predefined_region(accessory_type, image_size)
             print(f"   使用预定义区域: {region}")
         else:
             raise ValueError(f"未知的配饰类型: {accessory_type}。支持: {list(self.ACCESSORY_REGIONS.keys())}")
 
         # 创建遮罩
-        mask = self.create_mask(image_size, region, feather=5)
+        if pixel_mask is not None:
+            print(f"   使用 SAM 像素级遮罩")
+            mask = self.create_pixel_mask(pixel_mask)
+        else:
+            mask = self.create_mask(image_size, region, feather=5)
 
         # 保存临时文件（FLUX Fill Pro 需要 URL 或文件）
         temp_image_path = "/tmp/flux_input_image.png"
@@ -245,7 +323,8 @@ class FluxFillPro:
         self,
         image_path: str,
         replacements: Dict[str, str],
-        output_path: str
+        output_path: str,
+        nft_id: Optional[int] = None
     ) -> str:
         """
         批量替换多个配饰
@@ -254,6 +333,7 @@ class FluxFillPro:
             image_path: 原始图片路径
             replacements: 配饰替换字典 {accessory_type: new_description}
             output_path: 输出路径
+            nft_id: 原图对应的 NFT 编号（见 replace_accessory）
 
         Returns:
             最终图片路径
@@ -273,16 +353,42 @@ class FluxFillPro:
 
         print(f"🔄 批量替换 {len(replacements)} 个配饰...")
 
+        # SAM 只在原图上运行一次，一次算出所有配饰的区域
+        # （第一步的输入就是原图，由 replace_accessory 取像素级遮罩，SAM 结果已在缓存中；
+        # 之后每一步的输入是上一步的输出，不再重新检测，用原图上的区域画矩形遮罩）
+        regions = {}
+        original_size = Image.open(image_path).size
+        if self.use_sam and self.sam_detector:
+            predefined = {
+                accessory_type: self.predefined_region(accessory_type, original_size)
+                for accessory_type in replacements if accessory_type in self.ACCESSORY_REGIONS
+            }
+            regions = self.sam_detector.detect_all(image_path, list(replacements), predefined, nft_id=nft_id)
+
         for i, (accessory_type, description) in enumerate(replacements.items(), 1):
             print(f"\n--- 第 {i}/{len(replacements)} 个配饰 ---")
             temp_output = f"/tmp/flux_batch_{i}.png"
 
-            self.replace_accessory(
-                image_path=current_image,
-                accessory_type=accessory_type,
-                new_description=description,
-                output_path=temp_output
-            )
+            if current_image == image_path:
+                # 原图：预计算区域表 / SAM 像素级遮罩 / 图层 alpha 都可用
+                self.replace_accessory(
+                    image_path=current_image,
+                    accessory_type=accessory_type,
+                    new_description=description,
+                    output_path=temp_output,
+                    nft_id=nft_id
+                )
+            else:
+                region = regions.get(accessory_type)
+                if region is not None:
+                    region = self._scale_region(region, original_size, Image.open(current_image).size)
+                self.replace_accessory(
+                    image_path=current_image,
+                    accessory_type=accessory_type,
+                    new_description=description,
+                    output_path=temp_output,
+                    custom_region=region
+                )
 
             current_image = temp_output
             temp_outputs.append(temp_output)
@@ -296,6 +402,20 @@ class FluxFillPro:
 
         return output_path
 
+    @staticmethod
+    def _scale_region(
+        region: Tuple[int, int, int, int],
+        from_size: Tuple[int, int],
+        to_size: Tuple[int, int]
+    ) -> Tuple[int, int, int, int]:
+        """把区域 (x, y, width, height) 从一个图片尺寸换算到另一个尺寸"""
+        if tuple(from_size) == tuple(to_size):
+            return region
+        sx = to_size[0] / from_size[0]
+        sy = to_size[1] / from_size[1]
+        x, y, w, h = region
+        return (round(x * sx), round(y * sy), round(w * sx), round(h * sy))
+
     def visualize_regions(
         self,
         image_path: str,
@@ -314,8 +434,8 @@ class FluxFillPro:
         image = Image.open(image_path)
         draw = ImageDraw.Draw(image)
 
-        for accessory_type, config in self.ACCESSORY_REGIONS.items():
-            x, y, w, h = config["region"]
+        for accessory_type in self.ACCESSORY_REGIONS:
+            x, y, w, h = self.predefined_region(accessory_type, image.size)
             # 绘制矩形边框
             draw.rectangle([x, y, x + w, y + h], outline="red", width=3)
             # 添加标签
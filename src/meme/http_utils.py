@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+HTTP 工具 - 带连接池和重试的 keep-alive 会话
+供 memegen 客户端、SAM 掩码下载等共用
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def create_session(pool_size: int = 8, pool_connections: int = 4) -> requests.Session:
+    """
+    创建带连接池和重试的 keep-alive 会话
+
+    GET 请求遇到 502 / 503 / 504 或连接错误时最多重试 2 次（指数退避）。
+
+    Args:
+        pool_size: 每个主机最多保持的连接数（并发请求的线程数）
+        pool_connections: 最多为几个主机保留连接池
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=2,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=("GET",),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+图片编码工具 - 按预设把 PIL Image 编码为 PNG / WebP / JPEG
+
+生成结果可以直接交给上传接口，不必先写文件再读回来。
+
+预设:
+    fast_png  PNG compress_level=1，编码最快，文件稍大（默认）
+    png       PNG optimize=True，文件最小的无损格式，编码最慢
+    webp      有损 WebP quality=85，体积约为 PNG 的 1/10
+    jpeg      JPEG quality=85，适合聊天预览
+
+可通过环境变量 MEME_OUTPUT_PRESET 修改默认预设。
+"""
+
+import io
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+from PIL import Image
+
+
+OUTPUT_PRESETS: Dict[str, Dict] = {
+    "fast_png": {
+        "format": "PNG",
+        "params": {"compress_level": 1},
+        "description": "快速 PNG（低压缩级别）",
+    },
+    "png": {
+        "format": "PNG",
+        "params": {"optimize": True},
+        "description": "优化 PNG（最小无损体积）",
+    },
+    "webp": {
+        "format": "WEBP",
+        "params": {"quality": 85, "method": 4},
+        "description": "有损 WebP",
+    },
+    "jpeg": {
+        "format": "JPEG",
+        "params": {"quality": 85, "optimize": True},
+        "description": "JPEG（聊天预览）",
+    },
+}
+
+# 预设别名（预设名不区分大小写，"PNG" 等同于 "png"）
+PRESET_ALIASES = {
+    "jpg": "jpeg",
+}
+
+DEFAULT_PRESET = os.getenv("MEME_OUTPUT_PRESET", "fast_png")
+
+MIME_TYPES = {
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "JPEG": "image/jpeg",
+}
+
+EXTENSIONS = {
+    "PNG": ".png",
+    "WEBP": ".webp",
+    "JPEG": ".jpg",
+}
+
+# 文件扩展名 → 格式（保存时扩展名与预设格式一致则保留原扩展名）
+SUFFIX_FORMATS = {
+    ".png": "PNG",
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".webp": "WEBP",
+}
+
+
+def resolve_preset(preset: Optional[str] = None) -> str:
+    """规范化预设名（None 使用默认预设），未知预设抛出 ValueError"""
+    name = (preset or DEFAULT_PRESET).lower().lstrip(".")
+    name = PRESET_ALIASES.get(name, name)
+    if name not in OUTPUT_PRESETS:
+        raise ValueError(f"未知的输出预设: {preset}。支持: {list(OUTPUT_PRESETS)}")
+    return name
+
+
+def preset_format(preset: Optional[str] = None) -> str:
+    """预设对应的 PIL 格式名"""
+    return OUTPUT_PRESETS[resolve_preset(preset)]["format"]
+
+
+def mime_type(preset: Optional[str] = None) -> str:
+    """预设对应的 MIME 类型"""
+    return MIME_TYPES[preset_format(preset)]
+
+
+def extension(preset: Optional[str] = None) -> str:
+    """预设对应的文件扩展名"""
+    return EXTENSIONS[preset_format(preset)]
+
+
+def detect_format(data: bytes) -> Optional[str]:
+    """根据文件头判断已编码图片的格式（"PNG" / "WEBP" / "JPEG"），无法识别返回 None"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "PNG"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "WEBP"
+    if data[:3] == b"\xff\xd8\xff":
+        return "JPEG"
+    return None
+
+
+def strip_alpha_if_opaque(img: Image.Image) -> Image.Image:
+    """
+    完全不透明的图片去掉 alpha 通道
+
+    合成结果大多是不透明的，RGBA → RGB 让编码数据量减少 1/4。
+    """
+    if img.mode in ("RGBA", "LA") and img.getchannel("A").getextrema()[0] == 255:
+        return img.convert(img.mode[:-1])
+    return img
+
+
+def _prepare(img: Image.Image, image_format: str) -> Image.Image:
+    img = strip_alpha_if_opaque(img)
+    # JPEG 不支持透明通道
+    if image_format == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    return img
+
+
+def encode_image(img: Image.Image, preset: Optional[str] = None) -> bytes:
+    """
+    按预设把图片编码为 bytes
+
+    Args:
+        img: PIL Image
+        preset: 预设名（"fast_png" / "png" / "webp" / "jpeg"），None 使用默认预设
+
+    Returns:
+        编码后的图片数据
+    """
+    config = OUTPUT_PRESETS[resolve_preset(preset)]
+    buffer = io.BytesIO()
+    _prepare(img, config["format"]).save(buffer, format=config["format"], **config["params"])
+    return buffer.getvalue()
+
+
+def save_image(img: Image.Image, output_path: str, preset: Optional[str] = None) -> str:
+    """
+    按预设保存图片
+
+    文件扩展名与预设格式不一致时会替换扩展名（如 meme.png + webp → meme.webp）。
+
+    Args:
+        img: PIL Image
+        output_path: 输出路径
+        preset: 预设名，None 使用默认预设
+
+    Returns:
+        实际写入的文件路径
+    """
+    config = OUTPUT_PRESETS[resolve_preset(preset)]
+    path = Path(output_path)
+    if SUFFIX_FORMATS.get(path.suffix.lower()) != config["format"]:
+        path = path.with_suffix(EXTENSIONS[config["format"]])
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _prepare(img, config["format"]).save(path, format=config["format"], **config["params"])
+    return str(path)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+多关键词匹配器 - Aho-Corasick 自动机
+
+把所有关键词编译成一个自动机，对文字只扫描一遍就能找出所有关键词的所有出现位置
+（包括互相重叠、互为子串的关键词）。扫描耗时只和文字长度、命中数量有关，
+与关键词表的大小无关。
+
+用法:
+    matcher = KeywordMatcher(["麦当劳", "麦当劳打工", "枪"])
+    matcher.find_all("在麦当劳打工拿着枪")
+    # [(1, 4, "麦当劳"), (1, 6, "麦当劳打工"), (8, 9, "枪")]
+"""
+
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick 多模式匹配（区分大小写，需要忽略大小写时由调用方先转小写）
+
+    Attributes:
+        keywords: 去重后的关键词（保持传入顺序）
+    """
+
+    __slots__ = ("keywords", "_goto", "_fail", "_output")
+
+    def __init__(self, keywords: Iterable[str]):
+        """
+        Args:
+            keywords: 关键词（重复的、空字符串会被忽略）
+        """
+        self.keywords: Tuple[str, ...] = tuple(k for k in dict.fromkeys(keywords) if k)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 每个状态结束的关键词，按长度从长到短
+        self._output: List[Tuple[str, ...]] = [()]
+
+        for keyword in self.keywords:
+            self._insert(keyword)
+        self._build_failure_links()
+
+    def _insert(self, keyword: str):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = next_state
+        self._output[state] = (keyword,)
+
+    def _build_failure_links(self):
+        """BFS 构建失配指针，并把后缀状态的输出合并进来"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                # 失配状态一定更浅，已经处理过，输出已经完整
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+                queue.append(child)
+
+    def find_all(self, text: str) -> List[Tuple[int, int, str]]:
+        """
+        找出所有关键词的所有出现位置
+
+        Returns:
+            [(start, end, keyword), ...]，按 end 升序；同一个 end 上长的关键词在前。
+            text[start:end] == keyword
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        matches = []
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for keyword in output[state]:
+                matches.append((index + 1 - len(keyword), index + 1, keyword))
+        return matches
+
+    def find_longest(
+        self,
+        text: str,
+        accept: Optional[Callable[[int, int, str], bool]] = None,
+    ) -> List[Tuple[int, int, str]]:
+        """
+        最左最长匹配：互相重叠的命中只保留起点最靠左、其次最长的一个
+
+        "在麦当劳打工" → [(1, 6, "麦当劳打工")]（不再单独返回 "麦当劳"）
+
+        Args:
+            text: 文字
+            accept: 只在 accept(start, end, keyword) 为真的命中里选择，
+                被拒绝的长匹配不会挡住同一位置较短的匹配
+
+        Returns:
+            [(start, end, keyword), ...]，按位置排列且互不重叠
+        """
+        matches = self.find_all(text)
+        if accept is not None:
+            matches = [match for match in matches if accept(*match)]
+
+        selected = []
+        last_end = 0
+        for start, end, keyword in sorted(matches, key=lambda m: (m[0], -m[1])):
+            if start >= last_end:
+                selected.append((start, end, keyword))
+                last_end = end
+        return selected
+
+    def found(self, text: str) -> Set[str]:
+        """文字中出现过的关键词集合"""
+        return {keyword for _, _, keyword in self.find_all(text)}
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    def __repr__(self) -> str:
+        return f"KeywordMatcher({len(self.keywords)} keywords, {len(self._goto)} states)"
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+图层名搜索索引 - 把任意描述解析为 "类别:文件名.png"
+
+PromptParser.COMMON_LAYERS 只收录了几十个手写短语，而 layer_config.json 有 300 多个图层。
+这里对所有图层文件名建立索引:
+
+- 词: "Brown Cowboy Hat.png" → brown / cowboy / hat（加上类别名，"100Crazy" 拆成 100 / crazy）
+- 中文: 常见中文词先翻译成英文词（"粉色蝴蝶结" → pink bow），另有整词别名（"渔夫帽"）
+- 模糊: 词表中每个词的字符三元组，拼错的词纠正为最相近的词（"cowbow" → cowboy）
+
+查询只访问倒排表命中的少量候选，耗时远小于 1 ms。
+
+索引缓存在 cache/layer_index/index.json，只有 layer_config.json（或本模块的词表）
+变化时才重新构建。
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .keyword_matcher import KeywordMatcher
+
+
+INDEX_VERSION = 1
+
+# 中文词 → 英文词（查询时按最长匹配切分后翻译）
+CHINESE_TOKENS = {
+    # 类别
+    "帽子": "hat", "帽": "hat", "眼镜": "glasses", "墨镜": "sunglasses", "太阳镜": "sunglasses",
+    "耳环": "earring", "耳饰": "earring", "耳钉": "stud", "项链": "necklace", "颈链": "necklace",
+    "衣服": "shirt", "衬衫": "shirt", "上衣": "shirt", "头发": "hair", "发型": "hair",
+    "眉毛": "brows", "眼睛": "eyes", "嘴": "mouth", "背景": "background", "纹身": "tattoo",
+    "贴纸": "sticker",
+    # 颜色
+    "黑色": "black", "白色": "white", "蓝色": "blue", "粉色": "pink", "粉红": "pink",
+    "绿色": "green", "紫色": "purple", "棕色": "brown", "金色": "gold", "银色": "silver",
+    "橙色": "orange", "黄色": "yellow", "灰色": "grey", "红色": "red", "金发": "blonde",
+    # 物品 / 款式
+    "牛仔": "cowboy", "贝雷": "beret", "蝴蝶结": "bow", "发带": "headband", "头巾": "bandana",
+    "耳罩": "earmuffs", "猫耳": "cat ears", "熊": "bear", "猫": "cat", "兔": "bunny",
+    "草莓": "strawberry", "樱桃": "cherry", "蛋糕": "cake", "汉堡": "burger", "香蕉": "banana",
+    "花": "flower", "爱心": "heart", "心": "heart", "星星": "stars", "星": "star",
+    "十字架": "cross", "珍珠": "pearl", "链条": "chain", "鼻环": "nose ring", "唇钉": "snakebites",
+    "夹克": "jacket", "毛衣": "sweater", "外套": "coat", "背心": "tank", "卫衣": "hoodie",
+    "西装": "blazer", "开衫": "cardigan", "羽绒服": "puffer", "女仆": "maid", "水手": "sailor",
+    "狙击": "sniper", "祈祷": "prayer", "生日": "birthday", "派对": "party", "对话框": "chat bubble",
+    "光环": "halo", "双马尾": "braid", "辫子": "braid", "短发": "short", "锅盖头": "bowl",
+    "微笑": "smile", "抽烟": "smoking", "吸管": "straw", "吸血鬼": "vamp", "哭": "crying",
+    "流泪": "teary", "闭眼": "closed", "困": "sleepy", "螺旋": "spiral", "闪亮": "sparkle",
+    "腮红": "blush", "雀斑": "freckles", "外星人": "alien",
+}
+
+# 中文整词别名 → 图层（不与 PromptParser.COMMON_LAYERS 重复）
+CHINESE_ALIASES = {
+    "渔夫帽": "Hat:Buckethat.png",
+    "鸭舌帽": "Hat:Blue Cap.png",
+    "猫耳朵": "Hat:Cat Ears with Bell.png",
+    "熊耳朵": "Hat:Bear Ears.png",
+    "女仆帽": "Hat:Maid Hat.png",
+    "水手帽": "Hat:Sailor Hat.png",
+    "草莓帽": "Hat:Strawberry Hat.png",
+    "耳机": "Hat:Kossphones.png",
+    "以太坊项链": "Necklaces:ETH Necklace.png",
+    "珍珠项链": "Necklaces:Mestwood Pearl Necklace.png",
+    "樱桃项链": "Necklaces:Cherry Necklace.png",
+    "女仆装": "Shirt:Maid.png",
+    "派对帽子": "Overlay:Party Hat.png",
+    "狙击枪": "Overlay:Sniper.png",
+    "取消": "Overlay:Cancelled.png",
+}
+
+# 单个词的图层名（如 "Beret"）只在这些类别里当作 prompt 中的图层提及，
+# 其他类别的单词名太常见（"Milady"、"Orange"、"Sunset"），需要通过 search() 显式查询
+SINGLE_WORD_MENTION_CATEGORIES = ("Hat", "Glasses", "Earrings", "Necklaces", "Face Decoration", "Neck")
+
+# 拼错的词纠正时要求的最低三元组相似度
+MIN_TRIGRAM_SIMILARITY = 0.35
+
+_SPLIT_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+|[^\W\d_A-Za-z]+")
+_WORD_CHAR_RE = re.compile(r"\w")
+# 查询中没有翻译的中日韩文字（图层名都是英文，这些字不可能匹配）
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    把英文名字拆成小写词（按空格、大小写变化、数字边界）
+
+    "100Crazy" → ["100", "crazy"]，"ETH Necklace" → ["eth", "necklace"]
+    """
+    return [normalize_token(token) for token in _SPLIT_RE.findall(text)]
+
+
+def normalize_token(token: str) -> str:
+    """小写 + 去掉简单复数（两边都做同样处理，不要求是真正的词干）"""
+    token = token.lower()
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        token = token[:-1]
+    return token
+
+
+def trigrams(token: str) -> set:
+    """词的字符三元组（首尾加边界符，"hat" → ^ha / hat / at$）"""
+    padded = f"^{token}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class LayerMatch:
+    """
+    搜索结果
+
+    Attributes:
+        key: "类别:文件名.png"
+        score: 0~1，越大越相关
+    """
+
+    __slots__ = ("key", "score")
+
+    def __init__(self, key: str, score: float):
+        self.key = key
+        self.score = score
+
+    @property
+    def category(self) -> str:
+        return self.key.split(":", 1)[0]
+
+    @property
+    def filename(self) -> str:
+        return self.key.split(":", 1)[1]
+
+    def __repr__(self) -> str:
+        return f"LayerMatch({self.key!r}, score={self.score:.2f})"
+
+
+class LayerIndex:
+    """
+    图层名搜索索引
+
+    用法:
+        index = LayerIndex.load()
+        index.search("brown cowboy hat")[0].key   # "Hat:Brown Cowboy Hat.png"
+        index.find_mentions("戴着渔夫帽和 cherry necklace")
+    """
+
+    def __init__(
+        self,
+        layers: List[str],
+        names: List[str],
+        tokens: List[List[str]],
+        token_grams: Dict[str, List[str]],
+        phrases: Dict[str, str],
+        config_hash: str = "",
+    ):
+        """
+        通常通过 build() / load() 创建
+
+        Args:
+            layers: ["类别:文件名.png", ...]（按 layer_config.json 的顺序）
+            names: 每个图层规范化后的名字（"brown cowboy hat"）
+            tokens: 每个图层的词（名字 + 类别）
+            token_grams: 词表中每个词的字符三元组
+            phrases: prompt 中可以直接识别的短语 → 图层
+            config_hash: 构建时的配置哈希（用于判断磁盘缓存是否过期）
+        """
+        self.layers = list(layers)
+        self.names = list(names)
+        self.config_hash = config_hash
+
+        self._positions = {key: layer_id for layer_id, key in enumerate(self.layers)}
+        self._tokens = [tuple(layer_tokens) for layer_tokens in tokens]
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        self._exact: Dict[str, int] = {}
+        for layer_id in range(len(self.layers)):
+            for token in self._tokens[layer_id]:
+                self._postings[token].append(layer_id)
+            self._exact.setdefault(self.names[layer_id], layer_id)
+
+        self._token_grams = {token: set(grams) for token, grams in token_grams.items()}
+        self._gram_postings: Dict[str, List[str]] = defaultdict(list)
+        for token, grams in self._token_grams.items():
+            for gram in grams:
+                self._gram_postings[gram].append(token)
+
+        self._mention_phrases = dict(phrases)
+        self._chinese_matcher = KeywordMatcher(CHINESE_TOKENS)
+        self._mention_matcher = KeywordMatcher(self._mention_phrases)
+
+    @classmethod
+    def from_layers(cls, layers: List[str], config_hash: str = "") -> "LayerIndex":
+        """对图层列表做分词、三元组等预处理并建立索引"""
+        names, tokens = [], []
+        for key in layers:
+            category, filename = key.split(":", 1)
+            name = Path(filename).stem
+            names.append(" ".join(tokenize(name)))
+            tokens.append(list(dict.fromkeys(tokenize(name) + tokenize(category))))
+
+        vocabulary = dict.fromkeys(token for layer_tokens in tokens for token in layer_tokens)
+        token_grams = {token: sorted(trigrams(token)) for token in vocabulary}
+        return cls(layers, names, tokens, token_grams, cls._mention_phrases_for(layers), config_hash)
+
+    @staticmethod
+    def _mention_phrases_for(layers: List[str]) -> Dict[str, str]:
+        """可以在 prompt 中直接识别的短语 → 图层"""
+        phrases = {}
+        known = set(layers)
+        for phrase, key in CHINESE_ALIASES.items():
+            if key in known:
+                phrases[phrase] = key
+
+        for key in layers:
+            category, filename = key.split(":", 1)
+            words = Path(filename).stem.lower().split()
+            # 带单字母 / 单个数字的名字（"Smile A"、"3"）容易误匹配普通句子
+            if any(len(word) < 2 for word in words):
+                continue
+            if len(words) == 1 and category not in SINGLE_WORD_MENTION_CATEGORIES:
+                continue
+            phrases.setdefault(" ".join(words), key)
+        return phrases
+
+    # ------------------------------------------------------------------
+    # 构建 / 加载
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def config_hash_of(config_path: str) -> str:
+        """配置文件内容 + 索引版本 + 中文词表的哈希"""
+        digest = hashlib.sha256()
+        digest.update(Path(config_path).read_bytes())
+        digest.update(json.dumps([INDEX_VERSION, CHINESE_TOKENS, CHINESE_ALIASES], ensure_ascii=False).encode())
+        return digest.hexdigest()
+
+    @classmethod
+    def build(cls, config_path: str = "assets/milady_layers/layer_config.json") -> "LayerIndex":
+        """从 layer_config.json 构建索引"""
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        layers = [
+            f"{layer['name']}:{image}"
+            for layer in config["attributeLayers"]
+            for image in layer["images"]
+        ]
+        return cls.from_layers(layers, cls.config_hash_of(config_path))
+
+    @classmethod
+    def load(
+        cls,
+        config_path: str = "assets/milady_layers/layer_config.json",
+        cache_path: str = "cache/layer_index/index.json",
+    ) -> "LayerIndex":
+        """
+        加载磁盘缓存的索引，配置变化或缓存损坏时重新构建并写回
+
+        Raises:
+            OSError: 配置文件不存在
+        """
+        config_hash = cls.config_hash_of(config_path)
+        cache_file = Path(cache_path)
+
+        if cache_file.exists():
+            try:
+                with open(cache_file, "r", encoding="utf-8") as f:
+                    cached = json.load(f)
+                if cached.get("version") == INDEX_VERSION and cached.get("config_hash") == config_hash:
+                    return cls(
+                        cached["layers"], cached["names"], cached["tokens"],
+                        cached["token_grams"], cached["phrases"], config_hash
+                    )
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️  图层索引缓存损坏，重新构建: {e}")
+
+        index = cls.build(config_path)
+        try:
+            index.save(cache_path)
+        except OSError as e:
+            print(f"⚠️  无法写入图层索引缓存 {cache_path}: {e}")
+        return index
+
+    def save(self, cache_path: str = "cache/layer_index/index.json"):
+        """原子写入索引缓存"""
+        cache_file = Path(cache_path)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "version": INDEX_VERSION,
+            "config_hash": self.config_hash,
+            "layers": self.layers,
+            "names": self.names,
+            "tokens": [list(layer_tokens) for layer_tokens in self._tokens],
+            "token_grams": {token: sorted(grams) for token, grams in self._token_grams.items()},
+            "phrases": self._mention_phrases,
+        }
+        tmp_file = cache_file.with_name(f".{cache_file.name}.{os.getpid()}.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_file, cache_file)
+
+    def __len__(self) -> int:
+        return len(self.layers)
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+
+    def query_tokens(self, query: str) -> List[str]:
+        """把查询（中英混合）转成英文词：中文按最长匹配翻译，未收录的中日韩文字丢弃"""
+        parts = []
+        last_end = 0
+        for start, end, word in self._chinese_matcher.find_longest(query):
+            parts.append(_CJK_RE.sub(" ", query[last_end:start]))
+            parts.append(f" {CHINESE_TOKENS[word]} ")
+            last_end = end
+        parts.append(_CJK_RE.sub(" ", query[last_end:]))
+        return list(dict.fromkeys(tokenize("".join(parts))))
+
+    def search(self, query: str, limit: int = 5, category: Optional[str] = None) -> List[LayerMatch]:
+        """
+        按相关度搜索图层
+
+        打分:
+        - 1.0: 中文整词别名，或与图层名完全一致
+        - 0.5~0.95: 词重合（查询词覆盖率、图层名覆盖率越高越好），
+          拼错的词纠正后按相似度折算
+
+        Args:
+            query: 任意描述，如 "brown cowboy hat" / "粉色蝴蝶结" / "cowbow hat"
+            limit: 最多返回几个结果
+            category: 只在某个类别中搜索
+
+        Returns:
+            按分数从高到低排列的结果
+        """
+        scores: Dict[int, float] = {}
+
+        alias = CHINESE_ALIASES.get(query.strip())
+        if alias in self._positions:
+            scores[self._positions[alias]] = 1.0
+
+        tokens = self.query_tokens(query)
+        exact = self._exact.get(" ".join(tokens))
+        if exact is not None:
+            scores[exact] = 1.0
+
+        # 词重合（不认识的词纠正为最相近的词，按相似度计权重）
+        overlap: Dict[int, float] = defaultdict(float)
+        for token in tokens:
+            weight = 1.0
+            if token not in self._postings:
+                token, weight = self._correct(token)
+                if token is None:
+                    continue
+            for layer_id in self._postings[token]:
+                overlap[layer_id] += weight
+
+        for layer_id, weight in overlap.items():
+            coverage = weight / len(tokens)
+            precision = weight / len(self._tokens[layer_id])
+            score = 0.5 + 0.25 * coverage + 0.2 * precision
+            scores[layer_id] = max(scores.get(layer_id, 0.0), score)
+
+        results = [
+            LayerMatch(self.layers[layer_id], score)
+            for layer_id, score in scores.items()
+            if category is None or self.layers[layer_id].startswith(f"{category}:")
+        ]
+        # 同分时按配置顺序
+        results.sort(key=lambda match: (-match.score, self._positions[match.key]))
+        return results[:limit]
+
+    def _correct(self, token: str) -> Tuple[Optional[str], float]:
+        """
+        把不在词表里的词纠正为三元组相似度最高的词
+
+        Returns:
+            (词, 相似度)，没有足够相似的词时返回 (None, 0.0)
+        """
+        grams = trigrams(token)
+        shared: Dict[str, int] = defaultdict(int)
+        for gram in grams:
+            for candidate in self._gram_postings.get(gram, ()):
+                shared[candidate] += 1
+
+        best, best_similarity = None, 0.0
+        for candidate, count in shared.items():
+            similarity = count / len(grams | self._token_grams[candidate])
+            if similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+
+        if best_similarity < MIN_TRIGRAM_SIMILARITY:
+            return None, 0.0
+        return best, best_similarity
+
+    def resolve(
+        self,
+        query: str,
+        category: Optional[str] = None,
+        min_score: float = 0.5,
+        match_all: bool = False,
+    ) -> Optional[str]:
+        """
+        返回最相关的图层 "类别:文件名.png"，没有足够相关的结果时返回 None
+
+        Args:
+            match_all: 要求查询的每个词（拼错的词纠正后）都出现在图层名中，
+                用于从句子里截取的修饰词（"white cowboy" 只能选中同时含 white 和 cowboy 的图层）
+        """
+        if not match_all:
+            matches = self.search(query, limit=1, category=category)
+        else:
+            required = self._required_tokens(self.query_tokens(query))
+            if not required:
+                return None
+            matches = [
+                match for match in self.search(query, limit=len(self.layers), category=category)
+                if required <= set(self._tokens[self._positions[match.key]])
+            ]
+        if matches and matches[0].score >= min_score:
+            return matches[0].key
+        return None
+
+    def _required_tokens(self, tokens: List[str]) -> Optional[set]:
+        """查询词纠正为词表中的词，有词无法纠正时返回 None"""
+        required = set()
+        for token in tokens:
+            if token not in self._postings:
+                token, _ = self._correct(token)
+                if token is None:
+                    return None
+            required.add(token)
+        return required
+
+    def find_mentions(self, prompt: str) -> List[str]:
+        """
+        找出 prompt 中直接提到的图层名（完整图层名或中文别名，最左最长匹配）
+
+        "戴着渔夫帽和 Cherry Necklace" → ["Hat:Buckethat.png", "Necklaces:Cherry Necklace.png"]
+
+        Returns:
+            按出现顺序排列的图层（已去重）
+        """
+        mentions = []
+        for _, _, key in self.find_mention_spans(prompt):
+            if key not in mentions:
+                mentions.append(key)
+        return mentions
+
+    def find_mention_spans(self, prompt: str) -> List[Tuple[int, int, str]]:
+        """
+        同 find_mentions，但返回每次提及在 prompt.lower() 中的位置
+
+        Returns:
+            [(start, end, "类别:文件名.png"), ...]，按位置排列且互不重叠
+        """
+        text = prompt.lower()
+
+        # 英文名字要求完整单词（"beret" 不匹配 "berets"）；在选最长匹配之前检查，
+        # 不完整的长名字不会挡住同一位置完整的短名字
+        def is_mention(start: int, end: int, phrase: str) -> bool:
+            return not phrase.isascii() or self._is_word_match(text, start, end)
+
+        return [
+            (start, end, self._mention_phrases[phrase])
+            for start, end, phrase in self._mention_matcher.find_longest(text, accept=is_mention)
+        ]
+
+    @staticmethod
+    def _is_word_match(text: str, start: int, end: int) -> bool:
+        before = start > 0 and _WORD_CHAR_RE.match(text[start - 1]) is not None
+        after = end < len(text) and _WORD_CHAR_RE.match(text[end]) is not None
+        return not before and not after
+
+
+_shared_indexes: Dict[Tuple[str, str], LayerIndex] = {}
+_shared_lock = threading.Lock()
+
+
+def get_layer_index(
+    config_path: str = "assets/milady_layers/layer_config.json",
+    cache_path: str = "cache/layer_index/index.json",
+) -> Optional[LayerIndex]:
+    """
+    进程内共享的图层索引（首次调用时加载）
+
+    Returns:
+        LayerIndex，配置文件不存在时返回 None
+    """
+    key = (config_path, cache_path)
+    with _shared_lock:
+        if key not in _shared_indexes:
+            try:
+                _shared_indexes[key] = LayerIndex.load(config_path, cache_path)
+            except OSError as e:
+                print(f"⚠️  无法加载图层索引: {e}")
+                return None
+        return _shared_indexes[key]
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+预缩放图层存储 - Layer Store
+
+图层原图是 2000x2500 的 PNG，每次合成都要解码并 LANCZOS 缩放到 NFT 尺寸。
+这里把缩放后的图层以预乘 alpha 的 RGBA（PIL 的 "RGBa" 模式）数组形式持久化到磁盘，
+并在进程内用按字节预算淘汰的 LRU 缓存热点图层。
+
+大部分配饰图层（帽子、眼镜、耳环等）几乎全透明，所以每个图层只保存 alpha 通道的
+紧凑包围盒（bbox）内的像素和它在画布上的偏移，合成时只需混合这一小块区域。
+
+存储结构:
+    cache/layer_store/1000x1250/<类别>/<文件名>.npz  (pixels, offset, size)
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .cache_utils import ByteBudgetLRU
+
+
+# 默认内存预算（MB），可通过环境变量调整
+DEFAULT_CACHE_MB = int(os.getenv("MILADY_LAYER_CACHE_MB", "512"))
+
+
+class LayerEntry:
+    """
+    裁剪后的图层
+
+    Attributes:
+        pixels: alpha 包围盒内的预乘 RGBA 像素 (h, w, 4) uint8
+        offset: 包围盒左上角在完整画布上的位置 (x, y)
+        size: 完整画布尺寸 (width, height)
+    """
+
+    __slots__ = ("pixels", "offset", "size")
+
+    def __init__(self, pixels: np.ndarray, offset: Tuple[int, int], size: Tuple[int, int]):
+        self.pixels = pixels
+        self.offset = (int(offset[0]), int(offset[1]))
+        self.size = (int(size[0]), int(size[1]))
+
+    @property
+    def bbox(self) -> Optional[Tuple[int, int, int, int]]:
+        """在完整画布上的包围盒 (left, top, right, bottom)，全透明图层返回 None"""
+        height, width = self.pixels.shape[:2]
+        if width == 0 or height == 0:
+            return None
+        x, y = self.offset
+        return (x, y, x + width, y + height)
+
+    @property
+    def nbytes(self) -> int:
+        return self.pixels.nbytes
+
+    def to_image(self) -> Optional[Image.Image]:
+        """把裁剪区域转换为普通 RGBA 的 PIL Image，全透明图层返回 None"""
+        height, width = self.pixels.shape[:2]
+        if width == 0 or height == 0:
+            return None
+        return Image.frombytes("RGBa", (width, height), self.pixels.tobytes()).convert("RGBA")
+
+    def to_full_image(self) -> Image.Image:
+        """还原为完整画布尺寸的 RGBA 图层"""
+        full = Image.new("RGBA", self.size, (0, 0, 0, 0))
+        crop = self.to_image()
+        if crop is not None:
+            full.paste(crop, self.offset)
+        return full
+
+    def blend_into(self, canvas: Image.Image):
+        """
+        只在包围盒区域内把图层 alpha 混合到画布上（原地修改 canvas）
+
+        Args:
+            canvas: RGBA 画布，尺寸需与图层的完整尺寸一致
+        """
+        crop = self.to_image()
+        if crop is not None:
+            canvas.alpha_composite(crop, dest=self.offset)
+
+
+class LayerStore:
+    """
+    预缩放图层存储
+
+    - 磁盘层: 每个图层缩放到目标尺寸、按 alpha 包围盒裁剪后存成预乘 RGBA 的 .npz
+      （源文件更新后自动重建）
+    - 内存层: ByteBudgetLRU，按字节预算淘汰
+    """
+
+    _shared: Dict[Tuple[str, str, Tuple[int, int]], "LayerStore"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        layer_dir: str = "assets/milady_layers",
+        store_dir: str = "cache/layer_store",
+        target_size: Tuple[int, int] = (1000, 1250),
+        max_cache_bytes: Optional[int] = None,
+    ):
+        """
+        初始化图层存储
+
+        Args:
+            layer_dir: 图层原图目录
+            store_dir: 预缩放图层的存储目录
+            target_size: 目标尺寸（NFT 尺寸）
+            max_cache_bytes: 内存 LRU 的字节预算，None 使用 MILADY_LAYER_CACHE_MB
+        """
+        self.layer_dir = Path(layer_dir)
+        self.target_size = tuple(target_size)
+        self.store_dir = Path(store_dir) / f"{self.target_size[0]}x{self.target_size[1]}"
+
+        if max_cache_bytes is None:
+            max_cache_bytes = DEFAULT_CACHE_MB * 1024 * 1024
+        self.cache = ByteBudgetLRU(max_cache_bytes)
+
+    @classmethod
+    def shared(
+        cls,
+        layer_dir: str = "assets/milady_layers",
+        store_dir: str = "cache/layer_store",
+        target_size: Tuple[int, int] = (1000, 1250),
+    ) -> "LayerStore":
+        """
+        获取进程内共享的图层存储
+
+        Lark Bot 会在多个地方创建 MiladyComposer，共享实例可以让它们共用同一个内存缓存。
+        """
+        key = (str(Path(layer_dir)), str(Path(store_dir)), tuple(target_size))
+        with cls._shared_lock:
+            store = cls._shared.get(key)
+            if store is None:
+                store = cls(layer_dir=layer_dir, store_dir=store_dir, target_size=target_size)
+                cls._shared[key] = store
+            return store
+
+    def _source_path(self, category: str, image_name: str) -> Path:
+        return self.layer_dir / category / image_name
+
+    def _store_path(self, category: str, image_name: str) -> Path:
+        return self.store_dir / category / (Path(image_name).stem + ".npz")
+
+    def _is_fresh(self, source: Path, stored: Path) -> bool:
+        """预缩放文件存在且不比源文件旧"""
+        return stored.exists() and stored.stat().st_mtime >= source.stat().st_mtime
+
+    def _render(self, source: Path) -> LayerEntry:
+        """解码源图层 → 缩放到目标尺寸 → 预乘 alpha → 按 alpha 包围盒裁剪"""
+        layer = Image.open(source).convert("RGBA")
+        if layer.size != self.target_size:
+            layer = layer.resize(self.target_size, Image.Resampling.LANCZOS)
+
+        bbox = layer.getchannel("A").getbbox()
+        if bbox is None:
+            # 全透明图层
+            pixels = np.zeros((0, 0, 4), dtype=np.uint8)
+            return LayerEntry(pixels, (0, 0), self.target_size)
+
+        pixels = np.asarray(layer.crop(bbox).convert("RGBa"))
+        return LayerEntry(pixels, bbox[:2], self.target_size)
+
+    def _write(self, stored: Path, entry: LayerEntry):
+        """原子写入（先写临时文件再替换），多进程同时构建也不会读到半个文件"""
+        stored.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = stored.with_name(f".{stored.stem}.{os.getpid()}.tmp.npz")
+        np.savez(
+            tmp_path,
+            pixels=entry.pixels,
+            offset=np.array(entry.offset, dtype=np.int32),
+            size=np.array(entry.size, dtype=np.int32),
+        )
+        os.replace(tmp_path, stored)
+
+    def _read(self, stored: Path) -> LayerEntry:
+        with np.load(stored) as data:
+            return LayerEntry(data["pixels"], tuple(data["offset"]), tuple(data["size"]))
+
+    def get(self, category: str, image_name: str) -> Optional[LayerEntry]:
+        """
+        获取预缩放、已裁剪的图层
+
+        查找顺序: 内存 LRU → 磁盘存储 → 解码源 PNG（并写回磁盘）
+
+        Returns:
+            LayerEntry（像素数组只读），图层不存在时返回 None
+        """
+        key = (category, image_name)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry
+
+        source = self._source_path(category, image_name)
+        if not source.exists():
+            return None
+
+        stored = self._store_path(category, image_name)
+        entry = None
+        if self._is_fresh(source, stored):
+            try:
+                entry = self._read(stored)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️  预缩放图层损坏，重新生成 {category}/{image_name}: {e}")
+
+        if entry is None:
+            entry = self._render(source)
+            try:
+                self._write(stored, entry)
+            except OSError as e:
+                print(f"⚠️  无法写入图层存储 {stored}: {e}")
+
+        entry.pixels.setflags(write=False)
+        self.cache.put(key, entry, entry.nbytes)
+        return entry
+
+    def get_image(self, category: str, image_name: str) -> Optional[Image.Image]:
+        """获取预缩放图层并还原为完整画布尺寸的普通 RGBA PIL Image"""
+        entry = self.get(category, image_name)
+        if entry is None:
+            return None
+        return entry.to_full_image()
+
+    def build(
+        self,
+        layer_config: Dict[str, List[str]],
+        force: bool = False,
+    ) -> Dict[str, int]:
+        """
+        一次性构建所有图层的预缩放存储
+
+        Args:
+            layer_config: {类别: [图层文件名]}，通常来自 layer_config.json
+            force: 是否忽略已有文件强制重建
+
+        Returns:
+            统计信息 {"built": ..., "skipped": ..., "missing": ...}
+        """
+        stats = {"built": 0, "skipped": 0, "missing": 0}
+
+        for category, image_names in layer_config.items():
+            for image_name in image_names:
+                source = self._source_path(category, image_name)
+                if not source.exists():
+                    stats["missing"] += 1
+                    continue
+
+                stored = self._store_path(category, image_name)
+                if not force and self._is_fresh(source, stored):
+                    stats["skipped"] += 1
+                    continue
+
+                self._write(stored, self._render(source))
+                stats["built"] += 1
+
+            print(f"✅ {category}: {len(image_names)} 个图层")
+
+        return stats
+
+    @staticmethod
+    def load_layer_config(config_path: str = "assets/milady_layers/layer_config.json") -> Dict[str, List[str]]:
+        """读取 layer_config.json 为 {类别: [图层文件名]}"""
+        with open(config_path, "r") as f:
+            config = json.load(f)
+        return {layer["name"]: layer["images"] for layer in config["attributeLayers"]}
@@ -0,0 +1,177 @@
+"""
+Local (CPU-only) accessory detector for Milady NFTs
+
+Every Milady is a stack of known layer files, so the exact pixels of an
+accessory are the opaque pixels of its layer. For an image of an unmodified
+token (id passed explicitly or taken from a milady_<id>.png file name) the
+accessory layers come from the local attribute index,
+and their alpha channel is projected onto the image from the pre-scaled
+LayerStore entries.
+
+Used by SAMDetector when Replicate is unavailable: no network, no API cost,
+a few milliseconds per lookup once the layers are in the LayerStore.
+
+Results are SAM-compatible mask info dicts (bbox, coverage, center) plus the
+boolean pixel mask.
+"""
+
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .layer_store import LayerStore
+from .nft_attributes import NFTAttributeIndex
+from .sam_detector import measure_mask
+from .sam_mask_cache import nft_id_from_path
+
+
+# Layer categories (= attribute traits) holding each SAMDetector accessory type
+ACCESSORY_CATEGORIES = {
+    "hat": ("Hat",),
+    "glasses": ("Glasses",),
+    "earrings": ("Earrings",),
+    "necklace": ("Necklaces",),
+    "scarf": ("Necklaces",),
+    "face_accessories": ("Face Decoration",),
+}
+
+# Layer pixels at least this opaque belong to the accessory
+# (low enough to keep anti-aliased edges inside the inpainting mask)
+ALPHA_THRESHOLD = 64
+
+
+class LocalAccessoryDetector:
+    """
+    Accessory masks from NFT attributes + layer alpha.
+
+    Usage:
+        detector = LocalAccessoryDetector()
+        result = detector.detect("assets/milady_nfts/images/milady_5050.png", "hat")
+        if result is not None:
+            mask_info, pixels = result
+    """
+
+    def __init__(self, layer_store: Optional[LayerStore] = None,
+                 attribute_index: Optional[NFTAttributeIndex] = None,
+                 config_path: str = "assets/milady_layers/layer_config.json",
+                 alpha_threshold: int = ALPHA_THRESHOLD):
+        """
+        Args:
+            layer_store: Pre-scaled layers (default: the shared 1000x1250 store)
+            attribute_index: NFT attributes (default: the shared cache/nft_attributes index)
+            config_path: layer_config.json, used to resolve attribute values to file names
+            alpha_threshold: Minimum layer alpha of a mask pixel
+        """
+        self.layer_store = layer_store if layer_store is not None else LayerStore.shared()
+        self.attribute_index = attribute_index if attribute_index is not None else NFTAttributeIndex.shared()
+        self.alpha_threshold = alpha_threshold
+
+        # (category, lower-case file stem) -> file name
+        self._files: Dict[Tuple[str, str], str] = {}
+        try:
+            layer_config = LayerStore.load_layer_config(config_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️  无法读取图层配置，按属性值推断文件名: {e}")
+            layer_config = {}
+        for category, image_names in layer_config.items():
+            for image_name in image_names:
+                self._files[(category, Path(image_name).stem.lower())] = image_name
+
+    def layer_file(self, category: str, value: str) -> str:
+        """Layer file name of an attribute value ("eth necklace" -> "ETH Necklace.png")."""
+        return self._files.get((category, value.strip().lower()), value.title() + ".png")
+
+    def accessory_layers(self, nft_id: int, accessory_type: str) -> List[Tuple[str, str]]:
+        """(category, file name) of the layers making up an accessory of one NFT."""
+        attributes = self.attribute_index.get(nft_id)
+        if not attributes:
+            return []
+        return [
+            (category, self.layer_file(category, attributes[category]))
+            for category in ACCESSORY_CATEGORIES.get(accessory_type, ())
+            if category in attributes
+        ]
+
+    def layer_bbox(self, category: str, image_name: str) -> Optional[Tuple[int, int, int, int]]:
+        """(x, y, width, height) of the opaque pixels of one layer on the NFT canvas."""
+        entry = self.layer_store.get(category, image_name)
+        if entry is None or entry.bbox is None:
+            return None
+        info = measure_mask(entry.pixels[..., 3] >= self.alpha_threshold, 1)
+        if info is None:
+            return None
+        x, y, w, h = info['bbox']
+        return (entry.offset[0] + x, entry.offset[1] + y, w, h)
+
+    def layer_pixels(self, layers: List[Tuple[str, str]]) -> Optional[np.ndarray]:
+        """
+        Union of the opaque pixels of some layers on the full NFT canvas.
+
+        Returns:
+            (height, width) boolean array, or None if no layer has visible pixels
+        """
+        width, height = self.layer_store.target_size
+        binary = None
+        for category, image_name in layers:
+            entry = self.layer_store.get(category, image_name)
+            if entry is None or entry.bbox is None:
+                continue
+            if binary is None:
+                binary = np.zeros((height, width), dtype=bool)
+            x, y = entry.offset
+            crop_height, crop_width = entry.pixels.shape[:2]
+            binary[y:y + crop_height, x:x + crop_width] |= entry.pixels[..., 3] >= self.alpha_threshold
+        return binary
+
+    def pixels(self, nft_id: int, accessory_type: str,
+               image_size: Tuple[int, int]) -> Optional[np.ndarray]:
+        """
+        Pixel mask of one accessory of a token, scaled to an image of the token.
+
+        Returns:
+            (height, width) boolean array, or None if the token has no such accessory
+        """
+        binary = self.layer_pixels(self.accessory_layers(nft_id, accessory_type))
+        if binary is None:
+            return None
+
+        image_size = (int(image_size[0]), int(image_size[1]))
+        if image_size != self.layer_store.target_size:
+            resized = Image.fromarray(binary).resize(image_size, Image.Resampling.NEAREST)
+            binary = np.asarray(resized, dtype=bool)
+        return binary
+
+    def detect(self, image_path: str, accessory_type: str,
+               image_size: Optional[Tuple[int, int]] = None,
+               nft_id: Optional[int] = None) -> Optional[Tuple[Dict, np.ndarray]]:
+        """
+        Detect one accessory on an image of an unmodified NFT.
+
+        Args:
+            image_path: NFT image
+            accessory_type: SAMDetector accessory type (hat, glasses, ...)
+            image_size: (width, height) of the image (read from the file if omitted)
+            nft_id: Token id (default: taken from a milady_<id>.png file name)
+
+        Returns:
+            (mask info dict, (height, width) boolean mask) in image pixels,
+            or None if the token is unknown or has no such accessory
+        """
+        if nft_id is None:
+            nft_id = nft_id_from_path(image_path)
+        if nft_id is None:
+            return None
+
+        if image_size is None:
+            with Image.open(image_path) as img:
+                image_size = img.size
+        binary = self.pixels(nft_id, accessory_type, image_size)
+        if binary is None:
+            return None
+
+        info = measure_mask(binary, binary.size)
+        if info is None:
+            return None
+        return info, binary
@@ -6,13 +6,17 @@ Meme Generator V2 - 基于 NFT 原图 + 图层合成
 
 from PIL import Image
 from pathlib import Path
-from typing import Dict, Optional, List
+from typing import Dict, Iterable, Iterator, Optional, List, Tuple, Union
+import multiprocessing
+import os
 import random
 import time
 
 from .milady_composer import MiladyComposer
 from .caption_meme import CaptionMeme
 from .prompt_enhancer import PromptEnhancer
+from .async_prompt_enhancer import AsyncPromptEnhancer
+from .image_io import encode_image, save_image
 
 
 class MemeGeneratorV2:
@@ -76,14 +80,21 @@ class MemeGeneratorV2:
             font_path: 自定义字体路径
             enable_prompt_enhancer: 是否启用 Prompt Enhancer
         """
+        self.nft_dir = nft_dir
+        self.layer_dir = layer_dir
+        self.font_path = font_path
+
         self.composer = MiladyComposer(nft_dir=nft_dir, layer_dir=layer_dir)
         self.caption = CaptionMeme(font_path)
 
         # 初始化 Prompt Enhancer（可选）
+        # 请求路径里通过异步客户端调用：合并重复请求，超过截止时间使用原始提示词
         if enable_prompt_enhancer:
             self.prompt_enhancer = PromptEnhancer()
+            self.async_enhancer = AsyncPromptEnhancer(self.prompt_enhancer)
         else:
             self.prompt_enhancer = None
+            self.async_enhancer = None
 
         print("=" * 70)
         print("🎨 Meme Generator V2 已就绪！")
@@ -95,7 +106,7 @@ class MemeGeneratorV2:
             print("   - Prompt Enhancer: ❌ 未启用")
         print("=" * 70)
 
-    def generate(
+    def render(
         self,
         nft_id: Optional[int] = None,
         layers: Optional[Dict[str, str]] = None,
@@ -103,48 +114,29 @@ class MemeGeneratorV2:
         bottom_text: str = "",
         all_caps: bool = True,
         font_style: str = "impact",
-        output_path: Optional[str] = None,
         output_size: tuple = (1000, 1250),
-        use_base_layers: bool = False  # False=使用NFT原图+叠加, True=从基础图层自定义
-    ) -> str:
+        use_base_layers: bool = False,
+        rng: Optional[random.Random] = None
+    ) -> Optional[Image.Image]:
         """
-        生成 Milady Meme
+        合成 Milady Meme 并返回图片（不写文件）
 
-        Args:
-            nft_id: NFT ID (0-9999)，None 为随机
-            layers: 图层配置，如 {"Hat": "Cowboy Hat.png", "Glasses": "Heart Glasses.png"}
-            top_text: 顶部文字
-            bottom_text: 底部文字
-            all_caps: 是否全大写
-            font_style: 字体风格 ("impact", "angelic", "chinese", "glow")
-            output_path: 输出路径
-            output_size: 输出尺寸
-            use_base_layers: 是否从基础图层开始合成（True=替换模式，False=叠加模式）
+        参数含义与 generate() 相同
 
         Returns:
-            输出文件路径
-
-        Example:
-            >>> gen = MemeGeneratorV2()
-            >>> # 使用基础图层，添加帽子，加上文字
-            >>> path = gen.generate(
-            ...     layers={"Hat": "Cowboy Hat.png"},
-            ...     top_text="GM BUILDERS",
-            ...     bottom_text="LFG",
-            ...     font_style="glow",
-            ...     use_base_layers=True
-            ... )
+            PIL Image，合成失败时返回 None
         """
+        rng = rng or random
+
         # 1. 合成图片
         if use_base_layers:
             # 从基础图层开始合成（完全自定义）
-            import random
             skins = ["Pale.png", "Pink.png", "Tan.png", "Black.png"]
             backgrounds = ["XP.png", "Clouds.png", "Sunset.png", "Streets.png"]
 
             img = self.composer.compose_from_scratch(
-                skin=random.choice(skins),
-                background=random.choice(backgrounds),
+                skin=rng.choice(skins),
+                background=rng.choice(backgrounds),
                 layers=layers,
                 output_size=output_size
             )
@@ -174,14 +166,16 @@ class MemeGeneratorV2:
                 img = self.composer.compose(
                     nft_id=nft_id,
                     layers=layers,
-                    output_size=output_size
+                    output_size=output_size,
+                    rng=rng
                 )
         else:
             # 使用 NFT 原图（叠加模式）
             img = self.composer.compose(
                 nft_id=nft_id,
                 layers=layers,
-                output_size=output_size
+                output_size=output_size,
+                rng=rng
             )
 
         if img is None:
@@ -196,14 +190,81 @@ class MemeGeneratorV2:
                 font_style=font_style
             )
 
-        # 3. 保存
+        return img
+
+    def generate(
+        self,
+        nft_id: Optional[int] = None,
+        layers: Optional[Dict[str, str]] = None,
+        top_text: str = "",
+        bottom_text: str = "",
+        all_caps: bool = True,
+        font_style: str = "impact",
+        output_path: Optional[str] = None,
+        output_size: tuple = (1000, 1250),
+        use_base_layers: bool = False,  # False=使用NFT原图+叠加, True=从基础图层自定义
+        save: bool = True,
+        preset: Optional[str] = None,
+        rng: Optional[random.Random] = None
+    ) -> Union[str, bytes, None]:
+        """
+        生成 Milady Meme
+
+        Args:
+            nft_id: NFT ID (0-9999)，None 为随机
+            layers: 图层配置，如 {"Hat": "Cowboy Hat.png", "Glasses": "Heart Glasses.png"}
+            top_text: 顶部文字
+            bottom_text: 底部文字
+            all_caps: 是否全大写
+            font_style: 字体风格 ("impact", "angelic", "chinese", "glow")
+            output_path: 输出路径
+            output_size: 输出尺寸
+            use_base_layers: 是否从基础图层开始合成（True=替换模式，False=叠加模式）
+            save: 是否保存到文件；False 时不写磁盘，直接返回编码后的 bytes
+            preset: 输出编码预设 "fast_png" / "png" / "webp" / "jpeg"，None 使用默认预设
+            rng: 随机选择（NFT、底色等）使用的随机数生成器，None 使用全局 random
+
+        Returns:
+            输出文件路径（save=False 时为图片 bytes）
+
+        Example:
+            >>> gen = MemeGeneratorV2()
+            >>> # 使用基础图层，添加帽子，加上文字
+            >>> path = gen.generate(
+            ...     layers={"Hat": "Cowboy Hat.png"},
+            ...     top_text="GM BUILDERS",
+            ...     bottom_text="LFG",
+            ...     font_style="glow",
+            ...     use_base_layers=True
+            ... )
+        """
+        # 1-2. 合成图片并添加文字
+        img = self.render(
+            nft_id=nft_id,
+            layers=layers,
+            top_text=top_text,
+            bottom_text=bottom_text,
+            all_caps=all_caps,
+            font_style=font_style,
+            output_size=output_size,
+            use_base_layers=use_base_layers,
+            rng=rng
+        )
+        if img is None:
+            return None
+
+        # 3. 不落盘时直接返回编码结果
+        if not save:
+            return encode_image(img, preset)
+
+        # 4. 保存
         if output_path is None:
             output_dir = Path("output/memes")
             output_dir.mkdir(parents=True, exist_ok=True)
             timestamp = int(time.time())
             output_path = str(output_dir / f"milady_meme_{timestamp}.png")
 
-        img.save(output_path)
+        output_path = save_image(img, output_path, preset)
         print(f"💾 保存到: {output_path}")
 
         return output_path
@@ -214,7 +275,8 @@ class MemeGeneratorV2:
         top_text: str = "",
         bottom_text: str = "",
         all_caps: bool = True,
-        output_path: Optional[str] = None
+        output_path: Optional[str] = None,
+        preset: Optional[str] = None
     ) -> str:
         """
         生成随机 Milady Meme（随机 NFT + 随机图层）
@@ -224,6 +286,7 @@ class MemeGeneratorV2:
             top_text: 顶部文字
             bottom_text: 底部文字
             output_path: 输出路径
+            preset: 输出编码预设，None 使用默认预设
 
         Returns:
             输出文件路径
@@ -246,7 +309,7 @@ class MemeGeneratorV2:
             timestamp = int(time.time())
             output_path = str(output_dir / f"milady_meme_{timestamp}.png")
 
-        img.save(output_path)
+        output_path = save_image(img, output_path, preset)
         print(f"💾 保存到: {output_path}")
 
         return output_path
@@ -256,8 +319,10 @@ class MemeGeneratorV2:
         template_name: str,
         nft_id: Optional[int] = None,
         layers: Optional[Dict[str, str]] = None,
-        output_path: Optional[str] = None
-    ) -> str:
+        output_path: Optional[str] = None,
+        save: bool = True,
+        preset: Optional[str] = None
+    ) -> Union[str, bytes, None]:
         """
         使用预设模板生成 Meme
 
@@ -266,9 +331,11 @@ class MemeGeneratorV2:
             nft_id: NFT ID，None 为随机
             layers: 图层配置
             output_path: 输出路径
+            save: 是否保存到文件；False 时返回图片 bytes
+            preset: 输出编码预设 "fast_png" / "png" / "webp" / "jpeg"，None 使用默认预设
 
         Returns:
-            输出文件路径
+            输出文件路径（save=False 时为图片 bytes）
 
         Example:
             >>> gen = MemeGeneratorV2()
@@ -287,57 +354,177 @@ class MemeGeneratorV2:
             layers=layers,
             top_text=top_text,
             bottom_text=bottom_text,
-            output_path=output_path
+            output_path=output_path,
+            save=save,
+            preset=preset
         )
 
+    def _plan_batch(
+        self,
+        count: int,
+        template_name: Optional[str],
+        output_dir: Path,
+        seed: Optional[int]
+    ) -> List[Dict]:
+        """
+        预先生成批量任务列表（模板文字、NFT ID、输出路径）
+
+        每个任务使用由 (seed, 序号) 派生的独立随机数，所以同一个 seed
+        无论用几个进程、以什么顺序完成，结果都一样。
+        """
+        if seed is None:
+            seed = random.randrange(2**32)
+
+        jobs = []
+        for i in range(count):
+            rng = random.Random(f"{seed}:{i}")
+            current_template = template_name or rng.choice(list(self.MEME_TEMPLATES.keys()))
+            top_text, bottom_text = rng.choice(self.MEME_TEMPLATES[current_template])
+
+            jobs.append({
+                "index": i,
+                "seed": f"{seed}:{i}",
+                "nft_id": rng.randint(0, 9999),
+                "top_text": top_text,
+                "bottom_text": bottom_text,
+                "output_path": str(output_dir / f"meme_{i+1:04d}.png"),
+            })
+
+        return jobs
+
+    def _run_batch_job(self, job: Dict) -> Tuple[int, Optional[str], float]:
+        """执行一个批量任务，返回 (序号, 输出路径, 耗时秒数)"""
+        # 合成过程中的随机选择也使用任务自己的随机数生成器（不修改全局 random 的状态）
+        rng = random.Random(job["seed"])
+
+        start = time.perf_counter()
+        try:
+            path = self.generate(
+                nft_id=job["nft_id"],
+                top_text=job["top_text"],
+                bottom_text=job["bottom_text"],
+                output_path=job["output_path"],
+                rng=rng
+            )
+        except Exception as e:
+            print(f"❌ 任务 {job['index'] + 1} 失败: {e}")
+            path = None
+
+        return job["index"], path, time.perf_counter() - start
+
     def batch_generate(
         self,
         count: int,
         template_name: Optional[str] = None,
-        output_dir: str = "output/batch_memes"
+        output_dir: str = "output/batch_memes",
+        workers: Optional[int] = 1,
+        seed: Optional[int] = None
     ) -> List[str]:
         """
-        批量生成 Meme
+        批量生成 Meme（可选多进程并行）
+
+        workers > 1 时用 spawn 方式启动工作进程（不继承调用方的线程和锁），
+        每个工作进程初始化一次 MiladyComposer / CaptionMeme 并复用，
+        任务完成即写入文件，不等整批结束。
 
         Args:
             count: 生成数量
             template_name: 模板名称，None 为随机选择
             output_dir: 输出目录
+            workers: 进程数，1 为在当前进程顺序生成，None 使用 CPU 核数
+            seed: 随机种子，相同种子生成相同的一批 Meme
 
         Returns:
-            生成的文件路径列表
+            生成的文件路径列表（按任务序号排序）
         """
         output_dir = Path(output_dir)
         output_dir.mkdir(parents=True, exist_ok=True)
 
-        generated_paths = []
+        jobs = self._plan_batch(count, template_name, output_dir, seed)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, count))
 
-        print(f"\n🚀 开始批量生成 {count} 个 Meme...")
+        print(f"\n🚀 开始批量生成 {count} 个 Meme（{workers} 个进程）...")
+        batch_start = time.perf_counter()
 
-        for i in range(count):
-            # 随机选择模板
-            if template_name is None:
-                current_template = random.choice(list(self.MEME_TEMPLATES.keys()))
-            else:
-                current_template = template_name
+        if workers == 1:
+            results = map(self._run_batch_job, jobs)
+            pool = None
+        else:
+            pool = multiprocessing.get_context("spawn").Pool(
+                processes=workers,
+                initializer=_init_batch_worker,
+                initargs=(self.nft_dir, self.layer_dir, self.font_path)
+            )
+            results = pool.imap_unordered(_run_batch_worker_job, jobs)
+
+        completed = {}
+        try:
+            for done, (index, path, seconds) in enumerate(results, 1):
+                status = "✅" if path else "❌"
+                print(f"[{done}/{count}] {status} meme_{index+1:04d} ({seconds:.2f}s)")
+                if path:
+                    completed[index] = path
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        generated_paths = [completed[i] for i in sorted(completed)]
+        elapsed = time.perf_counter() - batch_start
+
+        print(f"\n✅ 批量生成完成！共 {len(generated_paths)} 个 Meme，耗时 {elapsed:.1f}s")
+        print(f"📁 输出目录: {output_dir}")
 
-            # 生成文件路径
-            output_path = output_dir / f"meme_{i+1:04d}.png"
+        return generated_paths
 
-            # 生成 Meme
-            print(f"\n[{i+1}/{count}] 生成中...")
-            path = self.generate_from_template(
-                template_name=current_template,
-                output_path=str(output_path)
-            )
+    # iter_generate 任务中可用的字段（与 render() 参数一致）
+    JOB_FIELDS = (
+        "nft_id", "layers", "top_text", "bottom_text",
+        "all_caps", "font_style", "output_size", "use_base_layers",
+    )
 
-            if path:
-                generated_paths.append(path)
+    def iter_generate(
+        self,
+        jobs: Iterable[Dict],
+        preset: Optional[str] = None
+    ) -> Iterator[Tuple[Dict, Union[Image.Image, bytes, None]]]:
+        """
+        流式批量生成：每完成一个任务就 yield 一次，不写文件
 
-        print(f"\n✅ 批量生成完成！共 {len(generated_paths)} 个 Meme")
-        print(f"📁 输出目录: {output_dir}")
+        任务按需从 jobs 中读取，同一时间只持有一张图片，内存占用与批量大小无关。
 
-        return generated_paths
+        Args:
+            jobs: 任务描述的可迭代对象，每个任务是 dict，如
+                  {"nft_id": 1234, "layers": {"Hat": "Beret.png"},
+                   "top_text": "GM", "bottom_text": "LFG", "font_style": "impact"}
+            preset: None 时 yield PIL Image；指定输出预设（如 "fast_png" / "webp"）时 yield 编码后的 bytes
+
+        Yields:
+            (任务, 图片或 bytes)，合成失败时为 (任务, None)
+
+        Example:
+            >>> gen = MemeGeneratorV2()
+            >>> jobs = ({"nft_id": i, "top_text": "GM"} for i in range(100))
+            >>> for job, data in gen.iter_generate(jobs, preset="webp"):
+            ...     upload(data)
+        """
+        for job in jobs:
+            unknown = set(job) - set(self.JOB_FIELDS)
+            if unknown:
+                print(f"⚠️  忽略未知字段: {sorted(unknown)}")
+
+            try:
+                img = self.render(**{k: v for k, v in job.items() if k in self.JOB_FIELDS})
+            except Exception as e:
+                print(f"❌ 任务失败 {job}: {e}")
+                img = None
+
+            if img is None or preset is None:
+                yield job, img
+            else:
+                yield job, encode_image(img, preset)
 
     def list_available_layers(self) -> Dict[str, List[str]]:
         """
@@ -388,9 +575,9 @@ class MemeGeneratorV2:
             >>> print(enhanced)
             "A cheerful Milady NFT character joyfully celebrating Thanksgiving..."
         """
-        # 使用 Prompt Enhancer 增强提示词
-        if self.prompt_enhancer and self.prompt_enhancer.is_available():
-            enhanced_prompt = self.prompt_enhancer.enhance(
+        # 使用 Prompt Enhancer 增强提示词（超过截止时间返回原始提示词，不阻塞生成）
+        if self.async_enhancer and self.async_enhancer.is_available():
+            enhanced_prompt = self.async_enhancer.enhance_sync(
                 prompt,
                 bypass=bypass_enhancer,
                 context="milady meme"
@@ -414,6 +601,27 @@ class MemeGeneratorV2:
         return enhanced_prompt
 
 
+# ==================== 批量生成工作进程 ====================
+# 每个工作进程持有一个预热好的生成器，避免每个任务重复初始化
+
+_batch_generator: Optional[MemeGeneratorV2] = None
+
+
+def _init_batch_worker(nft_dir: str, layer_dir: str, font_path: Optional[str]):
+    """工作进程初始化：创建生成器（批量模式不需要 Prompt Enhancer）"""
+    global _batch_generator
+    _batch_generator = MemeGeneratorV2(
+        nft_dir=nft_dir,
+        layer_dir=layer_dir,
+        font_path=font_path,
+        enable_prompt_enhancer=False
+    )
+
+
+def _run_batch_worker_job(job: Dict) -> Tuple[int, Optional[str], float]:
+    return _batch_generator._run_batch_job(job)
+
+
 def main():
     """测试 V2 生成器"""
 
@@ -2,14 +2,49 @@
 """
 Memegen.link API - 免费梗图生成
 使用 memegen.link 的 100+ 模板创建经典梗图
+
+网络开销优化:
+- 连接池: 所有请求共用一个 keep-alive 的 requests.Session，不必每次重新握手 TCP + TLS
+- 模板目录: 持久化到 cache/memegen/templates.json，过期后用 ETag / Last-Modified 条件请求
+  重新验证（没有变化时服务器只返回 304）
+- 渲染缓存: memegen 的输出完全由 URL（模板、文字、格式、参数）决定，
+  按 URL 把图片缓存在内存和 cache/memegen/renders 中
+- 本地渲染: POPULAR_TEMPLATES 中的模板用 memegen_local 在本地绘制（只下载一次空白底图），
+  不支持的模板 / 参数或本地渲染失败时回退到远程 API
+
+环境变量:
+    MEMEGEN_LOCAL_RENDER           是否优先本地渲染（默认 true）
+    MEMEGEN_CACHE_DIR              缓存目录（默认 cache/memegen）
+    MEMEGEN_CATALOG_TTL_MINUTES    模板目录多久重新验证一次（默认 60）
+    MEMEGEN_RENDER_CACHE_MB        渲染结果内存缓存（默认 32）
+    MEMEGEN_RENDER_CACHE_DISK_MB   渲染结果磁盘缓存（默认 256）
 """
 
+import hashlib
+import json
+import os
+import threading
+import time
 import requests
 from pathlib import Path
 from typing import Optional, Dict, List
 from PIL import Image
 from io import BytesIO
 
+from .cache_utils import ByteBudgetLRU
+from .http_utils import create_session
+from .memegen_local import LocalMemegenRenderer
+
+
+CACHE_DIR = os.getenv("MEMEGEN_CACHE_DIR", "cache/memegen")
+LOCAL_RENDER = os.getenv("MEMEGEN_LOCAL_RENDER", "true").lower() == "true"
+CATALOG_TTL_SECONDS = float(os.getenv("MEMEGEN_CATALOG_TTL_MINUTES", "60")) * 60
+RENDER_CACHE_MB = int(os.getenv("MEMEGEN_RENDER_CACHE_MB", "32"))
+RENDER_CACHE_DISK_MB = int(os.getenv("MEMEGEN_RENDER_CACHE_DISK_MB", "256"))
+
+# 单次请求超时（秒）
+REQUEST_TIMEOUT = 30
+
 
 class MemegenAPI:
     """
@@ -64,20 +99,227 @@ class MemegenAPI:
         "为什么不": "both",  # Why Not Both
     }
 
-    def __init__(self):
-        """初始化 Memegen API"""
-        pass
+    def __init__(
+        self,
+        cache_dir: str = CACHE_DIR,
+        session: Optional[requests.Session] = None,
+        catalog_ttl: float = CATALOG_TTL_SECONDS,
+        render_cache_mb: int = RENDER_CACHE_MB,
+        render_cache_disk_mb: int = RENDER_CACHE_DISK_MB,
+        local_render: bool = LOCAL_RENDER
+    ):
+        """
+        初始化 Memegen API
 
-    def get_templates(self) -> List[Dict]:
+        Args:
+            cache_dir: 模板目录和渲染结果的缓存目录
+            session: HTTP 会话（None 时创建带连接池的会话）
+            catalog_ttl: 模板目录在多少秒内直接使用、不重新验证
+            render_cache_mb: 渲染结果内存缓存预算（MB，0 禁用）
+            render_cache_disk_mb: 渲染结果磁盘缓存预算（MB，0 禁用）
+            local_render: 是否优先使用本地渲染（远程 API 作为回退）
+        """
+        self.session = session if session is not None else create_session()
+        self.cache_dir = Path(cache_dir)
+        self.catalog_path = self.cache_dir / "templates.json"
+        self.render_dir = self.cache_dir / "renders"
+        self.catalog_ttl = catalog_ttl
+
+        self._catalog: Optional[Dict] = None
+        self._catalog_lock = threading.Lock()
+
+        self.render_cache = ByteBudgetLRU(render_cache_mb * 1024 * 1024)
+        self.render_disk_budget = render_cache_disk_mb * 1024 * 1024
+        self._render_disk_bytes: Optional[int] = None
+        self._render_lock = threading.Lock()
+
+        self.local_render = local_render
+        self._local_renderer: Optional[LocalMemegenRenderer] = None
+        self._local_lock = threading.Lock()
+
+    # ==================== 模板目录 ====================
+
+    def _load_catalog(self) -> Optional[Dict]:
+        """读取持久化的模板目录（不存在或损坏时返回 None）"""
+        if not self.catalog_path.exists():
+            return None
+        try:
+            with open(self.catalog_path, "r", encoding="utf-8") as f:
+                catalog = json.load(f)
+            if isinstance(catalog.get("templates"), list):
+                return catalog
+        except (OSError, ValueError) as e:
+            print(f"⚠️  模板目录缓存损坏，重新下载: {e}")
+        return None
+
+    def _save_catalog(self, catalog: Dict):
+        """原子写入模板目录"""
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.catalog_path.with_name(f".templates.{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(catalog, f, ensure_ascii=False)
+            os.replace(tmp_path, self.catalog_path)
+        except OSError as e:
+            print(f"⚠️  无法写入模板目录缓存: {e}")
+
+    def get_templates(self, force_refresh: bool = False) -> List[Dict]:
         """
         获取所有可用模板
 
+        目录在 catalog_ttl 内直接使用缓存；过期后发送条件请求，
+        服务器返回 304 时继续使用缓存。网络失败时退回到过期的缓存。
+
+        Args:
+            force_refresh: 忽略 catalog_ttl，立即重新验证
+
         Returns:
             模板列表
         """
-        response = requests.get(f"{self.BASE_URL}/templates")
-        response.raise_for_status()
-        return response.json()
+        with self._catalog_lock:
+            catalog = self._catalog or self._load_catalog()
+            now = time.time()
+
+            if catalog and not force_refresh and now - catalog.get("checked_at", 0) < self.catalog_ttl:
+                self._catalog = catalog
+                return catalog["templates"]
+
+            headers = {}
+            if catalog:
+                if catalog.get("etag"):
+                    headers["If-None-Match"] = catalog["etag"]
+                if catalog.get("last_modified"):
+                    headers["If-Modified-Since"] = catalog["last_modified"]
+
+            try:
+                response = self.session.get(f"{self.BASE_URL}/templates", headers=headers, timeout=REQUEST_TIMEOUT)
+                if response.status_code == 304 and catalog:
+                    catalog["checked_at"] = now
+                else:
+                    response.raise_for_status()
+                    catalog = {
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                        "checked_at": now,
+                        "templates": response.json(),
+                    }
+                    print(f"📋 已更新 Memegen 模板目录 ({len(catalog['templates'])} 个模板)")
+            except requests.RequestException as e:
+                if not catalog:
+                    raise
+                print(f"⚠️  无法刷新模板目录，使用缓存: {e}")
+                catalog["checked_at"] = now
+
+            self._catalog = catalog
+            self._save_catalog(catalog)
+            return catalog["templates"]
+
+    # ==================== 本地渲染 ====================
+
+    @property
+    def local_renderer(self) -> Optional[LocalMemegenRenderer]:
+        """本地渲染器（首次使用时创建，共用连接池和缓存目录；禁用时为 None）"""
+        if not self.local_render:
+            return None
+        with self._local_lock:
+            if self._local_renderer is None:
+                self._local_renderer = LocalMemegenRenderer(
+                    base_url=self.BASE_URL,
+                    session=self.session,
+                    blank_dir=str(self.cache_dir / "blanks")
+                )
+            return self._local_renderer
+
+    # ==================== 渲染缓存 ====================
+
+    def _render_path(self, url: str) -> Path:
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return self.render_dir / digest[:2] / digest
+
+    def _fetch_image(self, url: str) -> bytes:
+        """
+        按 URL 获取渲染结果（内存缓存 → 磁盘缓存 → 网络）
+
+        Returns:
+            图片数据
+        """
+        data = self.render_cache.get(url)
+        if data is not None:
+            print("⚡ 命中渲染缓存（内存）")
+            return data
+
+        path = self._render_path(url)
+        if self.render_disk_budget > 0 and path.exists():
+            try:
+                data = path.read_bytes()
+                print("⚡ 命中渲染缓存（磁盘）")
+            except OSError:
+                data = None
+
+        if data is None:
+            response = self.session.get(url, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            data = response.content
+            self._store_render(path, data)
+
+        self.render_cache.put(url, data, len(data))
+        return data
+
+    def _store_render(self, path: Path, data: bytes):
+        """写入磁盘缓存，超过预算时从最早写入的文件开始删除"""
+        if self.render_disk_budget <= 0:
+            return
+
+        with self._render_lock:
+            try:
+                if self._render_disk_bytes is None:
+                    self._render_disk_bytes = sum(
+                        f.stat().st_size for f in self.render_dir.glob("*/*") if f.is_file()
+                    ) if self.render_dir.exists() else 0
+
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, path)
+                self._render_disk_bytes += len(data)
+
+                if self._render_disk_bytes > self.render_disk_budget:
+                    files = sorted(
+                        (f for f in self.render_dir.glob("*/*") if f.is_file()),
+                        key=lambda f: f.stat().st_mtime
+                    )
+                    for old in files:
+                        if self._render_disk_bytes <= self.render_disk_budget * 0.8:
+                            break
+                        size = old.stat().st_size
+                        old.unlink()
+                        self._render_disk_bytes -= size
+            except OSError as e:
+                print(f"⚠️  无法写入渲染缓存: {e}")
+
+    def render_cache_stats(self) -> Dict:
+        """渲染结果内存缓存的命中率等统计"""
+        stats = self.render_cache.stats()
+        stats["disk_bytes"] = self._render_disk_bytes
+        return stats
+
+    @staticmethod
+    def _write_output(data: bytes, output_path: str, format: str) -> str:
+        """
+        保存图片
+
+        扩展名与格式一致时直接写入原始数据（不解码重编码，GIF 动画也能完整保留），
+        否则按扩展名转换格式。
+        """
+        path = Path(output_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        suffix = path.suffix.lower().lstrip(".")
+        if suffix == format.lower() or (suffix, format.lower()) in {("jpeg", "jpg"), ("jpg", "jpeg")}:
+            path.write_bytes(data)
+        else:
+            Image.open(BytesIO(data)).save(path)
+        return str(path)
 
     def _encode_text(self, text: str) -> str:
         """
@@ -156,6 +398,17 @@ class MemegenAPI:
         if template in self.POPULAR_TEMPLATES:
             template = self.POPULAR_TEMPLATES[template]
 
+        # 优先本地渲染（不支持时返回 None，继续走远程 API）
+        renderer = self.local_renderer
+        if renderer is not None:
+            local_path = renderer.generate_meme(
+                template, top_text, bottom_text, output_path=output_path, format=format,
+                width=width, height=height, font=font, style=style, layout=layout,
+                background=background, color=color
+            )
+            if local_path:
+                return local_path
+
         # 编码文字
         top_encoded = self._encode_text(top_text) if top_text else "_"
         bottom_encoded = self._encode_text(bottom_text) if bottom_text else "_"
@@ -190,18 +443,14 @@ class MemegenAPI:
             print(f"   高级参数: {', '.join(params)}")
         print(f"   URL: {url}")
 
-        # 下载图片
-        response = requests.get(url)
-        response.raise_for_status()
-
-        img = Image.open(BytesIO(response.content))
+        # 下载图片（相同 URL 直接使用缓存）
+        data = self._fetch_image(url)
 
         # 保存
         if output_path is None:
             output_path = f"output/memegen_{template}.{format}"
 
-        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
-        img.save(output_path)
+        output_path = self._write_output(data, output_path, format)
 
         print(f"✅ 已保存: {output_path}")
 
@@ -230,6 +479,12 @@ class MemegenAPI:
         if template in self.POPULAR_TEMPLATES:
             template = self.POPULAR_TEMPLATES[template]
 
+        renderer = self.local_renderer
+        if renderer is not None:
+            local_path = renderer.generate_custom(template, lines, output_path=output_path, format=format)
+            if local_path:
+                return local_path
+
         # 编码所有行
         encoded_lines = [self._encode_text(line) for line in lines]
         text_path = "/".join(encoded_lines)
@@ -241,18 +496,14 @@ class MemegenAPI:
         for i, line in enumerate(lines, 1):
             print(f"   第{i}行: {line}")
 
-        # 下载图片
-        response = requests.get(url)
-        response.raise_for_status()
-
-        img = Image.open(BytesIO(response.content))
+        # 下载图片（相同 URL 直接使用缓存）
+        data = self._fetch_image(url)
 
         # 保存
         if output_path is None:
             output_path = f"output/memegen_{template}.{format}"
 
-        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
-        img.save(output_path)
+        output_path = self._write_output(data, output_path, format)
 
         print(f"✅ 已保存: {output_path}")
 
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+本地 Memegen 渲染器 - 不依赖 api.memegen.link 的梗图生成
+
+MemegenAPI 每次渲染都要请求 api.memegen.link，延迟取决于网络，断网时直接失败。
+这里用本地缓存的模板空白底图 + 文字框几何表，用项目自己的文字渲染引擎绘制:
+
+- 底图: 首次使用时从 memegen 下载 /images/<模板>.png（空白模板）并缓存到
+        cache/memegen/blanks，之后只读本地文件（进程内也会缓存解码后的图片）
+- 文字框: TEMPLATE_GEOMETRY 记录 POPULAR_TEMPLATES 中每个模板的文字框位置
+          （相对宽高），未列出的框按经典的上下两行排列
+- 文字: text_layout.fit_text 自动换行 + 二分字号，text_render 描边绘制
+
+不支持的参数（自定义字体 / 样式 / 背景、GIF 动图等）返回 None，由调用方回退到远程 API。
+"""
+
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from PIL import Image, ImageColor
+
+from .caption_meme import CaptionMeme
+from .image_io import save_image
+from .text_layout import fit_text, is_cjk, measure, tokenize
+from .text_render import draw_sprite, load_font, text_bbox
+
+
+BLANK_DIR = os.path.join(os.getenv("MEMEGEN_CACHE_DIR", "cache/memegen"), "blanks")
+
+
+class TextBox:
+    """
+    文字框（坐标、尺寸都是相对图片宽高的比例）
+
+    Attributes:
+        x, y: 左上角
+        width, height: 尺寸
+        valign: 文字在框内的垂直对齐（"top" / "center" / "bottom"）
+    """
+
+    __slots__ = ("x", "y", "width", "height", "valign")
+
+    def __init__(self, x: float, y: float, width: float, height: float, valign: str = "center"):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.valign = valign
+
+    def to_pixels(self, image_size: Tuple[int, int]) -> Tuple[int, int, int, int]:
+        """换算为像素 (left, top, width, height)"""
+        image_width, image_height = image_size
+        return (
+            int(self.x * image_width),
+            int(self.y * image_height),
+            int(self.width * image_width),
+            int(self.height * image_height),
+        )
+
+
+# 经典上下两行（memegen 的默认布局）
+TOP_BOTTOM = (
+    TextBox(0.025, 0.02, 0.95, 0.22, "top"),
+    TextBox(0.025, 0.76, 0.95, 0.22, "bottom"),
+)
+
+
+class LocalMemegenRenderer:
+    """本地 memegen 兼容渲染器"""
+
+    # 模板 → 文字框（按 memegen 的文字行顺序）
+    TEMPLATE_GEOMETRY: Dict[str, Tuple[TextBox, ...]] = {
+        # Drake: 右侧上下两格
+        "drake": (
+            TextBox(0.52, 0.02, 0.46, 0.46),
+            TextBox(0.52, 0.52, 0.46, 0.46),
+        ),
+        # Distracted Boyfriend: 路过的女生 / 男友 / 女友
+        "db": (
+            TextBox(0.05, 0.55, 0.35, 0.25),
+            TextBox(0.42, 0.40, 0.26, 0.25),
+            TextBox(0.68, 0.50, 0.30, 0.25),
+        ),
+        # Two Spider-Men: 左右各一个
+        "spiderman": (
+            TextBox(0.02, 0.02, 0.46, 0.3, "top"),
+            TextBox(0.52, 0.02, 0.46, 0.3, "top"),
+        ),
+        # Running Away Balloon: 气球 / 拉人的人
+        "balloon": (
+            TextBox(0.52, 0.02, 0.46, 0.25, "top"),
+            TextBox(0.02, 0.52, 0.46, 0.25),
+        ),
+        "both": TOP_BOTTOM,
+        "fine": TOP_BOTTOM,
+        "surprised": TOP_BOTTOM,
+        "afraid": TOP_BOTTOM,
+        "aag": TOP_BOTTOM,
+        "oprah": TOP_BOTTOM,
+        "buzz": TOP_BOTTOM,
+        "astronaut": TOP_BOTTOM,
+        "blb": TOP_BOTTOM,
+        "awkward": TOP_BOTTOM,
+        "boat": TOP_BOTTOM,
+        "iw": TOP_BOTTOM,
+    }
+
+    # memegen 字体名 → CaptionMeme 字体风格（其余字体交给远程 API）
+    FONT_STYLES = {
+        None: "impact",
+        "impact": "impact",
+        "thick": "impact",
+        "titilliumweb": "impact",
+    }
+
+    # 输出格式 → 编码预设（GIF 模板通常是动图，交给远程 API）
+    FORMAT_PRESETS = {
+        "png": "png",
+        "jpg": "jpeg",
+        "jpeg": "jpeg",
+        "webp": "webp",
+    }
+
+    def __init__(
+        self,
+        base_url: str = "https://api.memegen.link",
+        session: Optional[requests.Session] = None,
+        blank_dir: str = BLANK_DIR,
+        caption: Optional[CaptionMeme] = None
+    ):
+        """
+        Args:
+            base_url: 下载空白模板的 memegen 地址
+            session: HTTP 会话（None 时使用 requests 默认会话）
+            blank_dir: 空白模板缓存目录
+            caption: 提供字体的 CaptionMeme（None 时新建）
+        """
+        self.base_url = base_url
+        self.session = session if session is not None else requests.Session()
+        self.blank_dir = Path(blank_dir)
+        self.caption = caption if caption is not None else CaptionMeme()
+
+        self._blanks: Dict[str, Image.Image] = {}
+        self._blank_lock = threading.Lock()
+
+    def supports(self, template: str) -> bool:
+        """是否有该模板的文字框几何信息"""
+        return template in self.TEMPLATE_GEOMETRY
+
+    def blank(self, template: str) -> Image.Image:
+        """
+        获取空白模板底图（内存 → 磁盘 → 下载一次）
+
+        Returns:
+            RGB 底图（共享对象，调用方不要修改）
+
+        Raises:
+            requests.RequestException: 本地没有缓存且下载失败
+        """
+        with self._blank_lock:
+            img = self._blanks.get(template)
+            if img is not None:
+                return img
+
+            path = self.blank_dir / f"{template}.png"
+            if not path.exists():
+                print(f"⬇️  下载空白模板: {template}")
+                response = self.session.get(f"{self.base_url}/images/{template}.png", timeout=30)
+                response.raise_for_status()
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+                tmp_path.write_bytes(response.content)
+                os.replace(tmp_path, path)
+
+            img = Image.open(path).convert("RGB")
+            self._blanks[template] = img
+            return img
+
+    def prefetch(self, templates: Optional[List[str]] = None) -> Dict[str, bool]:
+        """
+        预先下载空白模板（默认 TEMPLATE_GEOMETRY 中的所有模板）
+
+        Returns:
+            {模板: 是否可用}
+        """
+        result = {}
+        for template in templates or list(self.TEMPLATE_GEOMETRY):
+            try:
+                self.blank(template)
+                result[template] = True
+            except (requests.RequestException, OSError) as e:
+                print(f"⚠️  无法获取空白模板 {template}: {e}")
+                result[template] = False
+        return result
+
+    def render(
+        self,
+        template: str,
+        lines: List[str],
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        font: Optional[str] = None,
+        color: Optional[str] = None
+    ) -> Image.Image:
+        """
+        渲染梗图
+
+        Args:
+            template: memegen 模板 id（如 "drake"）
+            lines: 每个文字框的文字（空字符串或 "_" 表示留空）
+            width / height: 输出尺寸（只给一个时保持比例）
+            font: memegen 字体名（见 FONT_STYLES）
+            color: 文字颜色 "文字色,描边色"（与 memegen 的 color 参数一致）
+
+        Returns:
+            RGB 图片
+        """
+        img = self.blank(template).copy()
+        if width or height:
+            img = img.resize(self._target_size(img.size, width, height), Image.LANCZOS)
+
+        text_color, outline_color = "white", "black"
+        if color:
+            colors = color.split(",")
+            text_color = colors[0] or text_color
+            if len(colors) > 1 and colors[1]:
+                outline_color = colors[1]
+
+        boxes = self.TEMPLATE_GEOMETRY.get(template, TOP_BOTTOM)
+        outline_width = max(1, min(img.size) // 150)
+
+        for text, box in zip(lines, boxes):
+            text = text.strip()
+            if not text or text == "_":
+                continue
+
+            # 与 memegen 默认样式一致：英文全部大写
+            has_chinese = self.caption._has_chinese(text)
+            if not has_chinese:
+                text = text.upper()
+            font_path = self._font_path(self.FONT_STYLES[font], has_chinese)
+
+            left, top, box_width, box_height = box.to_pixels(img.size)
+            min_size = max(10, img.width // 60)
+            max_size = self._max_font_size(text, font_path, box_width, min_size, max(12, img.width // 9))
+            layout = fit_text(text, font_path, box_width, box_height, min_size=min_size, max_size=max_size)
+            sprite, padding, _, _ = self.caption._render_caption(
+                layout.text, font_path, layout.font_size, False,
+                text_color, outline_color, outline_width, img.width, layout.spacing
+            )
+
+            # 按实际墨迹的包围盒对齐（字体的上伸部留白不计入）
+            ink_left, ink_top, ink_right, ink_bottom = (int(v) for v in text_bbox(
+                layout.text, load_font(font_path, layout.font_size), spacing=layout.spacing
+            ))
+            x = left + (box_width - (ink_right - ink_left)) // 2 - ink_left
+            if box.valign == "top":
+                y = top - ink_top
+            elif box.valign == "bottom":
+                y = top + box_height - ink_bottom
+            else:
+                y = top + (box_height - (ink_bottom - ink_top)) // 2 - ink_top
+
+            draw_sprite(img, sprite, (x - padding, y - padding))
+
+        return img
+
+    def generate_meme(
+        self,
+        template: str,
+        top_text: str = "",
+        bottom_text: str = "",
+        output_path: Optional[str] = None,
+        format: str = "png",
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        font: Optional[str] = None,
+        style: Optional[str] = None,
+        layout: Optional[str] = None,
+        background: Optional[str] = None,
+        color: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        与 MemegenAPI.generate_meme 参数一致的本地渲染
+
+        Returns:
+            输出图片路径；本地无法渲染（未知模板、不支持的参数、底图不可用）时返回 None
+        """
+        return self.generate_custom(
+            template, [top_text, bottom_text], output_path=output_path, format=format,
+            width=width, height=height, font=font, style=style, layout=layout,
+            background=background, color=color
+        )
+
+    def generate_custom(
+        self,
+        template: str,
+        lines: List[str],
+        output_path: Optional[str] = None,
+        format: str = "png",
+        **options
+    ) -> Optional[str]:
+        """
+        与 MemegenAPI.generate_custom 参数一致的本地渲染（多行文字）
+
+        Returns:
+            输出图片路径；本地无法渲染时返回 None
+        """
+        reason = self._unsupported_reason(template, format, options, lines)
+        if reason:
+            print(f"🌐 本地渲染不支持（{reason}），使用 memegen API")
+            return None
+
+        try:
+            img = self.render(
+                template, lines,
+                width=options.get("width"), height=options.get("height"),
+                font=options.get("font"), color=options.get("color")
+            )
+        except (requests.RequestException, OSError) as e:
+            print(f"⚠️  空白模板不可用，使用 memegen API: {e}")
+            return None
+
+        if output_path is None:
+            output_path = f"output/memegen_{template}.{format}"
+        output_path = save_image(img, output_path, self.FORMAT_PRESETS[format.lower()])
+        print(f"✅ 本地渲染完成: {output_path}")
+        return output_path
+
+    def _unsupported_reason(self, template: str, format: str, options: Dict,
+                            lines: Optional[List[str]] = None) -> Optional[str]:
+        """本地无法渲染的原因（可以渲染时返回 None）"""
+        if not self.supports(template):
+            return f"模板 {template}"
+        if format.lower() not in self.FORMAT_PRESETS:
+            return f"格式 {format}"
+        if options.get("font") not in self.FONT_STYLES:
+            return f"字体 {options['font']}"
+        for name in ("style", "layout", "background"):
+            if options.get(name):
+                return f"参数 {name}"
+        if options.get("color"):
+            for color in options["color"].split(","):
+                try:
+                    if color:
+                        ImageColor.getrgb(color)
+                except ValueError:
+                    return f"颜色 {color}"
+        # 多出来的文字行没有文字框，本地渲染会把它们丢掉
+        if lines is not None and len(lines) > len(self.TEMPLATE_GEOMETRY[template]):
+            return f"{len(lines)} 行文字"
+        return None
+
+    @staticmethod
+    def _max_font_size(text: str, font_path: Optional[str], box_width: int, min_size: int, max_size: int) -> int:
+        """
+        最长的英文单词必须能放进一行（memegen 不会把单词拆开），据此限制最大字号
+
+        中日韩文字可以在任意字之间换行，不参与限制
+        """
+        words = [token for token in tokenize(text) if not token.isspace() and not is_cjk(token)]
+        if not words:
+            return max_size
+        longest = max(words, key=len)
+        width = measure(font_path, max_size, longest)
+        if width <= box_width:
+            return max_size
+        return max(min_size, int(max_size * box_width / width))
+
+    def _font_path(self, font_style: str, has_chinese: bool) -> Optional[str]:
+        if has_chinese:
+            font_file = self.caption.chinese_font_path or self.caption.font_path
+        elif font_style in self.caption.loaded_fonts:
+            font_file = self.caption.loaded_fonts[font_style]["path"]
+        else:
+            font_file = self.caption.font_path
+        return str(font_file) if font_file else None
+
+    @staticmethod
+    def _target_size(size: Tuple[int, int], width: Optional[int], height: Optional[int]) -> Tuple[int, int]:
+        """只给宽或高时按比例计算另一边"""
+        original_width, original_height = size
+        if width and height:
+            return int(width), int(height)
+        if width:
+            return int(width), max(1, round(original_height * width / original_width))
+        return max(1, round(original_width * height / original_height)), int(height)
@@ -5,10 +5,19 @@ Milady 合成引擎 - 基于 NFT 原图 + 图层叠加
 """
 
 import json
+import os
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Union
 from PIL import Image
 import random
+import threading
+import time
+
+from .cache_utils import ByteBudgetLRU
+from .compositing import composite_image
+from .image_io import save_image
+from .layer_store import LayerEntry, LayerStore
+from .nft_attributes import NFTAttributeIndex
 
 
 class MiladyComposer:
@@ -52,10 +61,25 @@ class MiladyComposer:
         "Neck"
     ]
 
+    # 重组模式的前缀缓存：从这个类别所在的 z-index 开始的 z-index 边界可以作为中间画布的检查点
+    # （Background → Hair 这段前缀很少变，用户通常只改 Hat / Overlay 等上层图层）
+    PREFIX_CHECKPOINT_FROM = "Hair"
+
+    # 进程内共享的前缀缓存 {(图层目录, 画布尺寸, 合成引擎): 缓存}
+    _shared_prefix_caches: Dict[Tuple[str, Tuple[int, int], str], ByteBudgetLRU] = {}
+    _shared_lock = threading.Lock()
+
+    # 合成引擎: "pil" 逐层 alpha_composite；"numpy" 一次向量化计算整个图层栈
+    ENGINES = ("pil", "numpy")
+
     def __init__(self,
                  nft_dir: str = "assets/milady_nfts/images",
                  layer_dir: str = "assets/milady_layers",
-                 config_path: str = "assets/milady_layers/layer_config.json"):
+                 config_path: str = "assets/milady_layers/layer_config.json",
+                 layer_store: Optional[LayerStore] = None,
+                 attribute_index: Optional[NFTAttributeIndex] = None,
+                 prefix_cache_bytes: Optional[int] = None,
+                 engine: Optional[str] = None):
         """
         初始化合成引擎
 
@@ -63,9 +87,32 @@ class MiladyComposer:
             nft_dir: NFT 原图目录
             layer_dir: 图层目录
             config_path: 图层配置文件
+            layer_store: 预缩放图层存储，None 则使用进程内共享的存储
+            attribute_index: 本地 NFT 属性索引，None 则使用进程内共享的索引
+            prefix_cache_bytes: 重组模式中间画布缓存的字节预算，None 使用进程内共享的缓存
+                                （预算为 MILADY_PREFIX_CACHE_MB）
+            engine: 合成引擎 "pil" 或 "numpy"，None 使用 MILADY_COMPOSITE_ENGINE（默认 "pil"）
         """
+        engine = engine or os.getenv("MILADY_COMPOSITE_ENGINE", "pil")
+        if engine not in self.ENGINES:
+            raise ValueError(f"未知的合成引擎: {engine}。支持: {list(self.ENGINES)}")
+        self.engine = engine
+
         self.nft_dir = Path(nft_dir)
         self.layer_dir = Path(layer_dir)
+        self.layer_store = layer_store or LayerStore.shared(
+            layer_dir=layer_dir, target_size=self.NFT_SIZE
+        )
+        self.attribute_index = attribute_index if attribute_index is not None else NFTAttributeIndex.shared()
+
+        # 重组模式的中间画布缓存 {(nft_id, 图层前缀): 画布}
+        if prefix_cache_bytes is None:
+            self.prefix_cache = self.shared_prefix_cache(self.layer_store, engine)
+        else:
+            self.prefix_cache = ByteBudgetLRU(prefix_cache_bytes)
+
+        # create_meme 使用的文字渲染器（首次使用时创建）
+        self._caption = None
 
         # 加载图层配置
         with open(config_path, 'r') as f:
@@ -85,13 +132,31 @@ class MiladyComposer:
         print(f"✅ 加载了 {len(self.nft_list)} 个 NFT 原图")
         print(f"✅ 加载了 {len(self.layer_config)} 个图层类别")
 
-    def get_random_nft_id(self) -> int:
+    @classmethod
+    def shared_prefix_cache(cls, layer_store: LayerStore, engine: str) -> ByteBudgetLRU:
+        """
+        获取进程内共享的前缀缓存
+
+        Lark Bot 和生成器会创建多个 MiladyComposer，共享缓存让它们都能命中同一批中间画布。
+        """
+        key = (str(layer_store.layer_dir), tuple(layer_store.target_size), engine)
+        with cls._shared_lock:
+            cache = cls._shared_prefix_caches.get(key)
+            if cache is None:
+                cache = ByteBudgetLRU(int(os.getenv("MILADY_PREFIX_CACHE_MB", "256")) * 1024 * 1024)
+                cls._shared_prefix_caches[key] = cache
+            return cache
+
+    def get_random_nft_id(self, rng: Optional[random.Random] = None) -> int:
         """随机选择一个 NFT ID"""
-        return random.randint(0, 9999)
+        return (rng or random).randint(0, 9999)
 
     def get_nft_attributes(self, nft_id: int) -> Optional[Dict]:
         """
-        从官方 API 获取 NFT 的属性
+        获取 NFT 的属性
+
+        优先查本地属性索引（O(1)，离线可用），索引中没有时才请求官方 API，
+        并把结果写回索引（延迟合并写盘）
 
         Args:
             nft_id: NFT ID
@@ -99,19 +164,19 @@ class MiladyComposer:
         Returns:
             属性字典，如 {"Background": "tennis", "Race": "clay", "Hair": "og orange"}
         """
+        attributes = self.attribute_index.get(nft_id)
+        if attributes:
+            return attributes
+
         try:
             import requests
             url = f"https://www.miladymaker.net/milady/json/{nft_id}"
             response = requests.get(url, timeout=10)
             if response.status_code == 200:
-                data = response.json()
-                attributes = {}
-                for attr in data.get('attributes', []):
-                    trait_type = attr['trait_type']
-                    value = attr['value']
-                    # 跳过非图层属性
-                    if trait_type not in ['Drip Score', 'Core', 'Number']:
-                        attributes[trait_type] = value
+                attributes = NFTAttributeIndex.extract_attributes(response.json())
+                if attributes:
+                    self.attribute_index.put(nft_id, attributes)
+                    self.attribute_index.schedule_save()
                 return attributes
         except Exception as e:
             print(f"⚠️  无法获取 NFT #{nft_id} 的属性: {e}")
@@ -216,16 +281,13 @@ class MiladyComposer:
         # 4. 按 z-index 排序
         layers_to_compose.sort(key=lambda x: x[0])
 
-        # 5. 开始合成
-        canvas = None
-        for z, category, filename in layers_to_compose:
-            layer_img = self.load_layer(category, filename)
-            if layer_img:
-                if canvas is None:
-                    canvas = layer_img
-                else:
-                    canvas = Image.alpha_composite(canvas, layer_img)
-                print(f"✅ 叠加 {category}: {filename} (z={z})")
+        # 5. 开始合成（复用缓存中最长的已合成前缀，只混合变化的后缀）
+        # 第一个被替换 / 新增的图层之前都是 NFT 自身的图层，这段前缀下次还能复用
+        stable = next(
+            (i for i, (_, category, _) in enumerate(layers_to_compose) if category in normalized_replacements),
+            len(layers_to_compose)
+        )
+        canvas = self._compose_layer_stack(nft_id, layers_to_compose, stable)
 
         # 6. 调整输出尺寸
         if canvas and output_size != self.NFT_SIZE:
@@ -233,6 +295,89 @@ class MiladyComposer:
 
         return canvas
 
+    def _prefix_checkpoints(self, layers: List[Tuple[int, str, str]]) -> List[int]:
+        """
+        计算可缓存的前缀长度（z-index 边界）
+
+        Args:
+            layers: 按 z-index 排好序的 [(z, category, filename)]
+
+        Returns:
+            前缀长度列表（升序），包含完整长度
+        """
+        min_z = self.layer_z_index.get(self.PREFIX_CHECKPOINT_FROM, 0)
+        checkpoints = [
+            i for i in range(1, len(layers))
+            if layers[i][0] != layers[i - 1][0] and layers[i][0] >= min_z
+        ]
+        checkpoints.append(len(layers))
+        return checkpoints
+
+    def _compose_layer_stack(self, nft_id: int,
+                             layers: List[Tuple[int, str, str]],
+                             stable: Optional[int] = None) -> Optional[Image.Image]:
+        """
+        按顺序合成图层栈，复用前缀缓存
+
+        只保存一个快照：不超过 stable 的最后一个检查点（之后的图层是本次替换的，
+        下次请求多半会换掉），避免冷启动时在每个检查点都复制整张画布。
+
+        Args:
+            nft_id: NFT ID（缓存键的一部分）
+            layers: 按 z-index 排好序的 [(z, category, filename)]
+            stable: 前多少个图层是 NFT 自身的图层（None 表示全部）
+
+        Returns:
+            合成后的画布，没有任何图层成功加载时返回 None
+        """
+        stack = tuple((category, filename) for _, category, filename in layers)
+        checkpoints = self._prefix_checkpoints(layers)
+        if stable is None:
+            stable = len(layers)
+        snapshot_at = max((n for n in checkpoints if n <= stable), default=0)
+
+        # 从最长的前缀开始查找
+        candidate_keys = [(nft_id, stack[:n]) for n in reversed(checkpoints)]
+        hit_key, cached = self.prefix_cache.get_first(candidate_keys)
+
+        if cached is not None:
+            start = len(hit_key[1])
+            canvas = cached.copy()
+            composed_any = True
+            print(f"♻️  复用已合成的前缀（{start}/{len(stack)} 个图层）")
+        else:
+            start = 0
+            canvas = Image.new('RGBA', self.NFT_SIZE, (0, 0, 0, 0))
+            composed_any = False
+
+        # 逐段合成（每段到下一个 z-index 边界为止），在 snapshot_at 处保存快照
+        for end in checkpoints:
+            if end <= start:
+                continue
+
+            entries = []
+            for z, category, filename in layers[start:end]:
+                entry = self._get_layer_entry(category, filename)
+                if entry is not None:
+                    entries.append(entry)
+                    print(f"✅ 叠加 {category}: {filename} (z={z})")
+
+            if entries:
+                canvas = self._composite(canvas, entries)
+                composed_any = True
+
+            if composed_any and end == snapshot_at:
+                snapshot = canvas.copy()
+                self.prefix_cache.put((nft_id, stack[:end]), snapshot,
+                                      snapshot.width * snapshot.height * 4)
+            start = end
+
+        return canvas if composed_any else None
+
+    def prefix_cache_stats(self) -> Dict:
+        """重组模式前缀缓存的统计信息（命中率、占用字节等）"""
+        return self.prefix_cache.stats()
+
     def load_nft(self, nft_id: int) -> Optional[Image.Image]:
         """
         加载 NFT 原图
@@ -258,7 +403,9 @@ class MiladyComposer:
 
     def load_layer(self, category: str, image_name: str) -> Optional[Image.Image]:
         """
-        加载图层并缩放到 NFT 尺寸
+        加载图层（已缩放到 NFT 尺寸）
+
+        图层从预缩放图层存储读取，避免每次解码 2000x2500 的 PNG 再缩放
 
         Args:
             category: 图层类别（如 "Hat"）
@@ -267,25 +414,64 @@ class MiladyComposer:
         Returns:
             缩放后的 PIL Image 或 None
         """
-        layer_path = self.layer_dir / category / image_name
+        try:
+            layer = self.layer_store.get_image(category, image_name)
+        except Exception as e:
+            print(f"❌ 加载图层失败 {category}/{image_name}: {e}")
+            return None
 
-        if not layer_path.exists():
+        if layer is None:
             print(f"⚠️  图层不存在: {category}/{image_name}")
-            return None
+        return layer
 
+    def _get_layer_entry(self, category: str, image_name: str) -> Optional[LayerEntry]:
+        """从图层存储获取裁剪后的图层，失败时打印原因并返回 None"""
         try:
-            # 加载图层（2000x2500）
-            layer = Image.open(layer_path).convert('RGBA')
-
-            # 缩放到 NFT 尺寸（1000x1250）
-            layer_resized = layer.resize(self.NFT_SIZE, Image.Resampling.LANCZOS)
-
-            return layer_resized
-
+            entry = self.layer_store.get(category, image_name)
         except Exception as e:
             print(f"❌ 加载图层失败 {category}/{image_name}: {e}")
             return None
 
+        if entry is None:
+            print(f"⚠️  图层不存在: {category}/{image_name}")
+        return entry
+
+    def _composite(self, canvas: Image.Image, entries: List[LayerEntry]) -> Image.Image:
+        """
+        用当前引擎把一组图层（从下到上）合成到画布上
+
+        - pil: 逐层只混合 alpha 包围盒区域（原地修改 canvas）
+        - numpy: 所有图层叠成一个数组，一次向量化计算（返回新画布）
+        """
+        if self.engine == "numpy":
+            return composite_image(canvas, entries)
+
+        for entry in entries:
+            entry.blend_into(canvas)
+        return canvas
+
+    def blend_layer(self, canvas: Image.Image, category: str, image_name: str) -> bool:
+        """
+        把图层叠加到画布上（原地修改 canvas）
+
+        只混合图层 alpha 包围盒内的区域，帽子、眼镜这类几乎全透明的图层
+        不再需要对整张 1000x1250 画布做 alpha_composite
+
+        Args:
+            canvas: NFT 尺寸的 RGBA 画布
+            category: 图层类别
+            image_name: 图层文件名
+
+        Returns:
+            是否成功叠加
+        """
+        entry = self._get_layer_entry(category, image_name)
+        if entry is None:
+            return False
+
+        entry.blend_into(canvas)
+        return True
+
     def _normalize_layers(self, layers: Optional[Union[Dict[str, str], Dict[str, List[str]]]]) -> Dict[str, List[str]]:
         """
         统一图层格式为 Dict[str, List[str]]
@@ -339,22 +525,27 @@ class MiladyComposer:
         else:
             canvas = bg_layer
 
-        # 2. 加载并叠加皮肤基础图
-        skin_layer = self.load_layer("UnclothedBase", skin)
-        if skin_layer:
-            canvas = Image.alpha_composite(canvas, skin_layer)
+        entries = []
+
+        # 2. 加载皮肤基础图
+        skin_entry = self._get_layer_entry("UnclothedBase", skin)
+        if skin_entry is not None:
+            entries.append(skin_entry)
             print(f"✅ 叠加皮肤: {skin}")
 
-        # 3. 统一图层格式并叠加
+        # 3. 统一图层格式并加载
         normalized_layers = self._normalize_layers(layers)
         if normalized_layers:
             for category, image_names in normalized_layers.items():
                 for image_name in image_names:
-                    layer_img = self.load_layer(category, image_name)
-                    if layer_img:
-                        canvas = Image.alpha_composite(canvas, layer_img)
+                    entry = self._get_layer_entry(category, image_name)
+                    if entry is not None:
+                        entries.append(entry)
                         print(f"✅ 叠加 {category}: {image_name}")
 
+        # 4. 合成
+        canvas = self._composite(canvas, entries)
+
         # 调整输出尺寸
         if output_size != self.NFT_SIZE:
             canvas = canvas.resize(output_size, Image.Resampling.LANCZOS)
@@ -364,7 +555,8 @@ class MiladyComposer:
     def compose(self,
                 nft_id: Optional[int] = None,
                 layers: Optional[Union[Dict[str, str], Dict[str, List[str]]]] = None,
-                output_size: Tuple[int, int] = (1000, 1250)) -> Optional[Image.Image]:
+                output_size: Tuple[int, int] = (1000, 1250),
+                rng: Optional[random.Random] = None) -> Optional[Image.Image]:
         """
         合成 Milady 图片
 
@@ -374,6 +566,7 @@ class MiladyComposer:
                    格式1: {"Hat": "Cowboy Hat.png", "Glasses": "Sunglasses.png"}
                    格式2: {"Overlay": ["Gunpoint.png", "Birthday Hat.png"]}
             output_size: 输出尺寸
+            rng: 随机选择 NFT 时使用的随机数生成器，None 使用全局 random
 
         Returns:
             合成后的图片
@@ -393,7 +586,7 @@ class MiladyComposer:
         """
         # 选择 NFT
         if nft_id is None:
-            nft_id = self.get_random_nft_id()
+            nft_id = self.get_random_nft_id(rng)
 
         # 加载 NFT 原图作为基础
         canvas = self.load_nft(nft_id)
@@ -406,22 +599,23 @@ class MiladyComposer:
         # 统一图层格式
         normalized_layers = self._normalize_layers(layers)
 
-        # 叠加图层（所有图层都缩放到 NFT 尺寸再叠加）
+        # 叠加图层（图层已预缩放到 NFT 尺寸，只混合 alpha 包围盒区域）
+        entries = []
         if normalized_layers:
             for category, image_names in normalized_layers.items():
                 if category not in self.OVERLAY_LAYERS:
                     print(f"⚠️  跳过 {category}（不是可叠加图层）")
                     continue
 
-                # 逐个叠加该类别下的所有图层
+                # 逐个加载该类别下的所有图层
                 for image_name in image_names:
-                    layer_img = self.load_layer(category, image_name)
-                    if layer_img:
-                        # load_layer 已经把图层缩放到 NFT 尺寸 (1000x1250)
-                        # 使用 alpha 通道进行叠加
-                        canvas = Image.alpha_composite(canvas, layer_img)
+                    entry = self._get_layer_entry(category, image_name)
+                    if entry is not None:
+                        entries.append(entry)
                         print(f"✅ 叠加 {category}: {image_name}")
 
+        canvas = self._composite(canvas, entries)
+
         # 最后才调整到输出尺寸（如果需要）
         if output_size != self.NFT_SIZE:
             canvas = canvas.resize(output_size, Image.Resampling.LANCZOS)
@@ -432,7 +626,8 @@ class MiladyComposer:
     def compose_random(self,
                        nft_id: Optional[int] = None,
                        num_layers: int = 2,
-                       output_size: Tuple[int, int] = (1000, 1250)) -> Optional[Image.Image]:
+                       output_size: Tuple[int, int] = (1000, 1250),
+                       rng: Optional[random.Random] = None) -> Optional[Image.Image]:
         """
         随机合成 Milady（随机选择图层）
 
@@ -440,12 +635,14 @@ class MiladyComposer:
             nft_id: NFT ID，如果为 None 则随机选择
             num_layers: 随机添加的图层数量
             output_size: 输出尺寸
+            rng: 随机数生成器，None 使用全局 random
 
         Returns:
             合成后的图片
         """
         # 随机选择要叠加的图层类别
-        selected_categories = random.sample(
+        rng = rng or random
+        selected_categories = rng.sample(
             self.OVERLAY_LAYERS,
             min(num_layers, len(self.OVERLAY_LAYERS))
         )
@@ -454,10 +651,10 @@ class MiladyComposer:
         layers = {}
         for category in selected_categories:
             if category in self.layer_config and self.layer_config[category]:
-                image_name = random.choice(self.layer_config[category])
+                image_name = rng.choice(self.layer_config[category])
                 layers[category] = image_name
 
-        return self.compose(nft_id=nft_id, layers=layers, output_size=output_size)
+        return self.compose(nft_id=nft_id, layers=layers, output_size=output_size, rng=rng)
 
     def get_available_layers(self, category: str) -> List[str]:
         """
@@ -477,7 +674,8 @@ class MiladyComposer:
                     top_text: str = "",
                     bottom_text: str = "",
                     all_caps: bool = True,
-                    output_path: Optional[str] = None) -> Optional[str]:
+                    output_path: Optional[str] = None,
+                    preset: Optional[str] = None) -> Optional[str]:
         """
         创建带文字的 Milady Meme
 
@@ -487,6 +685,7 @@ class MiladyComposer:
             top_text: 顶部文字
             bottom_text: 底部文字
             output_path: 输出路径
+            preset: 输出编码预设（fast_png / png / webp / jpeg），None 使用默认预设
 
         Returns:
             输出文件路径
@@ -498,9 +697,10 @@ class MiladyComposer:
 
         # 如果有文字，使用 CaptionMeme 添加
         if top_text or bottom_text:
-            from .caption_meme import CaptionMeme
-            caption = CaptionMeme()
-            img = caption.add_caption(img, top_text, bottom_text, all_caps=all_caps)
+            if self._caption is None:
+                from .caption_meme import CaptionMeme
+                self._caption = CaptionMeme()
+            img = self._caption.add_caption(img, top_text, bottom_text, all_caps=all_caps)
 
         # 保存
         if output_path is None:
@@ -509,7 +709,7 @@ class MiladyComposer:
             timestamp = int(time.time())
             output_path = str(output_dir / f"milady_meme_{timestamp}.png")
 
-        img.save(output_path)
+        output_path = save_image(img, output_path, preset)
         print(f"💾 保存到: {output_path}")
 
         return output_path
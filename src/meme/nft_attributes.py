@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+NFT 属性索引 - 本地列式存储 10,000 个 Milady 的属性
+
+替代每次合成都请求 miladymaker.net 的做法：属性按 trait 分列存储，
+每列是 uint16 编码，编码对应各 trait 的取值词表。
+
+存储结构:
+    cache/nft_attributes/codes.npy   (token 数, trait 数) uint16，MISSING 表示无此属性
+    cache/nft_attributes/vocab.json  {"traits": [...], "values": {trait: [...]}}
+
+网络补充的属性通过 schedule_save() 延迟合并写盘；写盘时持有目录下的文件锁，
+磁盘上的索引被其他进程更新过时先重新加载再合并，不会丢失对方写入的 token。
+"""
+
+import atexit
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: 只做进程内加锁
+    fcntl = None
+
+
+@contextmanager
+def _file_lock(path: Path):
+    """跨进程的排他文件锁"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class NFTAttributeIndex:
+    """
+    Milady NFT 属性索引
+
+    - 查询: O(1)，直接按 token id 取行并解码
+    - 构建: 从 assets/milady_nfts/metadata/*.json 或 milady_*_info.json 一次性构建
+    - 缺失: 由调用方从网络获取后通过 put() 补充
+    """
+
+    MISSING = 0xFFFF
+
+    # 不是图层的属性
+    SKIP_TRAITS = {"Drip Score", "Core", "Number"}
+
+    # schedule_save() 的延迟（秒），期间补充的属性合并成一次写盘
+    SAVE_DELAY = 5.0
+
+    _shared: Dict[str, "NFTAttributeIndex"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        index_dir: str = "cache/nft_attributes",
+        max_tokens: int = 10000,
+    ):
+        """
+        Args:
+            index_dir: 索引存储目录
+            max_tokens: token 总数（Milady 为 10,000）
+        """
+        self.index_dir = Path(index_dir)
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+
+        # 上次保存后 put() 的 token（写盘前与磁盘上的新版本合并）
+        self._pending: Dict[int, Dict[str, str]] = {}
+        self._save_timer: Optional[threading.Timer] = None
+        self._flush_registered = False
+
+        self._reset()
+        self._load()
+
+    @classmethod
+    def shared(cls, index_dir: str = "cache/nft_attributes") -> "NFTAttributeIndex":
+        """
+        获取进程内共享的属性索引
+
+        MiladyComposer、LocalAccessoryDetector 等共用一份索引，只加载一次，网络补充的属性彼此可见。
+        """
+        key = str(Path(index_dir))
+        with cls._shared_lock:
+            index = cls._shared.get(key)
+            if index is None:
+                index = cls(index_dir)
+                cls._shared[key] = index
+            return index
+
+    @property
+    def codes_path(self) -> Path:
+        return self.index_dir / "codes.npy"
+
+    @property
+    def vocab_path(self) -> Path:
+        return self.index_dir / "vocab.json"
+
+    @property
+    def lock_path(self) -> Path:
+        return self.index_dir / ".lock"
+
+    def _reset(self):
+        """清空内存中的索引"""
+        self.traits: List[str] = []
+        self.values: Dict[str, List[str]] = {}
+        self._value_codes: Dict[str, Dict[str, int]] = {}
+        self.codes = np.full((self.max_tokens, 0), self.MISSING, dtype=np.uint16)
+
+    def _disk_version(self) -> Optional[Tuple[int, int]]:
+        """
+        磁盘上索引文件的版本（用于判断是否被其他进程更新过）
+
+        每次保存都用 os.replace 换成新文件，inode 会变，不依赖修改时间的精度
+        """
+        try:
+            stat = self.codes_path.stat()
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _load(self):
+        """从磁盘加载索引（不存在则保持为空）"""
+        self._loaded_version = self._disk_version()
+        if not (self.codes_path.exists() and self.vocab_path.exists()):
+            return
+
+        try:
+            with open(self.vocab_path, "r", encoding="utf-8") as f:
+                vocab = json.load(f)
+            codes = np.load(self.codes_path)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  NFT 属性索引损坏，忽略: {e}")
+            return
+
+        if codes.shape != (self.max_tokens, len(vocab["traits"])):
+            print(f"⚠️  NFT 属性索引尺寸不匹配 {codes.shape}，忽略")
+            return
+
+        self.traits = vocab["traits"]
+        self.values = vocab["values"]
+        self._value_codes = {
+            trait: {value: code for code, value in enumerate(values)}
+            for trait, values in self.values.items()
+        }
+        self.codes = codes
+
+    def save(self):
+        """
+        原子写入索引文件
+
+        磁盘上的索引在加载后被其他进程更新过时，先重新加载，再合并本进程 put() 的 token。
+        """
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock, _file_lock(self.lock_path):
+            if self._disk_version() != self._loaded_version:
+                pending = self._pending
+                self._reset()
+                self._load()
+                for nft_id, attributes in pending.items():
+                    self._put(nft_id, attributes)
+
+            tmp_codes = self.index_dir / f".codes.{os.getpid()}.tmp.npy"
+            tmp_vocab = self.index_dir / f".vocab.{os.getpid()}.tmp.json"
+            np.save(tmp_codes, self.codes)
+            with open(tmp_vocab, "w", encoding="utf-8") as f:
+                json.dump({"traits": self.traits, "values": self.values}, f, ensure_ascii=False)
+            os.replace(tmp_vocab, self.vocab_path)
+            os.replace(tmp_codes, self.codes_path)
+
+            self._pending = {}
+            self._loaded_version = self._disk_version()
+
+    def schedule_save(self, delay: Optional[float] = None):
+        """
+        延迟写盘（SAVE_DELAY 秒内的多次调用合并成一次 save()）
+
+        进程退出时会写入尚未保存的属性。
+        """
+        with self._lock:
+            if not self._flush_registered:
+                atexit.register(self.flush)
+                self._flush_registered = True
+            if self._save_timer is not None:
+                return
+            timer = threading.Timer(self.SAVE_DELAY if delay is None else delay, self.flush)
+            timer.daemon = True
+            self._save_timer = timer
+        timer.start()
+
+    def flush(self):
+        """立即写入尚未保存的属性（没有时什么都不做）"""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._pending:
+                return
+        try:
+            self.save()
+        except OSError as e:
+            print(f"⚠️  NFT 属性索引保存失败: {e}")
+
+    def __len__(self) -> int:
+        """已索引的 token 数量"""
+        if not self.traits:
+            return 0
+        return int(np.count_nonzero((self.codes != self.MISSING).any(axis=1)))
+
+    def __contains__(self, nft_id: int) -> bool:
+        return self.get(nft_id) is not None
+
+    def get(self, nft_id: int) -> Optional[Dict[str, str]]:
+        """
+        查询 NFT 属性
+
+        Returns:
+            属性字典，如 {"Background": "tennis", "Race": "clay", "Hair": "og orange"}，
+            未收录时返回 None
+        """
+        if not 0 <= nft_id < self.max_tokens or not self.traits:
+            return None
+
+        row = self.codes[nft_id]
+        attributes = {
+            trait: self.values[trait][code]
+            for trait, code in zip(self.traits, row.tolist())
+            if code != self.MISSING
+        }
+        return attributes or None
+
+    def put(self, nft_id: int, attributes: Dict[str, str]):
+        """
+        写入（或覆盖）一个 NFT 的属性（仅内存，需调用 save() / schedule_save() 持久化）
+
+        Args:
+            nft_id: NFT ID
+            attributes: 属性字典
+        """
+        if not 0 <= nft_id < self.max_tokens:
+            raise ValueError(f"NFT ID 超出范围: {nft_id}")
+
+        with self._lock:
+            self._put(nft_id, attributes)
+            self._pending[nft_id] = dict(attributes)
+
+    def _put(self, nft_id: int, attributes: Dict[str, str]):
+        """写入一行（调用方持有 _lock）"""
+        row = np.full(len(self.traits), self.MISSING, dtype=np.uint16)
+        for trait, value in attributes.items():
+            if trait in self.SKIP_TRAITS:
+                continue
+            if trait not in self._value_codes:
+                self._add_trait(trait)
+                row = np.append(row, np.uint16(self.MISSING))
+
+            value_codes = self._value_codes[trait]
+            if value not in value_codes:
+                value_codes[value] = len(self.values[trait])
+                self.values[trait].append(value)
+            row[self.traits.index(trait)] = value_codes[value]
+
+        self.codes[nft_id] = row
+
+    def _add_trait(self, trait: str):
+        """新增一列 trait"""
+        self.traits.append(trait)
+        self.values[trait] = []
+        self._value_codes[trait] = {}
+        new_column = np.full((self.max_tokens, 1), self.MISSING, dtype=np.uint16)
+        self.codes = np.hstack([self.codes, new_column])
+
+    @classmethod
+    def extract_attributes(cls, metadata: Dict) -> Dict[str, str]:
+        """
+        从 NFT metadata JSON 中提取图层属性
+
+        Args:
+            metadata: 包含 "attributes": [{"trait_type": ..., "value": ...}] 的字典
+
+        Returns:
+            {trait_type: value}（跳过非图层属性）
+        """
+        attributes = {}
+        for attr in metadata.get("attributes", []):
+            trait_type = attr.get("trait_type")
+            value = attr.get("value")
+            if trait_type and value is not None and trait_type not in cls.SKIP_TRAITS:
+                attributes[trait_type] = str(value)
+        return attributes
+
+    def build(self, metadata_files: Iterable[Path]) -> int:
+        """
+        从 metadata JSON 文件批量构建索引
+
+        支持:
+        - assets/milady_nfts/metadata/milady_{id}.json（官方 metadata）
+        - assets/milady_nfts/milady_{id}_info.json（如果包含 attributes 字段）
+
+        Args:
+            metadata_files: JSON 文件路径
+
+        Returns:
+            写入的 token 数量
+        """
+        count = 0
+        for path in metadata_files:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    metadata = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️  跳过无法解析的文件 {path}: {e}")
+                continue
+
+            nft_id = metadata.get("token_id")
+            if nft_id is None:
+                # 文件名格式 milady_{id}.json / milady_{id}_info.json
+                try:
+                    nft_id = int(Path(path).stem.split("_")[1])
+                except (IndexError, ValueError):
+                    continue
+
+            attributes = self.extract_attributes(metadata)
+            if attributes:
+                self.put(int(nft_id), attributes)
+                count += 1
+
+        return count
@@ -7,22 +7,42 @@ Prompt Enhancer - 提示词增强器
 """
 
 import os
-from typing import Optional
+import sqlite3
+from typing import Dict, Optional, Tuple
 from anthropic import Anthropic
 
+from .enhancement_cache import EnhancementCache, cache_key
+
 
 class PromptEnhancer:
     """提示词增强器 - 使用 Claude API 扩展简短提示"""
 
     MAX_LENGTH_FOR_ENHANCEMENT = 350  # 超过此长度则跳过增强
+    MODEL = "claude-3-5-haiku-20241022"  # 使用 Haiku 快速且便宜
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        cache: Optional[EnhancementCache] = None,
+        use_cache: Optional[bool] = None
+    ):
         """
         初始化 Prompt Enhancer
 
         Args:
             api_key: Anthropic API key (默认从环境变量读取)
+            cache: 增强结果缓存（None 时使用默认的 SQLite 缓存）
+            use_cache: 是否缓存增强结果（默认读取环境变量 PROMPT_ENHANCER_CACHE，默认开启）
         """
+        if use_cache is None:
+            use_cache = os.getenv("PROMPT_ENHANCER_CACHE", "true").lower() in ("1", "true", "yes")
+        self.cache = None
+        if use_cache:
+            try:
+                self.cache = cache if cache is not None else EnhancementCache()
+            except (OSError, sqlite3.Error) as e:
+                print(f"⚠️ 无法打开提示词缓存，不使用缓存: {e}")
+
         # 尝试从多个环境变量读取
         self.api_key = (
             api_key or
@@ -61,15 +81,14 @@ class PromptEnhancer:
             输出: "A Milady NFT character joyfully celebrating Thanksgiving,
                    wearing a pilgrim hat, surrounded by autumn decorations..."
         """
-        # 检查是否跳过
-        if bypass:
-            print("🔄 使用 -raw 标志，跳过提示词增强")
+        if self.should_skip(prompt, bypass):
             return prompt
 
-        # 检查长度
-        if len(prompt) > self.MAX_LENGTH_FOR_ENHANCEMENT:
-            print(f"📏 提示词长度 ({len(prompt)}) 超过 {self.MAX_LENGTH_FOR_ENHANCEMENT}，跳过增强")
-            return prompt
+        # 检查缓存（API 不可用时也可以返回之前的结果）
+        key, cached = self.lookup_cache(prompt, context)
+        if cached is not None:
+            print(f"⚡ 命中提示词缓存: '{prompt}'")
+            return cached
 
         # 检查客户端
         if not self.client:
@@ -81,6 +100,7 @@ class PromptEnhancer:
             print(f"🚀 正在增强提示词: '{prompt}'")
 
             enhanced = self._call_claude_api(prompt, context)
+            self.store_cache(key, enhanced, prompt, context)
 
             print(f"✅ 增强完成")
             print(f"📝 原始: {prompt}")
@@ -93,6 +113,59 @@ class PromptEnhancer:
             print(f"🔄 返回原始提示词")
             return prompt
 
+    def should_skip(self, prompt: str, bypass: bool = False) -> bool:
+        """是否跳过增强（-raw 标志或提示词过长）"""
+        if bypass:
+            print("🔄 使用 -raw 标志，跳过提示词增强")
+            return True
+
+        if len(prompt) > self.MAX_LENGTH_FOR_ENHANCEMENT:
+            print(f"📏 提示词长度 ({len(prompt)}) 超过 {self.MAX_LENGTH_FOR_ENHANCEMENT}，跳过增强")
+            return True
+
+        return False
+
+    def lookup_cache(self, prompt: str, context: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        查询增强结果缓存
+
+        Returns:
+            (缓存键, 缓存的增强结果)，未启用缓存时缓存键为 None，未命中时结果为 None
+        """
+        if self.cache is None:
+            return None, None
+
+        key = cache_key(prompt, context, self.MODEL, self._build_system_prompt(context))
+        try:
+            return key, self.cache.get(key)
+        except sqlite3.Error as e:
+            print(f"⚠️ 读取提示词缓存失败: {e}")
+            return key, None
+
+    def store_cache(self, key: Optional[str], enhanced: str, prompt: str, context: str):
+        """写入增强结果缓存（key 为 None 或结果为空时忽略）"""
+        if key is None or not enhanced:
+            return
+        try:
+            self.cache.put(key, enhanced, prompt=prompt, context=context, model=self.MODEL)
+        except sqlite3.Error as e:
+            print(f"⚠️ 写入提示词缓存失败: {e}")
+
+    def request_params(self, prompt: str, context: str) -> Dict:
+        """Messages API 的请求参数（同步 / 异步客户端共用）"""
+        return {
+            "model": self.MODEL,
+            "max_tokens": 500,
+            "temperature": 0.7,
+            "system": self._build_system_prompt(context),
+            "messages": [
+                {
+                    "role": "user",
+                    "content": f"Enhance this prompt: {prompt}"
+                }
+            ],
+        }
+
     def _call_claude_api(self, prompt: str, context: str) -> str:
         """
         调用 Claude API 进行提示词增强
@@ -104,22 +177,8 @@ class PromptEnhancer:
         Returns:
             增强后的提示词
         """
-        # 构建系统提示
-        system_prompt = self._build_system_prompt(context)
-
         # 调用 API
-        response = self.client.messages.create(
-            model="claude-3-5-haiku-20241022",  # 使用 Haiku 快速且便宜
-            max_tokens=500,
-            temperature=0.7,
-            system=system_prompt,
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"Enhance this prompt: {prompt}"
-                }
-            ]
-        )
+        response = self.client.messages.create(**self.request_params(prompt, context))
 
         # 提取响应
         enhanced = response.content[0].text.strip()
@@ -187,6 +246,10 @@ Keep output under 200 words. Output ONLY the enhanced prompt."""
         """检查 Prompt Enhancer 是否可用"""
         return self.client is not None
 
+    def cache_stats(self) -> Optional[Dict]:
+        """增强结果缓存的命中率等统计（未启用缓存时返回 None）"""
+        return self.cache.stats() if self.cache is not None else None
+
 
 # CLI 测试
 if __name__ == "__main__":
@@ -5,8 +5,19 @@
 """
 
 import re
+from collections import defaultdict
 from typing import Dict, Optional, List, Tuple
 
+from .keyword_matcher import KeywordMatcher
+from .layer_index import LayerIndex, get_layer_index
+
+
+# 与 re 的 \b 一致的"单词字符"判断
+_WORD_CHAR_RE = re.compile(r"\w")
+
+# 修饰词只在同一个短语里找（"hat, black background" 的 black 不修饰 hat）
+_CLAUSE_BREAK_RE = re.compile(r"[,，。.!！?？;；、:：\n]|\band\b|\bwith\b|和")
+
 
 class PromptParser:
     """自然语言 Prompt 解析器"""
@@ -120,9 +131,117 @@ class PromptParser:
         "mcdonald": ["mcdonald", "麦当劳", "mcdonalds", "mcd", "麦当劳背景", "mcdonald背景", "mcdonald标志"]
     }
 
-    def __init__(self):
-        """初始化解析器"""
+    # 图层类别关键词找到类别但没有具体图层时使用的默认图层
+    DEFAULT_CATEGORY_LAYERS = {
+        "Hat": "Beret.png",  # 默认贝雷帽
+        "Glasses": "Sunglasses.png",  # 默认墨镜
+        "Overlay": "Heart Meme.png",  # 默认爱心
+    }
+
+    # 类别关键词前最多取几个词作为修饰词（"brown cowboy hat" → "brown cowboy"）
+    MODIFIER_WORDS = 3
+
+    # 不作为修饰词的词：虚词、动词，以及几乎每个 prompt 都有的词（"milady hat" 不是 "Trucker Gothic Milady"）
+    MODIFIER_STOPWORDS = frozenset({
+        "a", "an", "the", "this", "that", "my", "her", "his", "their", "your", "me", "i", "she",
+        "give", "make", "generate", "create", "add", "put", "want", "need", "use", "show", "draw",
+        "wear", "wears", "wearing", "in", "on", "of", "for", "to", "some", "new", "cute", "nice",
+        "please", "pls", "plz", "gm", "gn", "milady", "miladys", "meme", "memes", "pic", "picture", "image",
+    })
+
+    # 关键词组 → 关键词表（COMMON_LAYERS 单独处理：区分大小写，匹配原始 prompt）
+    KEYWORD_GROUPS = {
+        "template": "TEMPLATE_KEYWORDS",
+        "font": "FONT_KEYWORDS",
+        "layer": "LAYER_KEYWORDS",
+        "visual_style": "VISUAL_STYLE_KEYWORDS",
+        "background": "BACKGROUND_KEYWORDS",
+    }
+
+    # 类加载时由 _compile_keywords() 生成
+    _keyword_matcher: KeywordMatcher = None
+    # 关键词 → [(组名, 键, 优先级)]，优先级越小越优先（与关键词表的顺序一致）
+    _keyword_targets: Dict[str, List[Tuple[str, str, int]]] = {}
+
+    def __init__(self, layer_index: Optional[LayerIndex] = None, use_layer_index: bool = True):
+        """
+        初始化解析器
+
+        Args:
+            layer_index: 图层名索引（None 使用进程内共享的索引）
+            use_layer_index: 是否用图层名索引识别 COMMON_LAYERS 之外的图层
+        """
         self.debug = False
+        if use_layer_index and layer_index is None:
+            layer_index = get_layer_index()
+        self.layer_index = layer_index if use_layer_index else None
+
+    @classmethod
+    def _compile_keywords(cls):
+        """
+        把所有关键词表编译成一个 Aho-Corasick 自动机
+
+        优先级与原来逐个关键词扫描时的顺序一致:
+        - 模板 / 字体 / 背景: 字典顺序靠前的先命中
+        - 常用图层: 关键词长的优先（长度相同时按字典顺序）
+        """
+        targets = defaultdict(list)
+
+        for group, table_name in cls.KEYWORD_GROUPS.items():
+            for rank, (key, keywords) in enumerate(getattr(cls, table_name).items()):
+                for keyword in keywords:
+                    targets[keyword].append((group, key, rank))
+
+        sorted_layers = sorted(cls.COMMON_LAYERS, key=len, reverse=True)
+        for rank, layer_name in enumerate(sorted_layers):
+            targets[layer_name].append(("common_layer", layer_name, rank))
+
+        cls._keyword_targets = dict(targets)
+        cls._keyword_matcher = KeywordMatcher(targets)
+
+    def _match_keywords(self, prompt: str, prompt_lower: str) -> Dict[str, Dict[str, int]]:
+        """
+        扫描一遍 prompt，找出所有关键词表的命中
+
+        - 普通关键词在小写 prompt 上做子串匹配
+        - 图层类别关键词要求单词边界（避免 "cap" 匹配到 "caption"）
+        - 常用图层名区分大小写，需要在原始 prompt 上也出现
+
+        Returns:
+            {组名: {键: 优先级}}，同一个键多次命中时保留最高优先级
+        """
+        hits = defaultdict(dict)
+        # 转小写可能改变长度（如 "İ"），此时位置无法对应回原始 prompt
+        aligned = len(prompt) == len(prompt_lower)
+
+        for start, end, keyword in self._keyword_matcher.find_all(prompt_lower):
+            for group, key, rank in self._keyword_targets[keyword]:
+                if group == "layer" and not self._is_word_match(prompt_lower, start, end):
+                    continue
+                if group == "common_layer":
+                    in_prompt = prompt[start:end] == keyword if aligned else keyword in prompt
+                    if not in_prompt:
+                        continue
+                if rank < hits[group].get(key, rank + 1):
+                    hits[group][key] = rank
+
+        return hits
+
+    @staticmethod
+    def _is_word_match(text: str, start: int, end: int) -> bool:
+        """text[start:end] 两端是否都是单词边界（与 re 的 \b 一致）"""
+        def is_boundary(index: int) -> bool:
+            before = index > 0 and _WORD_CHAR_RE.match(text[index - 1]) is not None
+            after = index < len(text) and _WORD_CHAR_RE.match(text[index]) is not None
+            return before != after
+
+        return is_boundary(start) and is_boundary(end)
+
+    @staticmethod
+    def _ranked(hits: Dict[str, Dict[str, int]], group: str) -> List[str]:
+        """某个组命中的键，按优先级排序"""
+        matched = hits.get(group, {})
+        return sorted(matched, key=matched.get)
 
     def parse(self, prompt: str) -> Dict:
         """
@@ -148,18 +267,20 @@ class PromptParser:
         }
 
         prompt_lower = prompt.lower()
+        # 所有关键词表只扫描一遍
+        hits = self._match_keywords(prompt, prompt_lower)
 
         # 1. 解析模板类型
-        params["template"] = self._parse_template(prompt_lower)
+        params["template"] = self._parse_template(prompt_lower, hits)
 
         # 2. 解析 NFT ID
         params["nft_id"] = self._parse_nft_id(prompt)
 
         # 3. 解析图层
-        params["layers"] = self._parse_layers(prompt, prompt_lower)
+        params["layers"] = self._parse_layers(prompt, prompt_lower, hits)
 
         # 4. 解析字体风格
-        params["font_style"] = self._parse_font_style(prompt_lower)
+        params["font_style"] = self._parse_font_style(prompt_lower, hits)
 
         # 5. 解析自定义文字
         top_text, bottom_text = self._parse_custom_text(prompt)
@@ -172,7 +293,7 @@ class PromptParser:
         params["all_caps"] = self._parse_caps_option(prompt_lower)
 
         # 7. 解析视觉风格（新增）
-        params["visual_styles"] = self._parse_visual_styles(prompt_lower)
+        params["visual_styles"] = self._parse_visual_styles(prompt_lower, hits)
 
         # 8. 检测是否需要 Prompt Enhancer
         # 如果有视觉风格描述，或者是纯自然语言描述（无模板），启用 Prompt Enhancer
@@ -180,7 +301,7 @@ class PromptParser:
             params["use_prompt_enhancer"] = True
 
         # 9. 解析自定义背景
-        params["custom_background"] = self._parse_custom_background(prompt_lower)
+        params["custom_background"] = self._parse_custom_background(prompt_lower, hits)
 
         if self.debug:
             print(f"📝 原始 Prompt: {prompt}")
@@ -188,13 +309,12 @@ class PromptParser:
 
         return params
 
-    def _parse_template(self, prompt_lower: str) -> Optional[str]:
+    def _parse_template(self, prompt_lower: str, hits: Optional[Dict] = None) -> Optional[str]:
         """解析模板类型"""
-        for template, keywords in self.TEMPLATE_KEYWORDS.items():
-            for keyword in keywords:
-                if keyword in prompt_lower:
-                    return template
-        return None
+        if hits is None:
+            hits = self._match_keywords(prompt_lower, prompt_lower)
+        templates = self._ranked(hits, "template")
+        return templates[0] if templates else None
 
     def _parse_nft_id(self, prompt: str) -> Optional[int]:
         """解析 NFT ID"""
@@ -216,56 +336,108 @@ class PromptParser:
 
         return None
 
-    def _parse_layers(self, prompt: str, prompt_lower: str) -> Dict[str, List[str]]:
+    def _parse_layers(self, prompt: str, prompt_lower: str, hits: Optional[Dict] = None) -> Dict[str, List[str]]:
         """
         解析图层（支持同一类别多个图层）
 
         返回格式: {"Overlay": ["Gunpoint.png", "Birthday Hat.png"], "Hat": ["Beret.png"]}
         """
-        from collections import defaultdict
+        if hits is None:
+            hits = self._match_keywords(prompt, prompt_lower)
         layers = defaultdict(list)
 
-        # 1. 先检查常用图层的中文名称（按长度排序，优先匹配更具体的关键词）
-        sorted_layers = sorted(self.COMMON_LAYERS.items(), key=lambda x: len(x[0]), reverse=True)
-        matched_keywords = set()  # 避免重复匹配
+        # 已经识别为具体图层的文字范围（在 prompt_lower 中），其中的类别关键词不再计入
+        # （"party hat" 已经是 Party Hat，不再因为 "hat" 再加一顶默认帽子）
+        used_spans = []
 
-        for layer_name, layer_path in sorted_layers:
-            if layer_name in prompt and layer_name not in matched_keywords:
-                category, filename = layer_path.split(":", 1)
-                # 支持同一类别添加多个图层
+        # 1. 先检查常用图层的中文名称（按长度排序，优先匹配更具体的关键词）
+        for layer_name in self._ranked(hits, "common_layer"):
+            category, filename = self.COMMON_LAYERS[layer_name].split(":", 1)
+            # 支持同一类别添加多个图层
+            if filename not in layers[category]:
+                layers[category].append(filename)
+            name_lower = layer_name.lower()
+            used_spans.extend(
+                (match.start(), match.start() + len(name_lower))
+                for match in re.finditer(re.escape(name_lower), prompt_lower)
+            )
+
+        # 2. 再用图层名索引识别完整的图层名 / 中文别名（如 "cherry necklace"、"渔夫帽"）
+        if self.layer_index is not None:
+            for start, end, layer_key in self.layer_index.find_mention_spans(prompt):
+                used_spans.append((start, end))
+                category, filename = layer_key.split(":", 1)
                 if filename not in layers[category]:
                     layers[category].append(filename)
-                    matched_keywords.add(layer_name)
-
-        # 2. 检查图层类别关键词（只在没有匹配到具体图层时设置默认）
-        # 使用单词边界匹配，避免 "cap" 匹配到 "caption"
-        import re
-        for category, keywords in self.LAYER_KEYWORDS.items():
-            for keyword in keywords:
-                # 使用 \b 单词边界，确保只匹配完整单词
-                pattern = r'\b' + re.escape(keyword) + r'\b'
-                if re.search(pattern, prompt_lower, re.IGNORECASE) and not layers[category]:
-                    # 找到了类别但没有具体图层，设置默认图层
-                    if category == "Hat":
-                        layers[category].append("Beret.png")  # 默认贝雷帽
-                    elif category == "Glasses":
-                        layers[category].append("Sunglasses.png")  # 默认墨镜
-                    elif category == "Overlay":
-                        layers[category].append("Heart Meme.png")  # 默认爱心
-                    break
+
+        # 3. 检查图层类别关键词（只在没有匹配到具体图层时处理）
+        # 匹配时已经要求单词边界，避免 "cap" 匹配到 "caption"
+        for category in self._ranked(hits, "layer"):
+            if layers.get(category):
+                continue
+            keyword_spans = [
+                (start, end) for start, end in self._category_keyword_spans(prompt_lower, category)
+                if not any(used_start <= start and end <= used_end for used_start, used_end in used_spans)
+            ]
+            if not keyword_spans:
+                continue
+            # 先用关键词前的修饰词在该类别中查找（"cowboy hat" → Brown Cowboy Hat）
+            layer_key = self._resolve_category(prompt_lower, category, keyword_spans)
+            category_layers = layers[category]
+            if layer_key is not None:
+                category_layers.append(layer_key.split(":", 1)[1])
+            elif category in self.DEFAULT_CATEGORY_LAYERS:
+                # 找到了类别但没有具体图层，设置默认图层
+                category_layers.append(self.DEFAULT_CATEGORY_LAYERS[category])
 
         # 转换为普通 dict
         return dict(layers)
 
-    def _parse_font_style(self, prompt_lower: str) -> str:
+    def _category_keyword_spans(self, prompt_lower: str, category: str) -> List[Tuple[int, int]]:
+        """类别关键词在 prompt_lower 中（满足单词边界）的位置"""
+        spans = []
+        for keyword in self.LAYER_KEYWORDS[category]:
+            for match in re.finditer(re.escape(keyword), prompt_lower):
+                if self._is_word_match(prompt_lower, match.start(), match.end()):
+                    spans.append((match.start(), match.end()))
+        return sorted(spans)
+
+    def _resolve_category(
+        self, prompt_lower: str, category: str, keyword_spans: List[Tuple[int, int]]
+    ) -> Optional[str]:
+        """
+        用类别关键词前的修饰词在该类别中查找图层
+
+        "give me a cowboy hat on a black background" → 在 Hat 中查找 "cowboy"
+        → "Hat:Brown Cowboy Hat.png"
+
+        修饰词去掉 MODIFIER_STOPWORDS 后必须全部出现在图层名中，
+        "make a milady hat meme" 没有修饰词，使用默认图层
+
+        Returns:
+            "类别:文件名.png"，没有图层名索引或修饰词不对应任何图层时返回 None
+        """
+        if self.layer_index is None:
+            return None
+
+        for start, _ in keyword_spans:
+            clause = _CLAUSE_BREAK_RE.split(prompt_lower[:start])[-1]
+            words = clause.split()[-self.MODIFIER_WORDS:]
+            modifiers = " ".join(word for word in words if word not in self.MODIFIER_STOPWORDS)
+            if modifiers:
+                layer_key = self.layer_index.resolve(modifiers, category=category, match_all=True)
+                if layer_key is not None:
+                    return layer_key
+        return None
+
+    def _parse_font_style(self, prompt_lower: str, hits: Optional[Dict] = None) -> str:
         """解析字体风格"""
-        for font_style, keywords in self.FONT_KEYWORDS.items():
-            for keyword in keywords:
-                if keyword in prompt_lower:
-                    return font_style
+        if hits is None:
+            hits = self._match_keywords(prompt_lower, prompt_lower)
+        font_styles = self._ranked(hits, "font")
 
         # 默认返回 impact
-        return "impact"
+        return font_styles[0] if font_styles else "impact"
 
     def _parse_custom_text(self, prompt: str) -> Tuple[str, str]:
         """解析自定义文字"""
@@ -346,41 +518,36 @@ class PromptParser:
             return False
         return True
 
-    def _parse_visual_styles(self, prompt_lower: str) -> List[str]:
+    def _parse_visual_styles(self, prompt_lower: str, hits: Optional[Dict] = None) -> List[str]:
         """
         解析视觉风格/效果
 
         Args:
             prompt_lower: 小写的 prompt
+            hits: _match_keywords 的结果（None 时重新扫描）
 
         Returns:
-            检测到的视觉风格列表
+            检测到的视觉风格列表（按 VISUAL_STYLE_KEYWORDS 的顺序）
         """
-        detected_styles = []
+        if hits is None:
+            hits = self._match_keywords(prompt_lower, prompt_lower)
+        return self._ranked(hits, "visual_style")
 
-        for style, keywords in self.VISUAL_STYLE_KEYWORDS.items():
-            for keyword in keywords:
-                if keyword in prompt_lower and style not in detected_styles:
-                    detected_styles.append(style)
-                    break  # 找到一个就跳过
-
-        return detected_styles
-
-    def _parse_custom_background(self, prompt_lower: str) -> Optional[str]:
+    def _parse_custom_background(self, prompt_lower: str, hits: Optional[Dict] = None) -> Optional[str]:
         """
         解析自定义背景类型
 
         Args:
             prompt_lower: 小写的 prompt
+            hits: _match_keywords 的结果（None 时重新扫描）
 
         Returns:
             背景类型（如 "mcdonald"）或 None
         """
-        for bg_type, keywords in self.BACKGROUND_KEYWORDS.items():
-            for keyword in keywords:
-                if keyword in prompt_lower:
-                    return bg_type
-        return None
+        if hits is None:
+            hits = self._match_keywords(prompt_lower, prompt_lower)
+        bg_types = self._ranked(hits, "background")
+        return bg_types[0] if bg_types else None
 
     def get_style_guide(self) -> str:
         """获取风格指南"""
@@ -636,6 +803,10 @@ A: 每次只能选一种字体风格
 """
 
 
+# 类加载时编译一次关键词自动机
+PromptParser._compile_keywords()
+
+
 # 便捷函数
 def parse_prompt(prompt: str, debug: bool = False) -> Dict:
     """
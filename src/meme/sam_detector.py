@@ -8,7 +8,10 @@ Milady Maker NFTs.
 Features:
 - Automatic mask generation using SAM-2
 - Intelligent matching combining IoU + position heuristics
-- Caching mechanism to reduce API costs
+- Precomputed per-NFT accessory regions (accessory_regions) consulted before SAM-2
+- Indexed mask cache (content hash, NFT id, perceptual hash) to avoid paid SAM-2 runs
+- Full-resolution mask pixels kept as packed bits for pixel-accurate inpainting masks
+- Offline fallback to layer-alpha masks (local_detector) when Replicate is unavailable
 - Automatic fallback to predefined regions
 - Support for all 6 current accessory types + expandable to 40+ types
 
@@ -22,15 +25,192 @@ Date: 2026-01-07
 import os
 import json
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from typing import Dict, List, Tuple, Optional
 from pathlib import Path
-from datetime import datetime, timedelta
 
 import replicate
 import requests
 from PIL import Image
 import numpy as np
 
+from .accessory_regions import AccessoryRegionTable
+from .http_utils import create_session
+from .sam_mask_cache import CacheHit, SAMMaskCache, content_hash, dhash, nft_id_from_path, pack_mask
+
+
+# Concurrent mask downloads (SAM-2 often returns dozens of masks)
+MASK_DOWNLOAD_WORKERS = int(os.getenv("SAM_MASK_DOWNLOAD_WORKERS", "8"))
+
+# Mask pixels brighter than this belong to the mask
+MASK_THRESHOLD = 128
+
+# A mask belongs to a detected accessory when this much of its bbox lies inside
+# the accessory's bbox (SAM often splits e.g. lenses and frame into separate masks)
+PART_CONTAINMENT = 0.8
+
+
+class SAMUnavailableError(RuntimeError):
+    """SAM-2 could not be run (missing Replicate token, network or API error)."""
+
+
+def decode_mask(data: bytes) -> np.ndarray:
+    """Decode one encoded SAM mask (PNG) into a (height, width) boolean array."""
+    with Image.open(BytesIO(data)) as mask_img:
+        if mask_img.mode != 'L':
+            mask_img = mask_img.convert('L')
+        return np.asarray(mask_img) > MASK_THRESHOLD
+
+
+def measure_mask(binary: np.ndarray, total_pixels: int) -> Optional[Dict]:
+    """
+    Measure one boolean mask.
+
+    The row projection gives the vertical extent; the column extent and pixel
+    count only scan the band of rows the mask occupies.
+
+    Args:
+        binary: (height, width) boolean mask
+        total_pixels: Pixel count of the source image (for coverage)
+
+    Returns:
+        Dict with bbox (x, y, width, height), coverage (percent) and center,
+        or None for an empty mask
+    """
+    rows = np.flatnonzero(binary.any(axis=1))
+    if rows.size == 0:
+        return None
+
+    y1, y2 = int(rows[0]), int(rows[-1]) + 1
+    band = binary[y1:y2]
+    cols = np.flatnonzero(band.any(axis=0))
+    x1, x2 = int(cols[0]), int(cols[-1]) + 1
+    mask_pixels = np.count_nonzero(band[:, x1:x2])
+
+    width = x2 - x1
+    height = y2 - y1
+    return {
+        'bbox': (x1, y1, width, height),
+        'coverage': float(mask_pixels / total_pixels * 100),
+        'center': (x1 + width // 2, y1 + height // 2)
+    }
+
+
+def analyze_mask(data: bytes, total_pixels: int) -> Optional[Dict]:
+    """Decode one SAM mask from memory and measure it (see measure_mask)."""
+    return measure_mask(decode_mask(data), total_pixels)
+
+
+def mask_image(binary: Optional[np.ndarray]) -> Optional[Image.Image]:
+    """Boolean mask -> 'L' image (255 = mask), None stays None."""
+    if binary is None:
+        return None
+    return Image.fromarray(binary.astype(np.uint8) * 255, 'L')
+
+
+class MaskSet:
+    """
+    Metadata of all masks from one SAM run, held as NumPy arrays.
+
+    Scores every mask against any number of accessory types in one
+    vectorized pass instead of looping over masks in Python.
+
+    Attributes:
+        masks: Mask info dicts (bbox, coverage, center), in SAM order
+        image_size: (width, height) of the image the masks belong to
+        bboxes: (N, 4) float array of (x, y, width, height)
+        coverage: (N,) float array of coverage percentages
+        centers: (N, 2) float array of (x, y)
+        source_key: Mask store key of the SAM run holding the mask pixels
+                    (None when only metadata is available)
+    """
+
+    __slots__ = ("masks", "image_size", "bboxes", "coverage", "centers", "source_key")
+
+    def __init__(self, masks: List[Dict], image_size: Tuple[int, int],
+                 source_key: Optional[str] = None):
+        self.masks = masks
+        self.image_size = (int(image_size[0]), int(image_size[1]))
+        self.source_key = source_key
+        self.bboxes = np.array([m['bbox'] for m in masks], dtype=np.float64).reshape(-1, 4)
+        self.coverage = np.array([m['coverage'] for m in masks], dtype=np.float64)
+        self.centers = np.array([m['center'] for m in masks], dtype=np.float64).reshape(-1, 2)
+
+    def __len__(self) -> int:
+        return len(self.masks)
+
+    def iou(self, region: Tuple[int, int, int, int]) -> np.ndarray:
+        """IoU of every mask bbox with one (x, y, width, height) region, shape (N,)."""
+        x, y, w, h = (float(v) for v in region)
+        left = np.maximum(self.bboxes[:, 0], x)
+        top = np.maximum(self.bboxes[:, 1], y)
+        right = np.minimum(self.bboxes[:, 0] + self.bboxes[:, 2], x + w)
+        bottom = np.minimum(self.bboxes[:, 1] + self.bboxes[:, 3], y + h)
+
+        intersection = np.where(
+            (right < left) | (bottom < top), 0.0, (right - left) * (bottom - top)
+        )
+        union = self.bboxes[:, 2] * self.bboxes[:, 3] + w * h - intersection
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(union > 0, intersection / union, 0.0)
+
+    def position_scores(self, hints: List[Dict]) -> np.ndarray:
+        """
+        Position heuristic score of every mask for every hint, shape (T, N).
+
+        Args:
+            hints: POSITION_HINTS entries (y_range, x_range, size_range)
+        """
+        y_ranges = np.array([h['y_range'] for h in hints], dtype=np.float64)[:, :, None]
+        x_ranges = np.array([h['x_range'] for h in hints], dtype=np.float64)[:, :, None]
+        size_ranges = np.array([h['size_range'] for h in hints], dtype=np.float64)[:, :, None]
+
+        img_width, img_height = self.image_size
+        norm_x = self.centers[:, 0] / img_width
+        norm_y = self.centers[:, 1] / img_height
+        coverage = self.coverage / 100.0
+
+        def range_score(value, ranges):
+            # 1.0 inside the range, losing 2.0 per unit of distance outside it
+            below = ranges[:, 0] - value
+            above = value - ranges[:, 1]
+            return np.where(
+                below > 0, np.maximum(0, 1.0 - below * 2),
+                np.where(above > 0, np.maximum(0, 1.0 - above * 2), 1.0)
+            )
+
+        y_score = range_score(norm_y, y_ranges)
+        x_score = range_score(norm_x, x_ranges)
+
+        size_min, size_max = size_ranges[:, 0], size_ranges[:, 1]
+        size_score = np.where(
+            coverage < size_min, np.maximum(0, coverage / size_min),
+            np.where(coverage > size_max, np.maximum(0, 1.0 - (coverage - size_max) * 2), 1.0)
+        )
+
+        # Weighted average (y position most important, then size, then x)
+        return y_score * 0.5 + size_score * 0.3 + x_score * 0.2
+
+    def parts_of(self, index: int) -> List[int]:
+        """
+        Indices of the masks making up the object of mask `index`.
+
+        That is the mask itself plus every non-background mask whose bbox lies
+        mostly (PART_CONTAINMENT) inside its bbox.
+        """
+        x, y, w, h = self.bboxes[index]
+        left = np.maximum(self.bboxes[:, 0], x)
+        top = np.maximum(self.bboxes[:, 1], y)
+        right = np.minimum(self.bboxes[:, 0] + self.bboxes[:, 2], x + w)
+        bottom = np.minimum(self.bboxes[:, 1] + self.bboxes[:, 3], y + h)
+        inside = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+        area = self.bboxes[:, 2] * self.bboxes[:, 3]
+
+        parts = (inside >= area * PART_CONTAINMENT) & (self.coverage < 90)
+        parts[index] = True
+        return [int(i) for i in np.flatnonzero(parts)]
+
 
 class SAMDetector:
     """
@@ -210,51 +390,66 @@ class SAMDetector:
         print(f"🎯 {reason}")
         return False, reason
 
-    def __init__(self, cache_dir: str = "cache/sam_masks", cache_ttl_hours: int = 168):
+    def __init__(self, cache_dir: str = "cache/sam_masks", cache_ttl_hours: int = 168,
+                 cache: Optional[SAMMaskCache] = None, session: Optional[requests.Session] = None,
+                 download_workers: int = MASK_DOWNLOAD_WORKERS,
+                 local_detector=None,
+                 region_table: Optional[AccessoryRegionTable] = None):
         """
         Initialize SAM detector.
 
         Args:
-            cache_dir: Directory to store cached SAM results
+            cache_dir: Directory holding the SAM mask store (masks.sqlite3)
             cache_ttl_hours: Cache time-to-live in hours (default: 168 = 7 days)
+            cache: Mask store to use instead of the one in cache_dir
+            session: HTTP session for mask downloads (default: pooled keep-alive session)
+            download_workers: Number of masks downloaded concurrently
+            local_detector: LocalAccessoryDetector used when SAM-2 is unavailable
+                            (default: created on first use)
+            region_table: Precomputed per-NFT regions (default: the shared table)
         """
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
-        self.cache_ttl = timedelta(hours=cache_ttl_hours)
+        self.cache = cache if cache is not None else SAMMaskCache(
+            str(self.cache_dir / "masks.sqlite3"), ttl_hours=cache_ttl_hours
+        )
+        self.download_workers = max(1, download_workers)
+        self.session = session if session is not None else create_session(self.download_workers, pool_connections=2)
+        self._local_detector = local_detector
+        self.region_table = region_table if region_table is not None else AccessoryRegionTable.shared()
+
+    @property
+    def local_detector(self):
+        """Offline layer-alpha detector (imported lazily: it depends on this module)."""
+        if self._local_detector is None:
+            from .local_detector import LocalAccessoryDetector
+            self._local_detector = LocalAccessoryDetector()
+        return self._local_detector
 
     def _get_cache_key(self, image_path: str) -> str:
         """Generate cache key from image file hash."""
         with open(image_path, 'rb') as f:
-            file_hash = hashlib.md5(f.read()).hexdigest()
-        return file_hash
+            return content_hash(f.read())
 
-    def _get_cached_masks(self, cache_key: str) -> Optional[List[Dict]]:
+    def _get_legacy_masks(self, data: bytes) -> Optional[List[Dict]]:
         """
-        Retrieve cached mask data if available and not expired.
+        Read a result from the old one-JSON-file-per-MD5 cache.
 
-        Returns:
-            List of mask info dicts, or None if cache miss/expired
+        The file is removed once read; the caller moves it into the mask store.
         """
-        cache_file = self.cache_dir / f"{cache_key}.json"
-
+        cache_file = self.cache_dir / f"{hashlib.md5(data).hexdigest()}.json"
         if not cache_file.exists():
             return None
-
-        # Check expiration
-        cache_mtime = datetime.fromtimestamp(cache_file.stat().st_mtime)
-        if datetime.now() - cache_mtime > self.cache_ttl:
-            cache_file.unlink()  # Remove expired cache
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                masks_info = json.load(f)
+            cache_file.unlink()
+        except (OSError, ValueError):
             return None
-
-        # Load cached data
-        with open(cache_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-
-    def _cache_masks(self, cache_key: str, masks_info: List[Dict]):
-        """Save mask data to cache."""
-        cache_file = self.cache_dir / f"{cache_key}.json"
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(masks_info, f, ensure_ascii=False, indent=2)
+        return [
+            {**m, 'bbox': tuple(m['bbox']), 'center': tuple(m['center'])}
+            for m in masks_info
+        ]
 
     def _run_sam(self, image_path: str) -> List[Dict]:
         """
@@ -267,86 +462,133 @@ class SAMDetector:
             List of dicts with keys: bbox, coverage, center
             bbox format: (x, y, width, height)
         """
-        # Check cache first
-        cache_key = self._get_cache_key(image_path)
-        cached = self._get_cached_masks(cache_key)
-        if cached is not None:
+        return self.detect_masks(image_path).masks
+
+    def _lookup_regions(self, image_path: str, accessory_types: List[str],
+                        nft_id: Optional[int]) -> Dict[str, Tuple[int, int, int, int]]:
+        """Precomputed regions of an unmodified NFT image (types without one are left out)."""
+        if nft_id is None:
+            return {}
+        found = [t for t in accessory_types if self.region_table.get(nft_id, t) is not None]
+        if not found:
+            return {}
+
+        with Image.open(image_path) as img:
+            image_size = img.size
+        regions = {}
+        for accessory_type in found:
+            region = self.region_table.get(nft_id, accessory_type, image_size)
+            accessory_name = self.POSITION_HINTS.get(accessory_type, {}).get('name', accessory_type)
+            print(f"✅ 使用预计算的{accessory_name}区域 (NFT #{nft_id}): {region}")
+            regions[accessory_type] = region
+        return regions
+
+    def detect_masks(self, image_path: str, nft_id: Optional[int] = None) -> MaskSet:
+        """
+        All SAM masks of an image (from the cache when possible).
+
+        Args:
+            image_path: Path to input image
+            nft_id: Token id of an unmodified NFT image (default: from a milady_<id>.png name)
+
+        Returns:
+            MaskSet with the masks and the image size
+
+        Raises:
+            SAMUnavailableError: Not cached and SAM-2 could not be run
+        """
+        # Check cache first: content hash, then NFT id / perceptual hash
+        with open(image_path, 'rb') as f:
+            data = f.read()
+        cache_key = content_hash(data)
+        hit = self.cache.get_exact(cache_key)
+        if hit is not None:
             print(f"✅ 使用缓存的 SAM 结果 (cache key: {cache_key[:8]}...)")
-            return cached
+            return MaskSet(hit.masks, hit.size, hit.source_key)
+
+        img = Image.open(BytesIO(data))
+        img_size = img.size
+        phash = dhash(img)
+        if nft_id is None:
+            nft_id = nft_id_from_path(image_path)
+
+        hit = self.cache.get(cache_key, size=img_size, phash=phash, nft_id=nft_id)
+        if hit is None:
+            legacy = self._get_legacy_masks(data)
+            if legacy is not None:
+                # Old cache entries have no mask pixels
+                hit = CacheHit(legacy, img_size, cache_key)
+        if hit is not None:
+            print(f"✅ 使用缓存的 SAM 结果 (相同 NFT 的其他副本)")
+            # Alias this exact file so the next lookup is a content-hash hit
+            self.cache.put(cache_key, hit.masks, img_size, phash, nft_id=nft_id,
+                           source_key=hit.source_key)
+            return MaskSet(hit.masks, img_size, hit.source_key)
 
         print(f"🔄 运行 SAM-2 模型...")
 
         # Run SAM via Replicate API
-        with open(image_path, "rb") as f:
-            output = replicate.run(
-                self.SAM_MODEL,
-                input={"image": f}
-            )
+        try:
+            with open(image_path, "rb") as f:
+                output = replicate.run(
+                    self.SAM_MODEL,
+                    input={"image": f}
+                )
+        except Exception as e:
+            raise SAMUnavailableError(f"SAM-2 不可用: {e}") from e
 
         # Download individual masks
         individual_masks = output.get('individual_masks', [])
 
         if not individual_masks:
             print("⚠️  SAM 未返回任何掩码")
-            return []
-
-        # Load image to get dimensions
-        img = Image.open(image_path)
-        img_width, img_height = img.size
-        total_pixels = img_width * img_height
-
-        masks_info = []
-        temp_dir = Path("temp/sam_masks")
-        temp_dir.mkdir(parents=True, exist_ok=True)
+            return MaskSet([], img_size)
 
-        for idx, mask_url in enumerate(individual_masks):
-            # Download mask
-            temp_mask_path = temp_dir / f"mask_{idx}.png"
-            response = requests.get(str(mask_url), timeout=30)
+        masks_info, pixels = self._ingest_masks(individual_masks, img_size)
 
-            if response.status_code != 200:
-                continue
-
-            with open(temp_mask_path, 'wb') as f:
-                f.write(response.content)
-
-            # Analyze mask
-            mask_img = Image.open(temp_mask_path).convert('L')
-            mask_array = np.array(mask_img)
-
-            # Find bounding box
-            rows = np.any(mask_array > 128, axis=1)
-            cols = np.any(mask_array > 128, axis=0)
-
-            if not rows.any() or not cols.any():
-                continue
-
-            y1, y2 = np.where(rows)[0][[0, -1]]
-            x1, x2 = np.where(cols)[0][[0, -1]]
+        print(f"✅ SAM 检测到 {len(masks_info)} 个掩码")
 
-            width = x2 - x1 + 1
-            height = y2 - y1 + 1
+        # Cache results (metadata + packed mask pixels)
+        self.cache.put(cache_key, masks_info, img_size, phash, nft_id=nft_id, pixels=pixels)
 
-            # Calculate coverage
-            mask_pixels = np.sum(mask_array > 128)
-            coverage = (mask_pixels / total_pixels) * 100
+        return MaskSet(masks_info, img_size, cache_key)
 
-            # Center point
-            center_x = x1 + width // 2
-            center_y = y1 + height // 2
+    def _download_mask(self, mask_url: str) -> Optional[bytes]:
+        """Download one mask image (None on a non-200 response)."""
+        response = self.session.get(str(mask_url), timeout=30)
+        if response.status_code != 200:
+            return None
+        return response.content
 
-            masks_info.append({
-                'bbox': (int(x1), int(y1), int(width), int(height)),
-                'coverage': float(coverage),
-                'center': (int(center_x), int(center_y))
-            })
+    def _ingest_mask(self, mask_url: str, total_pixels: int) -> Optional[Tuple[Dict, bytes]]:
+        data = self._download_mask(mask_url)
+        if data is None:
+            return None
+        binary = decode_mask(data)
+        info = measure_mask(binary, total_pixels)
+        if info is None:
+            return None
+        return info, pack_mask(binary, info['bbox'])
 
-        print(f"✅ SAM 检测到 {len(masks_info)} 个掩码")
+    def _ingest_masks(self, mask_urls: List[str],
+                      img_size: Tuple[int, int]) -> Tuple[List[Dict], List[bytes]]:
+        """
+        Download and analyze SAM masks concurrently, straight from memory.
 
-        # Cache results
-        self._cache_masks(cache_key, masks_info)
+        Results keep SAM's mask order; failed downloads and empty masks are skipped.
 
-        return masks_info
+        Returns:
+            (mask info dicts, packed pixels of each mask)
+        """
+        total_pixels = img_size[0] * img_size[1]
+        workers = min(self.download_workers, len(mask_urls))
+        if workers <= 1:
+            results = [self._ingest_mask(url, total_pixels) for url in mask_urls]
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sam-mask") as pool:
+                results = list(pool.map(lambda url: self._ingest_mask(url, total_pixels), mask_urls))
+        results = [result for result in results if result is not None]
+        return [info for info, _ in results], [bits for _, bits in results]
 
     def _calculate_iou(self, box1: Tuple[int, int, int, int],
                        box2: Tuple[int, int, int, int]) -> float:
@@ -359,31 +601,8 @@ class SAMDetector:
         Returns:
             IoU score (0.0 to 1.0)
         """
-        x1_1, y1_1, w1, h1 = box1
-        x2_1 = x1_1 + w1
-        y2_1 = y1_1 + h1
-
-        x1_2, y1_2, w2, h2 = box2
-        x2_2 = x1_2 + w2
-        y2_2 = y1_2 + h2
-
-        # Intersection
-        x_left = max(x1_1, x1_2)
-        y_top = max(y1_1, y1_2)
-        x_right = min(x2_1, x2_2)
-        y_bottom = min(y2_1, y2_2)
-
-        if x_right < x_left or y_bottom < y_top:
-            return 0.0
-
-        intersection = (x_right - x_left) * (y_bottom - y_top)
-
-        # Union
-        area1 = w1 * h1
-        area2 = w2 * h2
-        union = area1 + area2 - intersection
-
-        return intersection / union if union > 0 else 0.0
+        mask_set = MaskSet([{'bbox': box1, 'coverage': 0.0, 'center': (0, 0)}], (1, 1))
+        return float(mask_set.iou(box2)[0])
 
     def _calculate_position_score(self, mask_info: Dict, accessory_type: str,
                                   img_width: int, img_height: int) -> float:
@@ -403,66 +622,85 @@ class SAMDetector:
         """
         if accessory_type not in self.POSITION_HINTS:
             accessory_type = "other"
+        mask_set = MaskSet([mask_info], (img_width, img_height))
+        return float(mask_set.position_scores([self.POSITION_HINTS[accessory_type]])[0, 0])
 
-        hints = self.POSITION_HINTS[accessory_type]
+    def _score_masks(self, mask_set: MaskSet, accessory_types: List[str],
+                     predefined_regions: Dict[str, Tuple[int, int, int, int]],
+                     iou_weight: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Score every mask for every accessory type at once.
+
+        Background masks (>= 90% coverage) score 0.
+
+        Returns:
+            (combined, position, iou) score arrays, each of shape (T, N)
+        """
+        hints = [self.POSITION_HINTS.get(t, self.POSITION_HINTS["other"]) for t in accessory_types]
+        position = mask_set.position_scores(hints)
+
+        iou = np.zeros_like(position)
+        combined = position.copy()
+        for row, accessory_type in enumerate(accessory_types):
+            region = predefined_regions.get(accessory_type)
+            if region is not None:
+                iou[row] = mask_set.iou(region)
+                combined[row] = iou[row] * iou_weight + position[row] * (1 - iou_weight)
+
+        combined[:, mask_set.coverage >= 90] = 0.0
+        return combined, position, iou
+
+    def _select_index(self, mask_set: MaskSet, accessory_type: str, combined: np.ndarray,
+                      position: np.ndarray, iou: np.ndarray,
+                      predefined_region: Optional[Tuple[int, int, int, int]]) -> Optional[int]:
+        """
+        Index of the best-scoring mask for one accessory type (scores of shape (N,)).
 
-        # Extract mask properties
-        x, y, w, h = mask_info['bbox']
-        center_x, center_y = mask_info['center']
-        coverage = mask_info['coverage'] / 100.0  # Convert to 0-1
+        Returns None when no mask qualifies (the caller falls back to predefined_region).
+        """
+        if len(mask_set) == 0:
+            print(f"⚠️  SAM 未检测到任何掩码，使用预定义区域")
+            return None
 
-        # Normalized positions
-        norm_y = center_y / img_height
-        norm_x = center_x / img_width
+        if not (mask_set.coverage < 90).any():
+            print(f"⚠️  所有掩码都是背景，使用预定义区域")
+            return None
 
-        # Calculate scores for each dimension
-        scores = []
+        # First mask with the highest positive score
+        best = int(np.argmax(combined))
+        if combined[best] <= 0:
+            print(f"⚠️  未找到合适的掩码，使用预定义区域")
+            return None
 
-        # Y position score
-        y_min, y_max = hints['y_range']
-        if y_min <= norm_y <= y_max:
-            # Perfect position
-            y_score = 1.0
-        else:
-            # Penalize based on distance outside range
-            if norm_y < y_min:
-                y_score = max(0, 1.0 - (y_min - norm_y) * 2)
-            else:
-                y_score = max(0, 1.0 - (norm_y - y_max) * 2)
-        scores.append(y_score)
-
-        # X position score
-        x_min, x_max = hints['x_range']
-        if x_min <= norm_x <= x_max:
-            x_score = 1.0
-        else:
-            if norm_x < x_min:
-                x_score = max(0, 1.0 - (x_min - norm_x) * 2)
-            else:
-                x_score = max(0, 1.0 - (norm_x - x_max) * 2)
-        scores.append(x_score)
-
-        # Size score
-        size_min, size_max = hints['size_range']
-        if size_min <= coverage <= size_max:
-            size_score = 1.0
-        else:
-            if coverage < size_min:
-                # Too small
-                size_score = max(0, coverage / size_min)
-            else:
-                # Too large
-                size_score = max(0, 1.0 - (coverage - size_max) * 2)
-        scores.append(size_score)
+        # Require minimum position score of 0.3
+        if position[best] < 0.3:
+            print(f"⚠️  最佳掩码位置分数过低 ({position[best]:.3f})，使用预定义区域")
+            return None
 
-        # Weighted average (y position most important, then size, then x)
-        position_score = (scores[0] * 0.5 + scores[2] * 0.3 + scores[1] * 0.2)
+        # Report results
+        best_mask = mask_set.masks[best]
+        accessory_name = self.POSITION_HINTS.get(accessory_type, {}).get('name', accessory_type)
+        print(f"✅ 检测到{accessory_name}:")
+        print(f"   位置分数: {position[best]:.3f}")
+        if predefined_region is not None:
+            print(f"   IoU: {iou[best]:.3f}")
+        print(f"   综合分数: {combined[best]:.3f}")
+        print(f"   区域: {best_mask['bbox']}")
 
-        return position_score
+        return best
+
+    def _select_region(self, mask_set: MaskSet, accessory_type: str, combined: np.ndarray,
+                       position: np.ndarray, iou: np.ndarray,
+                       predefined_region: Optional[Tuple[int, int, int, int]]
+                       ) -> Optional[Tuple[int, int, int, int]]:
+        """Bbox of the best-scoring mask for one accessory type, or predefined_region."""
+        best = self._select_index(mask_set, accessory_type, combined, position, iou, predefined_region)
+        return predefined_region if best is None else mask_set.masks[best]['bbox']
 
     def detect_accessory(self, image_path: str, accessory_type: str,
                         predefined_region: Optional[Tuple[int, int, int, int]] = None,
-                        iou_weight: float = 0.5) -> Optional[Tuple[int, int, int, int]]:
+                        iou_weight: float = 0.5,
+                        nft_id: Optional[int] = None) -> Optional[Tuple[int, int, int, int]]:
         """
         Detect accessory region using SAM with intelligent matching.
 
@@ -471,85 +709,166 @@ class SAMDetector:
             accessory_type: Type of accessory (hat, glasses, earrings, etc.)
             predefined_region: Fallback region (x, y, width, height), optional
             iou_weight: Weight for IoU vs position score (0-1, default 0.5)
+            nft_id: Token id of an unmodified NFT image, enables the precomputed
+                    region table and the offline fallback (default: from a
+                    milady_<id>.png file name)
 
         Returns:
             Detected bounding box (x, y, width, height), or predefined_region if no match,
             or None if no match and no predefined region
         """
-        # Run SAM
-        masks_info = self._run_sam(image_path)
+        if nft_id is None:
+            nft_id = nft_id_from_path(image_path)
+        precomputed = self._lookup_regions(image_path, [accessory_type], nft_id)
+        if accessory_type in precomputed:
+            return precomputed[accessory_type]
+
+        try:
+            mask_set = self.detect_masks(image_path, nft_id)
+        except SAMUnavailableError as e:
+            print(f"⚠️  {e}")
+            return self._detect_local(image_path, accessory_type, predefined_region, nft_id)[0]
+        combined, position, iou = self._score_masks(
+            mask_set, [accessory_type], {accessory_type: predefined_region}, iou_weight
+        )
+        return self._select_region(
+            mask_set, accessory_type, combined[0], position[0], iou[0], predefined_region
+        )
+
+    def detect_accessory_mask(self, image_path: str, accessory_type: str,
+                              predefined_region: Optional[Tuple[int, int, int, int]] = None,
+                              iou_weight: float = 0.5, nft_id: Optional[int] = None
+                              ) -> Tuple[Optional[Tuple[int, int, int, int]], Optional[Image.Image]]:
+        """
+        Detect an accessory and return its exact pixel mask.
 
-        if not masks_info:
-            print(f"⚠️  SAM 未检测到任何掩码，使用预定义区域")
-            return predefined_region
+        For a token in the precomputed region table the mask is the alpha of its
+        accessory layers. Otherwise it is the union of the best SAM mask and the
+        masks lying inside it (see MaskSet.parts_of), rebuilt from the packed
+        pixels in the mask store.
 
-        # Load image dimensions
-        img = Image.open(image_path)
-        img_width, img_height = img.size
+        Args:
+            image_path: Path to NFT image
+            accessory_type: Type of accessory (hat, glasses, earrings, etc.)
+            predefined_region: Fallback region (x, y, width, height), optional
+            iou_weight: Weight for IoU vs position score (0-1, default 0.5)
+            nft_id: Token id of an unmodified NFT image, enables the precomputed
+                    region table and the offline fallback (default: from a
+                    milady_<id>.png file name)
 
-        # Filter out background masks (>90% coverage)
-        valid_masks = [m for m in masks_info if m['coverage'] < 90]
+        Returns:
+            (bbox, mask) where mask is an 'L' image of the image size (255 = accessory).
+            mask is None when falling back to predefined_region or when the
+            cached result has no stored pixels; bbox is then as in detect_accessory().
+        """
+        if nft_id is None:
+            nft_id = nft_id_from_path(image_path)
+        precomputed = self._lookup_regions(image_path, [accessory_type], nft_id)
+        if accessory_type in precomputed:
+            with Image.open(image_path) as img:
+                image_size = img.size
+            pixels = self.local_detector.pixels(nft_id, accessory_type, image_size)
+            return precomputed[accessory_type], mask_image(pixels)
+
+        try:
+            mask_set = self.detect_masks(image_path, nft_id)
+        except SAMUnavailableError as e:
+            print(f"⚠️  {e}")
+            bbox, pixels = self._detect_local(image_path, accessory_type, predefined_region, nft_id)
+            return bbox, mask_image(pixels)
+
+        combined, position, iou = self._score_masks(
+            mask_set, [accessory_type], {accessory_type: predefined_region}, iou_weight
+        )
+        best = self._select_index(
+            mask_set, accessory_type, combined[0], position[0], iou[0], predefined_region
+        )
+        if best is None:
+            return predefined_region, None
+
+        bbox = mask_set.masks[best]['bbox']
+        if mask_set.source_key is None:
+            return bbox, None
+        pixels = self.cache.get_pixels(mask_set.source_key, mask_set.parts_of(best), mask_set.image_size)
+        if pixels is None:
+            print(f"⚠️  缓存中没有掩码像素，使用矩形区域")
+        return bbox, mask_image(pixels)
+
+    def detect_all(self, image_path: str, accessory_types: Optional[List[str]] = None,
+                   predefined_regions: Optional[Dict[str, Tuple[int, int, int, int]]] = None,
+                   iou_weight: float = 0.5,
+                   nft_id: Optional[int] = None) -> Dict[str, Optional[Tuple[int, int, int, int]]]:
+        """
+        Best region for several accessory types from a single SAM run.
 
-        if not valid_masks:
-            print(f"⚠️  所有掩码都是背景，使用预定义区域")
-            return predefined_region
-
-        # Find best matching mask
-        best_mask = None
-        best_score = 0.0
-        best_iou = 0.0
-        best_pos_score = 0.0
-
-        for mask in valid_masks:
-            # Calculate position score
-            pos_score = self._calculate_position_score(
-                mask, accessory_type, img_width, img_height
-            )
+        Args:
+            image_path: Path to NFT image
+            accessory_types: Types to detect (default: every POSITION_HINTS type)
+            predefined_regions: Fallback region per type, optional
+            iou_weight: Weight for IoU vs position score (0-1, default 0.5)
+            nft_id: Token id of an unmodified NFT image, enables the precomputed
+                    region table and the offline fallback (default: from a
+                    milady_<id>.png file name)
 
-            # Calculate IoU if predefined region available
-            iou = 0.0
-            if predefined_region is not None:
-                iou = self._calculate_iou(mask['bbox'], predefined_region)
-
-            # Combined score
-            if predefined_region is not None:
-                # Use both IoU and position
-                combined_score = iou * iou_weight + pos_score * (1 - iou_weight)
-            else:
-                # Only position score
-                combined_score = pos_score
-
-            if combined_score > best_score:
-                best_score = combined_score
-                best_mask = mask
-                best_iou = iou
-                best_pos_score = pos_score
-
-        # Decision logic
-        if best_mask is None:
-            print(f"⚠️  未找到合适的掩码，使用预定义区域")
-            return predefined_region
+        Returns:
+            {accessory_type: bbox (x, y, width, height) or fallback region or None}
+        """
+        if accessory_types is None:
+            accessory_types = list(self.POSITION_HINTS)
+        predefined_regions = predefined_regions or {}
+
+        # Precomputed regions first; SAM-2 only runs for the remaining types
+        if nft_id is None:
+            nft_id = nft_id_from_path(image_path)
+        results = self._lookup_regions(image_path, accessory_types, nft_id)
+        accessory_types = [t for t in accessory_types if t not in results]
+        if not accessory_types:
+            return results
+
+        try:
+            mask_set = self.detect_masks(image_path, nft_id)
+        except SAMUnavailableError as e:
+            print(f"⚠️  {e}")
+            for accessory_type in accessory_types:
+                results[accessory_type] = self._detect_local(
+                    image_path, accessory_type, predefined_regions.get(accessory_type), nft_id
+                )[0]
+            return results
+
+        combined, position, iou = self._score_masks(
+            mask_set, accessory_types, predefined_regions, iou_weight
+        )
+        for row, accessory_type in enumerate(accessory_types):
+            results[accessory_type] = self._select_region(
+                mask_set, accessory_type, combined[row], position[row], iou[row],
+                predefined_regions.get(accessory_type)
+            )
+        return results
 
-        # Require minimum position score of 0.3
-        if best_pos_score < 0.3:
-            print(f"⚠️  最佳掩码位置分数过低 ({best_pos_score:.3f})，使用预定义区域")
-            return predefined_region
+    def _detect_local(self, image_path: str, accessory_type: str,
+                      predefined_region: Optional[Tuple[int, int, int, int]],
+                      nft_id: Optional[int]) -> Tuple[Optional[Tuple[int, int, int, int]], Optional[np.ndarray]]:
+        """
+        Offline detection from the NFT's layer alpha.
 
-        # Report results
+        Returns:
+            (bbox, boolean pixel mask), or (predefined_region, None) if the image
+            is not a known NFT or has no such accessory
+        """
         accessory_name = self.POSITION_HINTS.get(accessory_type, {}).get('name', accessory_type)
-        print(f"✅ 检测到{accessory_name}:")
-        print(f"   位置分数: {best_pos_score:.3f}")
-        if predefined_region is not None:
-            print(f"   IoU: {best_iou:.3f}")
-        print(f"   综合分数: {best_score:.3f}")
-        print(f"   区域: {best_mask['bbox']}")
+        result = self.local_detector.detect(image_path, accessory_type, nft_id=nft_id)
+        if result is None:
+            print(f"⚠️  本地图层检测未找到{accessory_name}，使用预定义区域")
+            return predefined_region, None
 
-        return best_mask['bbox']
+        info, pixels = result
+        print(f"✅ 本地图层检测到{accessory_name}:")
+        print(f"   区域: {info['bbox']}")
+        return info['bbox'], pixels
 
     def clear_cache(self):
         """Clear all cached SAM results."""
-        import shutil
-        if self.cache_dir.exists():
-            shutil.rmtree(self.cache_dir)
-            self.cache_dir.mkdir(parents=True, exist_ok=True)
-            print("✅ 已清除 SAM 缓存")
+        self.cache.clear()
+        for legacy_file in self.cache_dir.glob("*.json"):
+            legacy_file.unlink()
+        print("✅ 已清除 SAM 缓存")
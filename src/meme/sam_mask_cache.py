@@ -0,0 +1,471 @@
+"""
+SAM mask cache - one indexed SQLite store for SAM-2 results
+
+SAMDetector used to keep one JSON file per MD5 of the image bytes, so any
+re-encoded, resized or re-downloaded copy of the same NFT was a cache miss and
+another paid SAM-2 run. This store keeps the mask metadata of every run in a
+single SQLite table and answers three kinds of lookups, cheapest first:
+
+1. Content hash: SHA-256 of the exact image bytes
+2. NFT id: untouched originals (milady_<id>.png), verified by perceptual hash
+3. Perceptual hash: 256-bit difference hash (dHash), nearest neighbour by
+   Hamming distance over an in-memory index of every cached run. Only for
+   images without a token id, and only near-identical: Miladys share one face
+   template, so tokens differing by an earring or a tattoo are just 2-7 bits
+   apart and must not share masks. A token id never matches another token.
+
+Masks are stored in the pixel coordinates of the image SAM ran on and are
+rescaled to the size of the image being looked up.
+
+Besides the metadata (bbox, coverage, center), the full-resolution pixels of
+every mask are kept as packed bits (np.packbits + zlib) of the mask's bbox,
+so the exact union mask of a detected accessory can be rebuilt without
+another SAM run. Copies found by NFT id / perceptual hash point at the pixels
+of the run they came from.
+
+Storage:
+    cache/sam_masks/masks.sqlite3
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+
+DEFAULT_DB_PATH = "cache/sam_masks/masks.sqlite3"
+
+# dHash grid (HASH_SIZE x HASH_SIZE bits)
+HASH_SIZE = 16
+# Maximum Hamming distance (out of 256 bits) between copies of the same token
+# (the NFT id lookup: re-encoded / resized copies are 0-3 bits apart)
+DEFAULT_MAX_DISTANCE = 10
+# Maximum Hamming distance for the pure perceptual lookup (no token id)
+DEFAULT_PERCEPTUAL_MAX_DISTANCE = 1
+
+_NFT_FILENAME_RE = re.compile(r"milady_(\d+)\.(?:png|jpe?g|webp)$", re.IGNORECASE)
+
+# Number of set bits in every byte value
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def content_hash(data: bytes) -> str:
+    """SHA-256 of the raw image bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def nft_id_from_path(image_path: Union[str, Path]) -> Optional[int]:
+    """Token id of an original NFT file (milady_<id>.png), or None."""
+    match = _NFT_FILENAME_RE.search(Path(image_path).name)
+    return int(match.group(1)) if match else None
+
+
+def dhash(img: Image.Image, hash_size: int = HASH_SIZE) -> bytes:
+    """
+    Difference hash: sign of the horizontal gradient on a tiny grayscale copy.
+
+    Survives resizing and re-encoding, while different NFTs (background,
+    hair, accessories) differ in dozens of bits.
+
+    Returns:
+        hash_size * hash_size / 8 bytes
+    """
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = np.asarray(small, dtype=np.int16)
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes()
+
+
+def hamming_distances(hashes: np.ndarray, target: bytes) -> np.ndarray:
+    """
+    Hamming distance from every row of `hashes` (N x bytes, uint8) to `target`.
+    """
+    target_bits = np.frombuffer(target, dtype=np.uint8)
+    return _POPCOUNT[np.bitwise_xor(hashes, target_bits)].sum(axis=1, dtype=np.int32)
+
+
+def pack_mask(binary: np.ndarray, bbox: Tuple[int, int, int, int]) -> bytes:
+    """
+    Compress the bbox region of a boolean mask: packed bits, then zlib.
+
+    Args:
+        binary: (height, width) boolean mask of the full image
+        bbox: (x, y, width, height) of the mask
+    """
+    x, y, w, h = bbox
+    return zlib.compress(np.packbits(binary[y:y + h, x:x + w]).tobytes())
+
+
+def unpack_mask(data: bytes, width: int, height: int) -> np.ndarray:
+    """Inverse of pack_mask(): the (height, width) boolean bbox region."""
+    bits = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    return np.unpackbits(bits, count=width * height).reshape(height, width).astype(bool)
+
+
+def scale_masks(masks: List[Dict], from_size: Tuple[int, int], to_size: Tuple[int, int]) -> List[Dict]:
+    """Rescale mask bboxes and centers between image sizes (coverage is relative)."""
+    if tuple(from_size) == tuple(to_size):
+        return masks
+
+    sx = to_size[0] / from_size[0]
+    sy = to_size[1] / from_size[1]
+    scaled = []
+    for mask in masks:
+        x, y, w, h = mask["bbox"]
+        cx, cy = mask["center"]
+        scaled.append({
+            **mask,
+            "bbox": (round(x * sx), round(y * sy), max(1, round(w * sx)), max(1, round(h * sy))),
+            "center": (round(cx * sx), round(cy * sy)),
+        })
+    return scaled
+
+
+class CacheHit:
+    """
+    A cache lookup result.
+
+    Attributes:
+        masks: Mask info dicts (bbox, coverage, center), in SAM order
+        size: (width, height) the masks are expressed in
+        source_key: Content hash of the SAM run whose mask pixels apply
+    """
+
+    __slots__ = ("masks", "size", "source_key")
+
+    def __init__(self, masks: List[Dict], size: Tuple[int, int], source_key: str):
+        self.masks = masks
+        self.size = (int(size[0]), int(size[1]))
+        self.source_key = source_key
+
+
+class SAMMaskCache:
+    """
+    Indexed store of SAM-2 mask metadata and packed mask pixels.
+
+    Usage:
+        cache = SAMMaskCache()
+        hit = cache.get(key, size=img.size, phash=dhash(img), nft_id=nft_id)
+        if hit is None:
+            masks, pixels = run_sam(...)
+            cache.put(key, masks, img.size, dhash(img), nft_id=nft_id, pixels=pixels)
+
+    Thread-safe; one connection guarded by a lock.
+    """
+
+    def __init__(
+        self,
+        db_path: str = DEFAULT_DB_PATH,
+        ttl_hours: float = 168,
+        max_distance: int = DEFAULT_MAX_DISTANCE,
+        perceptual_max_distance: int = DEFAULT_PERCEPTUAL_MAX_DISTANCE,
+    ):
+        """
+        Args:
+            db_path: SQLite file (":memory:" for a process-local cache)
+            ttl_hours: Entry lifetime in hours (<= 0 never expires)
+            max_distance: Maximum dHash Hamming distance for NFT id hits
+            perceptual_max_distance: Maximum dHash Hamming distance for perceptual
+                                     hits (images without a token id)
+        """
+        self.db_path = db_path
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_distance = max_distance
+        self.perceptual_max_distance = perceptual_max_distance
+
+        self.hits = {"content": 0, "nft_id": 0, "perceptual": 0}
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if db_path != ":memory:":
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sam_masks (
+                content_hash TEXT PRIMARY KEY,
+                nft_id INTEGER,
+                phash BLOB NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                masks TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                source_hash TEXT
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sam_masks)")}
+        if "source_hash" not in columns:
+            self._conn.execute("ALTER TABLE sam_masks ADD COLUMN source_hash TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sam_masks_nft ON sam_masks (nft_id)")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sam_mask_pixels (
+                content_hash TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                bits BLOB NOT NULL,
+                PRIMARY KEY (content_hash, idx)
+            )
+            """
+        )
+
+        # In-memory perceptual index: row i of _phashes belongs to _keys[i]
+        self._keys: List[str] = []
+        self._created: List[float] = []
+        self._phashes = np.zeros((0, HASH_SIZE * HASH_SIZE // 8), dtype=np.uint8)
+        self._load_index()
+
+    def _load_index(self):
+        rows = self._conn.execute("SELECT content_hash, phash, created_at FROM sam_masks").fetchall()
+        self._keys = [row[0] for row in rows]
+        self._created = [row[2] for row in rows]
+        if rows:
+            hashes = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.uint8)
+            self._phashes = hashes.reshape(len(rows), -1).copy()
+        else:
+            self._phashes = np.zeros((0, HASH_SIZE * HASH_SIZE // 8), dtype=np.uint8)
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created_at > self.ttl_seconds
+
+    def _select(self, where: str, params: Tuple) -> List[Tuple]:
+        return self._conn.execute(
+            "SELECT content_hash, phash, width, height, masks, created_at, source_hash"
+            f" FROM sam_masks WHERE {where}",
+            params,
+        ).fetchall()
+
+    def get_exact(self, key: str) -> Optional[CacheHit]:
+        """
+        Content-hash lookup only (no image decoding needed by the caller).
+
+        A miss here is not counted; follow up with get() for the full lookup.
+
+        Returns:
+            CacheHit in the cached image's size, or None
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._select("content_hash = ?", (key,))
+            if not rows or self._is_expired(rows[0][5], now):
+                return None
+            return self._hit(rows[0], "content", None)
+
+    def get(
+        self,
+        key: str,
+        size: Optional[Tuple[int, int]] = None,
+        phash: Optional[bytes] = None,
+        nft_id: Optional[int] = None,
+    ) -> Optional[CacheHit]:
+        """
+        Look up cached masks: content hash, then NFT id, then perceptual hash.
+
+        With a token id only runs of that token (or the exact same bytes) match;
+        the perceptual lookup is used only when nft_id is None.
+
+        Args:
+            key: content_hash() of the image bytes
+            size: (width, height) of the image; masks are rescaled to it
+            phash: dhash() of the image (required for NFT id / perceptual lookups)
+            nft_id: Token id if the image is an original NFT file
+
+        Returns:
+            CacheHit (masks rescaled to `size`), or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            row, kind = None, None
+            rows = self._select("content_hash = ?", (key,))
+            if rows:
+                row, kind = rows[0], "content"
+
+            if row is None and phash is not None and nft_id is not None:
+                for candidate in self._select("nft_id = ?", (nft_id,)):
+                    if self._distance(candidate[1], phash) <= self.max_distance:
+                        row, kind = candidate, "nft_id"
+                        break
+
+            if row is None and phash is not None and nft_id is None and self._keys:
+                distances = hamming_distances(self._phashes, phash)
+                best = int(np.argmin(distances))
+                if (distances[best] <= self.perceptual_max_distance
+                        and not self._is_expired(self._created[best], now)):
+                    rows = self._select("content_hash = ?", (self._keys[best],))
+                    if rows:
+                        row, kind = rows[0], "perceptual"
+
+            if row is None or self._is_expired(row[5], now):
+                if row is not None:
+                    self._delete(row[0])
+                self.misses += 1
+                return None
+
+            return self._hit(row, kind, size)
+
+    def _hit(self, row: Tuple, kind: str, size: Optional[Tuple[int, int]]) -> CacheHit:
+        """Count a hit and decode the row's masks (called with the lock held)."""
+        self._conn.execute("UPDATE sam_masks SET hits = hits + 1 WHERE content_hash = ?", (row[0],))
+        self.hits[kind] += 1
+
+        masks = [
+            {**mask, "bbox": tuple(mask["bbox"]), "center": tuple(mask["center"])}
+            for mask in json.loads(row[4])
+        ]
+        stored_size = (row[2], row[3])
+        if size:
+            masks = scale_masks(masks, stored_size, size)
+        return CacheHit(masks, size or stored_size, row[6] or row[0])
+
+    def put(
+        self,
+        key: str,
+        masks: List[Dict],
+        size: Tuple[int, int],
+        phash: bytes,
+        nft_id: Optional[int] = None,
+        pixels: Optional[List[bytes]] = None,
+        source_key: Optional[str] = None,
+    ):
+        """
+        Store the masks of one SAM run, or an alias of another run.
+
+        Args:
+            key: content_hash() of the image bytes
+            masks: Mask info dicts (bbox, coverage, center) in image pixels
+            size: (width, height) of the image
+            phash: dhash() of the image
+            nft_id: Token id if the image is an original NFT file
+            pixels: pack_mask() data of every mask (same order as masks)
+            source_key: For a copy of a cached image: the run whose pixels apply
+        """
+        now = time.time()
+        if source_key == key:
+            source_key = None
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO sam_masks
+                    (content_hash, nft_id, phash, width, height, masks, created_at, hits, source_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)
+                """,
+                (key, nft_id, phash, int(size[0]), int(size[1]), json.dumps(masks), now, source_key),
+            )
+            if pixels is not None:
+                self._conn.execute("DELETE FROM sam_mask_pixels WHERE content_hash = ?", (key,))
+                self._conn.executemany(
+                    "INSERT INTO sam_mask_pixels (content_hash, idx, bits) VALUES (?, ?, ?)",
+                    [(key, idx, bits) for idx, bits in enumerate(pixels)],
+                )
+            if key in self._keys:
+                index = self._keys.index(key)
+                self._phashes[index] = np.frombuffer(phash, dtype=np.uint8)
+                self._created[index] = now
+            else:
+                self._keys.append(key)
+                self._created.append(now)
+                self._phashes = np.vstack([self._phashes, np.frombuffer(phash, dtype=np.uint8)])
+
+    def get_pixels(
+        self,
+        source_key: str,
+        indices: List[int],
+        size: Optional[Tuple[int, int]] = None,
+    ) -> Optional[np.ndarray]:
+        """
+        Exact union of the given masks of one SAM run.
+
+        Args:
+            source_key: CacheHit.source_key
+            indices: Mask indices (positions in CacheHit.masks)
+            size: (width, height) of the result (default: the run's image size)
+
+        Returns:
+            (height, width) boolean array, or None if the pixels are not stored
+        """
+        with self._lock:
+            rows = self._select("content_hash = ?", (source_key,))
+            if not rows:
+                return None
+            stored = self._conn.execute(
+                f"SELECT idx, bits FROM sam_mask_pixels WHERE content_hash = ?"
+                f" AND idx IN ({', '.join('?' * len(indices))})",
+                (source_key, *indices),
+            ).fetchall()
+        if len(stored) != len(set(indices)):
+            return None
+
+        width, height = rows[0][2], rows[0][3]
+        masks = json.loads(rows[0][4])
+        union = np.zeros((height, width), dtype=bool)
+        for idx, bits in stored:
+            x, y, w, h = masks[idx]["bbox"]
+            union[y:y + h, x:x + w] |= unpack_mask(bits, w, h)
+
+        if size is not None and tuple(size) != (width, height):
+            resized = Image.fromarray(union).resize(tuple(size), Image.Resampling.NEAREST)
+            union = np.asarray(resized, dtype=bool)
+        return union
+
+    @staticmethod
+    def _distance(a: bytes, b: bytes) -> int:
+        return int(hamming_distances(np.frombuffer(a, dtype=np.uint8)[None, :], b)[0])
+
+    def _delete(self, key: str):
+        self._conn.execute("DELETE FROM sam_masks WHERE content_hash = ?", (key,))
+        self._conn.execute("DELETE FROM sam_mask_pixels WHERE content_hash = ?", (key,))
+        if key in self._keys:
+            index = self._keys.index(key)
+            del self._keys[index]
+            del self._created[index]
+            self._phashes = np.delete(self._phashes, index, axis=0)
+
+    def purge_expired(self) -> int:
+        """Delete all expired entries; returns the number removed."""
+        if self.ttl_seconds <= 0:
+            return 0
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM sam_masks WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            )
+            self._conn.execute(
+                "DELETE FROM sam_mask_pixels WHERE content_hash NOT IN (SELECT content_hash FROM sam_masks)"
+            )
+            self._load_index()
+            return cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM sam_masks")
+            self._conn.execute("DELETE FROM sam_mask_pixels")
+            self._load_index()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sam_masks").fetchone()[0]
+
+    def stats(self) -> Dict:
+        """Hit counts by lookup kind, misses and hit rate."""
+        hits = sum(self.hits.values())
+        total = hits + self.misses
+        return {
+            "entries": len(self._keys),
+            **{f"{kind}_hits": count for kind, count in self.hits.items()},
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
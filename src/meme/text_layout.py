@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+文字排版 - 自动换行 + 二分查找最大字号
+
+在给定的文字框内找到能放下（换行后）整段文字的最大字号:
+
+- 换行: 拉丁文按单词断行（超长单词按字符断开），中日韩文字可以在任意两个字之间断行
+- 字号: 在 [min_size, max_size] 上二分查找，测量次数为 O(log(字号范围))
+- 测量: 每个 (字体, 字号, 词) 的宽度只测量一次，换行时只做加法
+
+用法:
+    layout = fit_text("WHEN YOU FINALLY SHIP THE FEATURE", font_path, 900, 300)
+    layout.text       # 含换行符的文字
+    layout.font_size  # 选中的字号
+"""
+
+import re
+from functools import lru_cache
+from typing import List, Optional
+
+from .text_render import load_font
+
+
+# 中日韩文字（汉字、假名、韩文、全角标点），每个字都是一个可断行的单位
+_CJK_RANGES = (
+    "\u3000-\u303f"   # CJK 标点
+    "\u3040-\u30ff"   # 平假名 / 片假名
+    "\u3400-\u4dbf"   # 扩展 A
+    "\u4e00-\u9fff"   # 基本汉字
+    "\uac00-\ud7af"   # 韩文
+    "\uff00-\uffef"   # 全角字符
+)
+_TOKEN_RE = re.compile(rf"[{_CJK_RANGES}]|[^\s{_CJK_RANGES}]+|\s+")
+
+# 多行文字的行间距（相对字号）
+LINE_SPACING_RATIO = 0.1
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    把文字切成可断行的单位
+
+    "GM 中文梗图 LFG" → ["GM", " ", "中", "文", "梗", "图", " ", "LFG"]
+    """
+    return _TOKEN_RE.findall(text)
+
+
+def is_cjk(token: str) -> bool:
+    return bool(token) and bool(re.match(rf"[{_CJK_RANGES}]", token[0]))
+
+
+@lru_cache(maxsize=65536)
+def measure(font_path: Optional[str], size: int, token: str) -> float:
+    """测量一个词在某字号下的宽度（结果缓存）"""
+    return load_font(font_path, size).getlength(token)
+
+
+@lru_cache(maxsize=1024)
+def line_height(font_path: Optional[str], size: int) -> int:
+    """某字号下单行文字的高度（包含上伸部和下伸部）"""
+    left, top, right, bottom = load_font(font_path, size).getbbox("Ag中")
+    return bottom - top
+
+
+class TextLayout:
+    """
+    排版结果
+
+    Attributes:
+        lines: 每行文字
+        font_size: 字号
+        width: 最宽一行的宽度
+        height: 总高度（含行间距）
+        fits: 是否放进了目标框（最小字号也放不下时为 False）
+    """
+
+    __slots__ = ("lines", "font_size", "width", "height", "fits")
+
+    def __init__(self, lines: List[str], font_size: int, width: float, height: float, fits: bool):
+        self.lines = lines
+        self.font_size = font_size
+        self.width = width
+        self.height = height
+        self.fits = fits
+
+    @property
+    def text(self) -> str:
+        """多行文字（换行符分隔），可以直接交给 ImageDraw.text"""
+        return "\n".join(self.lines)
+
+    @property
+    def spacing(self) -> int:
+        """行间距（像素）"""
+        return int(self.font_size * LINE_SPACING_RATIO)
+
+    def __repr__(self) -> str:
+        return f"TextLayout(size={self.font_size}, lines={self.lines!r}, fits={self.fits})"
+
+
+def wrap_text(text: str, font_path: Optional[str], size: int, max_width: float) -> List[str]:
+    """
+    按最大宽度贪心换行
+
+    Args:
+        text: 文字（已有的换行符会保留）
+        font_path: 字体文件路径
+        size: 字号
+        max_width: 每行最大宽度（像素）
+
+    Returns:
+        每行文字
+    """
+    lines = []
+    for paragraph in text.split("\n"):
+        line: List[str] = []
+        line_width = 0.0
+
+        for token in tokenize(paragraph):
+            if token.isspace():
+                # 行首不保留空格
+                if line:
+                    line.append(" ")
+                    line_width += measure(font_path, size, " ")
+                continue
+
+            token_width = measure(font_path, size, token)
+
+            # 单个拉丁单词比整行还宽：按字符断开
+            if token_width > max_width and not is_cjk(token):
+                for char in token:
+                    char_width = measure(font_path, size, char)
+                    if line and line_width + char_width > max_width:
+                        lines.append("".join(line).rstrip())
+                        line, line_width = [], 0.0
+                    line.append(char)
+                    line_width += char_width
+                continue
+
+            if line and line_width + token_width > max_width:
+                lines.append("".join(line).rstrip())
+                line, line_width = [], 0.0
+
+            line.append(token)
+            line_width += token_width
+
+        lines.append("".join(line).rstrip())
+
+    return lines
+
+
+def layout_text(
+    text: str,
+    font_path: Optional[str],
+    size: int,
+    max_width: float,
+    max_height: float,
+    max_lines: Optional[int] = None
+) -> TextLayout:
+    """在指定字号下排版，并判断是否放得进目标框"""
+    lines = wrap_text(text, font_path, size, max_width)
+    width = max(sum(measure(font_path, size, token) for token in tokenize(line)) for line in lines)
+    spacing = int(size * LINE_SPACING_RATIO)
+    height = len(lines) * line_height(font_path, size) + (len(lines) - 1) * spacing
+
+    fits = width <= max_width and height <= max_height
+    if max_lines is not None and len(lines) > max_lines:
+        fits = False
+
+    return TextLayout(lines, size, width, height, fits)
+
+
+@lru_cache(maxsize=4096)
+def fit_text(
+    text: str,
+    font_path: Optional[str],
+    max_width: float,
+    max_height: float,
+    min_size: int = 16,
+    max_size: int = 100,
+    max_lines: Optional[int] = None
+) -> TextLayout:
+    """
+    二分查找能放进目标框的最大字号
+
+    能否放下对字号是单调的（字号越大，每行越宽、行数越多），
+    所以只需要 O(log(max_size - min_size)) 次排版。
+
+    Args:
+        text: 文字
+        font_path: 字体文件路径（None 使用 PIL 默认字体）
+        max_width: 目标框宽度
+        max_height: 目标框高度
+        min_size: 最小字号（仍放不下时返回最小字号的排版，fits=False）
+        max_size: 最大字号
+        max_lines: 最多行数（None 不限制）
+
+    Returns:
+        TextLayout（结果会被缓存，调用方不要修改）
+    """
+    # 短文字最常见：最大字号直接放得下
+    largest = layout_text(text, font_path, max_size, max_width, max_height, max_lines)
+    if largest.fits or max_size <= min_size:
+        return largest
+
+    best = layout_text(text, font_path, min_size, max_width, max_height, max_lines)
+    if not best.fits:
+        return best
+
+    low, high = min_size + 1, max_size - 1
+    while low <= high:
+        size = (low + high) // 2
+        layout = layout_text(text, font_path, size, max_width, max_height, max_lines)
+        if layout.fits:
+            best = layout
+            low = size + 1
+        else:
+            high = size - 1
+
+    return best
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+测试共用的 fixture
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Type
+
+import pytest
+
+
+class FakeServer(ThreadingHTTPServer):
+    """
+    本地假 HTTP 服务（随机端口，每个请求一个线程）
+
+    测试需要的状态（请求计数等）作为属性挂在服务对象上，处理器通过 self.server 访问，
+    修改时用 self.server.lock 加锁
+    """
+
+    daemon_threads = True
+
+    def __init__(self, handler: Type[BaseHTTPRequestHandler]):
+        # 不把每个请求打印到 stderr
+        quiet = type(handler.__name__, (handler,), {"log_message": lambda self, *args: None})
+        super().__init__(("127.0.0.1", 0), quiet)
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+@pytest.fixture
+def fake_server():
+    """
+    启动假 HTTP 服务: fake_server(Handler, **state)，测试结束时关闭
+
+    Returns:
+        启动函数，返回 FakeServer（state 设为它的属性）
+    """
+    servers = []
+
+    def start(handler: Type[BaseHTTPRequestHandler], **state) -> FakeServer:
+        server = FakeServer(handler)
+        for name, value in state.items():
+            setattr(server, name, value)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
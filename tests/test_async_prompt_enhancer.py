@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+测试异步 Prompt Enhancer
+使用本地的假 Anthropic Messages API 服务
+"""
+
+import asyncio
+import inspect
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+
+import pytest
+from anthropic import AsyncAnthropic
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.async_prompt_enhancer import AsyncPromptEnhancer
+from src.meme.enhancement_cache import EnhancementCache
+from src.meme.prompt_enhancer import PromptEnhancer
+
+
+class FakeMessagesHandler(BaseHTTPRequestHandler):
+    """POST /v1/messages，延迟 server.delay 秒后返回 "enhanced: <用户消息>" """
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        time.sleep(server.delay)
+        with server.lock:
+            server.active -= 1
+
+        payload = json.dumps({
+            "id": "msg_test",
+            "type": "message",
+            "role": "assistant",
+            "model": body["model"],
+            "content": [{"type": "text", "text": f"enhanced: {body['messages'][0]['content']}"}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": 1, "output_tokens": 1},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+@pytest.fixture
+def server(fake_server):
+    return fake_server(FakeMessagesHandler, delay=0.0, requests=0, active=0, max_active=0)
+
+
+def sdk_request_params(enhancer: PromptEnhancer):
+    """
+    requirements.txt 固定的 SDK 版本直接接受 temperature；
+    不接受该参数的 SDK 版本改用 extra_body 发送，请求 JSON 完全相同
+    """
+    create = AsyncAnthropic(api_key="test").messages.create
+    if "temperature" in inspect.signature(create).parameters:
+        return enhancer.request_params
+
+    def request_params(prompt, context):
+        params = PromptEnhancer.request_params(enhancer, prompt, context)
+        params["extra_body"] = {"temperature": params.pop("temperature")}
+        return params
+
+    return request_params
+
+
+@pytest.fixture
+def make_enhancer(server, monkeypatch):
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    monkeypatch.delenv("CLAUDE_API_KEY", raising=False)
+
+    def make(**kwargs):
+        client = AsyncAnthropic(api_key="test", base_url=server.url, max_retries=0)
+        enhancer = PromptEnhancer(cache=EnhancementCache(":memory:"))
+        enhancer.request_params = sdk_request_params(enhancer)
+        return AsyncPromptEnhancer(enhancer, client=client, **kwargs)
+
+    return make
+
+
+def test_concurrent_identical_requests_share_one_call(server, make_enhancer):
+    server.delay = 0.2
+    enhancer = make_enhancer()
+
+    async def run():
+        prompts = ["milady celebrating thanksgiving", "Milady celebrating Thanksgiving!"] * 3
+        return await asyncio.gather(*(enhancer.enhance(p) for p in prompts))
+
+    results = asyncio.run(run())
+    assert server.requests == 1
+    assert len(set(results)) == 1 and results[0].startswith("enhanced:")
+    assert enhancer.stats()["coalesced"] == 5
+
+
+def test_deadline_falls_back_and_result_is_cached_later(server, make_enhancer):
+    server.delay = 0.5
+    enhancer = make_enhancer()
+
+    async def run():
+        start = time.perf_counter()
+        first = await enhancer.enhance("wen moon", deadline=0.1)
+        elapsed = time.perf_counter() - start
+        # 调用没有被取消，完成后写入缓存
+        await asyncio.sleep(0.6)
+        return first, elapsed, await enhancer.enhance("wen moon", deadline=0.1)
+
+    first, elapsed, second = asyncio.run(run())
+    assert first == "wen moon" and elapsed < 0.4
+    assert second.startswith("enhanced:")
+    assert server.requests == 1
+    assert enhancer.stats()["timeouts"] == 1
+
+
+def test_concurrency_limit(server, make_enhancer):
+    server.delay = 0.1
+    enhancer = make_enhancer(max_concurrency=2)
+
+    async def run():
+        return await asyncio.gather(*(enhancer.enhance(f"prompt {i}") for i in range(6)))
+
+    results = asyncio.run(run())
+    assert all(r.startswith("enhanced:") for r in results)
+    assert server.requests == 6
+    assert server.max_active <= 2
+
+
+def test_enhance_sync_from_threads(server, make_enhancer):
+    server.delay = 0.2
+    enhancer = make_enhancer()
+    results = []
+
+    threads = [
+        threading.Thread(target=lambda: results.append(enhancer.enhance_sync("gm builders")))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    enhancer.close()
+    assert len(results) == 4 and len(set(results)) == 1
+    assert server.requests == 1
+
+
+def test_slow_cache_does_not_block_event_loop(server, make_enhancer, monkeypatch):
+    enhancer = make_enhancer()
+    cache = enhancer.enhancer.cache
+    get = cache.get
+
+    def slow_get(key):
+        time.sleep(0.3)
+        return get(key)
+
+    monkeypatch.setattr(cache, "get", slow_get)
+
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        result = await enhancer.enhance("gm frens")
+        ticker.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(run())
+    # 查询缓存时事件循环仍在运行其他协程
+    assert result.startswith("enhanced:") and ticks >= 10
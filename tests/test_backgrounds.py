@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+测试背景注册表的内存 / 磁盘缓存和失效
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.backgrounds import BackgroundRegistry, render_mcdonald
+from src.meme.mcdonald_background import create_mcdonald_background
+from src.meme.prompt_parser import PromptParser
+
+
+class CountingRenderer:
+    def __init__(self, color="blue"):
+        self.color = color
+        self.calls = []
+
+    def __call__(self, size):
+        self.calls.append(size)
+        return Image.new("RGB", size, self.color)
+
+
+def test_renders_once_per_size(tmp_path):
+    render = CountingRenderer()
+    registry = BackgroundRegistry(cache_dir=str(tmp_path))
+    registry.register("plain", render)
+
+    first = registry.get("plain", (40, 50))
+    assert registry.get("plain", (40, 50)) is first
+    assert first.mode == "RGBA" and first.size == (40, 50)
+    registry.get("plain", (20, 25))
+    assert render.calls == [(40, 50), (20, 25)]
+
+    # 重启后从磁盘读取
+    restarted = BackgroundRegistry(cache_dir=str(tmp_path))
+    restarted.register("plain", render)
+    assert restarted.get("plain", (40, 50)).tobytes() == first.tobytes()
+    assert len(render.calls) == 2
+
+    with pytest.raises(ValueError):
+        registry.get("missing", (40, 50))
+
+
+def test_source_change_invalidates(tmp_path):
+    source = tmp_path / "logo.png"
+    source.write_bytes(b"v1")
+    render = CountingRenderer()
+    registry = BackgroundRegistry(cache_dir=str(tmp_path / "cache"))
+    registry.register("branded", render, sources=[source])
+
+    registry.get("branded", (10, 10))
+    source.write_bytes(b"version 2")
+    registry.get("branded", (10, 10))
+    assert len(render.calls) == 2
+    # 旧版本的磁盘缓存被删除
+    assert len(list((tmp_path / "cache" / "branded").glob("*.npy"))) == 1
+
+
+def test_mcdonald_background():
+    base = render_mcdonald((300, 375))
+    created = create_mcdonald_background((300, 375))
+    assert created.tobytes() == base.tobytes()
+
+    # 调用方修改返回的背景不影响共享底图
+    created.paste((0, 0, 0, 255), (0, 0, 300, 375))
+    assert create_mcdonald_background((300, 375)).tobytes() == base.tobytes()
+
+
+def test_background_keywords_are_registered():
+    registry = BackgroundRegistry.shared()
+    assert all(name in registry for name in PromptParser.BACKGROUND_KEYWORDS)
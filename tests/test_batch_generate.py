@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+测试批量生成
+- batch_generate: 同一个 seed 不论用几个进程，生成的图片都一样，且不修改全局 random 的状态
+- iter_generate: 按需读取任务、逐个产出，不写文件
+"""
+
+import random
+import sys
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.image_io import detect_format
+from src.meme.meme_generator_v2 import MemeGeneratorV2
+
+
+COUNT = 4
+SEED = 7
+
+
+@pytest.fixture
+def generator(tmp_path):
+    """只为本批任务会用到的 NFT 生成小尺寸的假原图"""
+    nft_dir = tmp_path / "nfts"
+    nft_dir.mkdir()
+    gen = MemeGeneratorV2(nft_dir=str(nft_dir), enable_prompt_enhancer=False)
+    for job in gen._plan_batch(COUNT, None, tmp_path, SEED):
+        nft_id = job["nft_id"]
+        color = (nft_id % 256, nft_id // 40, 128, 255)
+        Image.new("RGBA", (100, 125), color).save(nft_dir / f"milady_{nft_id}.png")
+    return gen
+
+
+def read_batch(paths):
+    return [Image.open(path).tobytes() for path in paths]
+
+
+def test_batch_is_deterministic_across_workers(generator, tmp_path):
+    random.seed(123)
+    state = random.getstate()
+    sequential = generator.batch_generate(COUNT, output_dir=str(tmp_path / "one"), seed=SEED)
+    assert random.getstate() == state
+
+    parallel = generator.batch_generate(COUNT, output_dir=str(tmp_path / "two"), workers=2, seed=SEED)
+    assert len(sequential) == COUNT
+    assert [Path(p).name for p in parallel] == [Path(p).name for p in sequential]
+    assert read_batch(parallel) == read_batch(sequential)
+
+
+def test_iter_generate_streams(generator, tmp_path):
+    nft_ids = [job["nft_id"] for job in generator._plan_batch(COUNT, None, tmp_path, SEED)]
+    missing = 10000  # 没有原图，合成失败
+    consumed = []
+
+    def jobs():
+        for nft_id in nft_ids[:2] + [missing]:
+            consumed.append(nft_id)
+            yield {"nft_id": nft_id, "top_text": "GM", "unknown": 1}
+
+    results = generator.iter_generate(jobs(), preset="webp")
+    job, data = next(results)
+    assert consumed == nft_ids[:1] and job["nft_id"] == nft_ids[0]
+    assert detect_format(data) == "WEBP"
+
+    rest = list(results)
+    assert [data is None for _, data in rest] == [False, True]
+    assert list(tmp_path.glob("**/*.webp")) == []
+
+    job, img = next(generator.iter_generate([{"nft_id": nft_ids[0]}]))
+    assert img.size == (100, 125)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+测试 NumPy 合成引擎
+与 PIL 逐层 alpha_composite 的结果逐像素对比
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.compositing import composite_image
+from src.meme.layer_store import LayerEntry, LayerStore
+from src.meme.milady_composer import MiladyComposer
+from src.meme.nft_attributes import NFTAttributeIndex
+
+
+SIZE = (200, 250)
+LAYER_DIR = Path("assets/milady_layers")
+
+# 容差: PIL 每混合一层就把结果舍入到 8 位（定点运算），numpy 引擎全程浮点、最后只舍入一次。
+# 单层最多差 1；多层时各层的舍入误差可以叠加到 2，但下面的层的误差会被上层的 (1 - alpha)
+# 衰减，不会随层数线性增长（随机图层 2~16 层实测最大差都是 2）
+MAX_DIFF = 2
+
+
+def make_entry(rng, size=SIZE) -> LayerEntry:
+    """随机生成一个带半透明区域的裁剪图层"""
+    width, height = size
+    x0, y0 = rng.integers(0, width // 2), rng.integers(0, height // 2)
+    x1, y1 = rng.integers(x0 + 1, width + 1), rng.integers(y0 + 1, height + 1)
+
+    pixels = rng.integers(0, 256, size=(y1 - y0, x1 - x0, 4), dtype=np.uint8)
+    pixels[..., 3][rng.random(pixels.shape[:2]) < 0.3] = 0
+    pixels[..., 3][rng.random(pixels.shape[:2]) < 0.3] = 255
+
+    crop = Image.fromarray(pixels, "RGBA")
+    return LayerEntry(np.asarray(crop.convert("RGBa")), (x0, y0), size)
+
+
+def max_diff(a: Image.Image, b: Image.Image) -> int:
+    return int(np.abs(np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16)).max())
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_pil_chain(seed):
+    rng = np.random.default_rng(seed)
+    entries = [make_entry(rng) for _ in range(8)]
+    base = Image.new("RGBA", SIZE, (200, 180, 160, 255))
+
+    expected = base.copy()
+    for entry in entries:
+        entry.blend_into(expected)
+
+    result = composite_image(base, entries)
+
+    assert result.size == SIZE
+    assert max_diff(result, expected) <= MAX_DIFF
+    # 底图不被修改
+    assert base.getpixel((0, 0)) == (200, 180, 160, 255)
+
+
+def test_empty_and_transparent_layers():
+    base = Image.new("RGBA", SIZE, (10, 20, 30, 255))
+    empty = LayerEntry(np.zeros((0, 0, 4), dtype=np.uint8), (0, 0), SIZE)
+
+    assert composite_image(base, []) is base
+    assert max_diff(composite_image(base, [empty]), base) == 0
+
+
+@pytest.mark.skipif(not (LAYER_DIR / "Hair").exists(), reason="缺少图层素材")
+def test_composer_engines_match(tmp_path):
+    """真实图层: numpy 引擎与 pil 引擎的合成结果一致"""
+    layers = {}
+    for category in ("Hair", "Eyes", "Mouth", "Hat", "Glasses"):
+        images = sorted((LAYER_DIR / category).glob("*.png"))
+        if images:
+            layers[category] = images[0].name
+
+    store = LayerStore(layer_dir=str(LAYER_DIR), store_dir=str(tmp_path / "store"))
+    index = NFTAttributeIndex(index_dir=str(tmp_path / "index"))
+
+    results = {}
+    for engine in MiladyComposer.ENGINES:
+        composer = MiladyComposer(layer_store=store, attribute_index=index, engine=engine)
+        results[engine] = composer.compose_from_scratch(layers=layers)
+
+    assert max_diff(results["pil"], results["numpy"]) <= MAX_DIFF
+
+
+def test_unknown_engine(tmp_path):
+    with pytest.raises(ValueError):
+        MiladyComposer(layer_store=LayerStore(store_dir=str(tmp_path)), engine="gpu")
+
+
+@pytest.mark.skipif(not (LAYER_DIR / "Hair").exists(), reason="缺少图层素材")
+def test_prefix_cache_reuses_nft_layers(tmp_path):
+    """换帽子时复用 NFT 自身图层的前缀，结果与不用缓存完全一致"""
+    store = LayerStore(layer_dir=str(LAYER_DIR), store_dir=str(tmp_path / "store"))
+    index = NFTAttributeIndex(index_dir=str(tmp_path / "index"))
+    index.put(42, {"Race": "clay", "Eyes": "classic", "Shirt": "bear sweater",
+                   "Hair": "bowl black", "Hat": "alien hat"})
+
+    composer = MiladyComposer(layer_store=store, attribute_index=index, prefix_cache_bytes=64 << 20)
+    uncached = MiladyComposer(layer_store=store, attribute_index=index, prefix_cache_bytes=0)
+
+    for i, hat in enumerate(["Aloha Visor.png", "Backwards Trucker Pink.png", "Aloha Visor.png"]):
+        result = composer.compose_with_replacement(42, {"Hat": hat})
+        stats = composer.prefix_cache_stats()
+        # 冷启动只保存第一个替换图层之前的那一个检查点
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (i, 1, 1)
+        expected = uncached.compose_with_replacement(42, {"Hat": hat})
+        assert np.array_equal(np.asarray(result), np.asarray(expected))
+
+    # 默认使用进程内共享的缓存
+    assert MiladyComposer(layer_store=store, attribute_index=index).prefix_cache \
+        is MiladyComposer(layer_store=store, attribute_index=index).prefix_cache
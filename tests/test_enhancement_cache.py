@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+测试提示词增强结果缓存
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme import enhancement_cache
+from src.meme.enhancement_cache import EnhancementCache, cache_key, normalize_prompt
+from src.meme.prompt_enhancer import PromptEnhancer
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(enhancement_cache.time, "time", clock.time)
+    return clock
+
+
+def test_normalized_prompts_share_key():
+    assert normalize_prompt("  Milady   celebrating Thanksgiving!! ") == "milady celebrating thanksgiving"
+    key = cache_key("milady celebrating thanksgiving", "milady meme", "model", "system")
+    assert cache_key("Milady celebrating  thanksgiving.", "milady meme", "model", "system") == key
+    assert cache_key("milady celebrating thanksgiving", "general meme", "model", "system") != key
+    assert cache_key("milady celebrating thanksgiving", "milady meme", "model", "system v2") != key
+
+
+def test_persists_across_instances(tmp_path):
+    db_path = str(tmp_path / "cache.sqlite3")
+    EnhancementCache(db_path).put("k", "enhanced")
+    cache = EnhancementCache(db_path)
+    assert cache.get("k") == "enhanced"
+    assert cache.get("missing") is None
+    assert cache.stats()["hit_rate"] == 0.5
+
+
+def test_ttl_expiry(clock):
+    cache = EnhancementCache(":memory:", ttl_hours=1)
+    cache.put("k", "enhanced")
+    clock.now += 3599
+    assert cache.get("k") == "enhanced"
+    clock.now += 2
+    assert cache.get("k") is None
+    assert cache.stats()["expired"] == 1
+    assert len(cache) == 0
+
+
+def test_evicts_least_recently_used(clock):
+    cache = EnhancementCache(":memory:", max_entries=2)
+    cache.put("a", "A")
+    clock.now += 1
+    cache.put("b", "B")
+    clock.now += 1
+    cache.get("a")
+    clock.now += 1
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+    assert cache.stats()["evictions"] == 1
+
+
+class FakeMessages:
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        text = f"enhanced: {kwargs['messages'][0]['content']}"
+        return type("Response", (), {"content": [type("Block", (), {"text": text})()]})()
+
+
+def test_enhancer_calls_api_once_per_prompt(monkeypatch):
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    monkeypatch.delenv("CLAUDE_API_KEY", raising=False)
+    enhancer = PromptEnhancer(cache=EnhancementCache(":memory:"))
+    messages = FakeMessages()
+    enhancer.client = type("Client", (), {"messages": messages})()
+
+    first = enhancer.enhance("milady celebrating thanksgiving")
+    assert enhancer.enhance("Milady celebrating Thanksgiving!") == first
+    assert messages.calls == 1
+    assert enhancer.cache_stats()["hits"] == 1
+
+    # 没有 API 时仍然可以返回缓存的结果
+    enhancer.client = None
+    assert enhancer.enhance("milady celebrating thanksgiving") == first
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+测试图片编码预设和保存路径的扩展名处理
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.image_io import detect_format, encode_image, resolve_preset, save_image
+
+
+@pytest.mark.parametrize("name, preset, expected, image_format", [
+    ("meme.png", "png", "meme.png", "PNG"),
+    ("meme.PNG", "fast_png", "meme.PNG", "PNG"),
+    ("meme.jpeg", "jpeg", "meme.jpeg", "JPEG"),
+    ("meme.jpg", "jpg", "meme.jpg", "JPEG"),
+    ("meme.png", "webp", "meme.webp", "WEBP"),
+    ("meme.jpeg", "png", "meme.png", "PNG"),
+    ("meme", "jpeg", "meme.jpg", "JPEG"),
+])
+def test_save_image_suffix(tmp_path, name, preset, expected, image_format):
+    """扩展名与预设格式一致时保留，否则换成预设格式的扩展名"""
+    path = save_image(Image.new("RGBA", (8, 8), "red"), str(tmp_path / name), preset)
+    assert Path(path).name == expected
+    assert detect_format(Path(path).read_bytes()) == image_format
+
+
+def test_encode_and_unknown_preset():
+    assert detect_format(encode_image(Image.new("RGB", (8, 8)), "webp")) == "WEBP"
+    with pytest.raises(ValueError):
+        resolve_preset("gif")
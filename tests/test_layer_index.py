@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+测试图层名搜索索引
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.layer_index import LayerIndex
+from src.meme.prompt_parser import PromptParser
+
+
+CONFIG = {
+    "attributeLayers": [
+        {"name": "Hat", "images": ["Beret.png", "Blue Cap.png", "Brown Cowboy Hat.png", "Buckethat.png",
+                                   "Pink Bow.png", "Blue Pink Bow.png"], "z": 10},
+        {"name": "Necklaces", "images": ["Cherry Necklace.png", "ETH Necklace.png"], "z": 7},
+        {"name": "Mouth", "images": ["Smile A.png", "Smoking.png"], "z": 5},
+        {"name": "Overlay", "images": ["100Crazy.png", "Milady.png"], "z": 20},
+    ]
+}
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / "layer_config.json"
+    path.write_text(json.dumps(CONFIG))
+    return path
+
+
+@pytest.fixture
+def index(config_path, tmp_path):
+    return LayerIndex.load(str(config_path), str(tmp_path / "index.json"))
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("brown cowboy hat", "Hat:Brown Cowboy Hat.png"),
+    ("Brown Cowboy Hat.png", "Hat:Brown Cowboy Hat.png"),
+    ("cowbow hat", "Hat:Brown Cowboy Hat.png"),      # 拼写错误
+    ("粉色蝴蝶结", "Hat:Pink Bow.png"),                # 中文词翻译
+    ("渔夫帽", "Hat:Buckethat.png"),                   # 中文整词别名
+    ("blue hat", "Hat:Blue Cap.png"),
+    ("100 crazy", "Overlay:100Crazy.png"),
+    ("smokng", "Mouth:Smoking.png"),
+])
+def test_search_ranks_expected_layer_first(index, query, expected):
+    assert index.search(query)[0].key == expected
+
+
+def test_search_by_category(index):
+    assert index.resolve("cherry", category="Necklaces") == "Necklaces:Cherry Necklace.png"
+    assert index.resolve("xyz") is None
+
+
+def test_find_mentions_longest_whole_words(index):
+    prompt = "戴着渔夫帽和 Cherry Necklace, a beret and a blue pink bow, write a caption, smile a lot, milady"
+    assert index.find_mentions(prompt) == [
+        "Hat:Buckethat.png", "Necklaces:Cherry Necklace.png", "Hat:Beret.png", "Hat:Blue Pink Bow.png",
+    ]
+    assert index.find_mentions("berets") == []
+
+
+def test_rejected_long_mention_keeps_shorter_one():
+    index = LayerIndex.from_layers(["Hat:Cat Ears.png", "Hat:Cat Ears Bell.png"])
+    # "cat ears bell" 不是完整单词，退回到同一位置的 "cat ears"
+    assert index.find_mention_spans("cat ears bellhop") == [(0, 8, "Hat:Cat Ears.png")]
+    assert index.find_mentions("cat ears bell") == ["Hat:Cat Ears Bell.png"]
+
+
+def test_unknown_chinese_dropped_from_query(index):
+    assert index.query_tokens("戴着粉色蝴蝶结的 milady") == ["pink", "bow", "milady"]
+    assert index.resolve("戴着 cherry", category="Necklaces", match_all=True) == "Necklaces:Cherry Necklace.png"
+    assert index.resolve("pink cherry", category="Necklaces", match_all=True) is None
+
+
+def test_cache_rebuilt_only_when_config_changes(config_path, tmp_path):
+    cache_path = tmp_path / "index.json"
+    LayerIndex.load(str(config_path), str(cache_path))
+    cached = json.loads(cache_path.read_text())
+
+    # 配置不变: 直接使用缓存（缓存里的内容即使被改动也会原样加载）
+    cached["layers"][0] = "Hat:Cached.png"
+    cache_path.write_text(json.dumps(cached))
+    assert LayerIndex.load(str(config_path), str(cache_path)).layers[0] == "Hat:Cached.png"
+
+    # 配置变化: 重新构建
+    config = json.loads(config_path.read_text())
+    config["attributeLayers"][0]["images"].append("Fez.png")
+    config_path.write_text(json.dumps(config))
+    rebuilt = LayerIndex.load(str(config_path), str(cache_path))
+    assert rebuilt.layers[0] == "Hat:Beret.png"
+    assert rebuilt.resolve("fez") == "Hat:Fez.png"
+
+
+def test_parser_uses_index_for_uncommon_layers(index):
+    layers = PromptParser(layer_index=index).parse("milady wearing a brown cowboy hat and eth necklace")["layers"]
+    assert layers == {"Hat": ["Brown Cowboy Hat.png"], "Necklaces": ["ETH Necklace.png"]}
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+测试预缩放图层存储：按 alpha 包围盒裁剪、磁盘复用、只混合包围盒区域，以及按字节淘汰的 LRU
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.cache_utils import ByteBudgetLRU
+from src.meme.layer_store import LayerStore
+
+
+SOURCE_SIZE = (200, 250)
+TARGET_SIZE = (100, 125)
+
+
+def open_store(tmp_path) -> LayerStore:
+    return LayerStore(layer_dir=str(tmp_path / "layers"), store_dir=str(tmp_path / "store"), target_size=TARGET_SIZE)
+
+
+def make_store(tmp_path) -> LayerStore:
+    """一个半透明帽子图层 + 一个全透明图层"""
+    hat_dir = tmp_path / "layers" / "Hat"
+    hat_dir.mkdir(parents=True)
+    layer = Image.new("RGBA", SOURCE_SIZE, (0, 0, 0, 0))
+    ImageDraw.Draw(layer).ellipse((40, 10, 160, 70), fill=(200, 50, 50, 180))
+    layer.save(hat_dir / "Cowboy Hat.png")
+    Image.new("RGBA", SOURCE_SIZE, (0, 0, 0, 0)).save(hat_dir / "Empty.png")
+    return open_store(tmp_path)
+
+
+def test_layer_cropped_to_alpha_bbox(tmp_path):
+    store = make_store(tmp_path)
+    entry = store.get("Hat", "Cowboy Hat.png")
+
+    expected = Image.open(tmp_path / "layers" / "Hat" / "Cowboy Hat.png").resize(TARGET_SIZE, Image.Resampling.LANCZOS)
+    assert entry.bbox == expected.getchannel("A").getbbox()
+    assert entry.pixels.shape[:2] == (entry.bbox[3] - entry.bbox[1], entry.bbox[2] - entry.bbox[0])
+    assert np.abs(np.asarray(entry.to_full_image(), dtype=np.int16) - np.asarray(expected)).max() <= 2
+
+    assert store.get("Hat", "Empty.png").bbox is None
+    assert store.get("Hat", "Missing.png") is None
+
+
+def test_store_reused_across_instances(tmp_path):
+    make_store(tmp_path).get("Hat", "Cowboy Hat.png")
+    stored = tmp_path / "store" / "100x125" / "Hat" / "Cowboy Hat.npz"
+    assert stored.exists()
+
+    # 新实例直接读取磁盘上的预缩放文件，源文件更新后重建
+    mtime = stored.stat().st_mtime_ns
+    open_store(tmp_path).get("Hat", "Cowboy Hat.png")
+    assert stored.stat().st_mtime_ns == mtime
+
+    source = tmp_path / "layers" / "Hat" / "Cowboy Hat.png"
+    os.utime(source, (stored.stat().st_mtime + 10, stored.stat().st_mtime + 10))
+    open_store(tmp_path).get("Hat", "Cowboy Hat.png")
+    assert stored.stat().st_mtime_ns != mtime
+
+
+def test_blend_matches_full_alpha_composite(tmp_path):
+    entry = make_store(tmp_path).get("Hat", "Cowboy Hat.png")
+    canvas = Image.new("RGBA", TARGET_SIZE, (30, 120, 200, 255))
+
+    expected = Image.alpha_composite(canvas, entry.to_full_image())
+    entry.blend_into(canvas)
+    assert np.array_equal(np.asarray(canvas), np.asarray(expected))
+
+
+def test_byte_budget_lru_evicts_least_recently_used():
+    cache = ByteBudgetLRU(100)
+    cache.put("a", 1, 40)
+    cache.put("b", 2, 40)
+    assert cache.get("a") == 1
+    cache.put("c", 3, 40)
+
+    assert "b" not in cache and "a" in cache and "c" in cache
+    cache.put("huge", 4, 101)
+    assert "huge" not in cache
+
+    stats = cache.stats()
+    assert stats["bytes"] == 80 and stats["evictions"] == 1 and stats["hits"] == 1
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Tests for the offline layer-alpha accessory detector and SAMDetector's
+fallback to it when Replicate is unavailable
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme import flux_fill_pro, sam_detector
+from src.meme.accessory_regions import AccessoryRegionTable
+from src.meme.layer_store import LayerStore
+from src.meme.local_detector import LocalAccessoryDetector
+from src.meme.nft_attributes import NFTAttributeIndex
+from src.meme.sam_detector import SAMDetector
+
+
+NFT_SIZE = (100, 125)
+LAYER_SIZE = (200, 250)
+
+
+@pytest.fixture
+def local_detector(tmp_path):
+    """Layers at 2x NFT size: a hat ellipse and two glasses lenses."""
+    layer_dir = tmp_path / "layers"
+    layers = {
+        "Hat": {"Cowboy Hat.png": [(40, 10, 160, 70)]},
+        "Glasses": {"ETH Glasses.png": [(50, 90, 90, 110), (110, 90, 150, 110)]},
+    }
+    for category, files in layers.items():
+        (layer_dir / category).mkdir(parents=True)
+        for name, ellipses in files.items():
+            layer = Image.new("RGBA", LAYER_SIZE, (0, 0, 0, 0))
+            draw = ImageDraw.Draw(layer)
+            for box in ellipses:
+                draw.ellipse(box, fill=(200, 50, 50, 255))
+            layer.save(layer_dir / category / name)
+    config = {"attributeLayers": [
+        {"name": category, "images": list(files), "z": z} for z, (category, files) in enumerate(layers.items())
+    ]}
+    (layer_dir / "layer_config.json").write_text(json.dumps(config))
+
+    index = NFTAttributeIndex(index_dir=str(tmp_path / "attributes"))
+    index.put(5050, {"Hat": "cowboy hat", "Glasses": "eth glasses", "Race": "clay"})
+
+    store = LayerStore(layer_dir=str(layer_dir), store_dir=str(tmp_path / "store"), target_size=NFT_SIZE)
+    return LocalAccessoryDetector(
+        layer_store=store, attribute_index=index, config_path=str(layer_dir / "layer_config.json")
+    )
+
+
+def save_nft(tmp_path, name="milady_5050.png", size=NFT_SIZE):
+    path = tmp_path / name
+    Image.new("RGB", size, "pink").save(path)
+    return str(path)
+
+
+def test_masks_come_from_layer_alpha(local_detector, tmp_path):
+    path = save_nft(tmp_path)
+
+    info, pixels = local_detector.detect(path, "glasses")
+    assert np.allclose(info["bbox"], (25, 45, 50, 10), atol=1)  # LANCZOS-softened edges
+    assert pixels.shape == (NFT_SIZE[1], NFT_SIZE[0])
+    assert info["coverage"] == pytest.approx(pixels.sum() / pixels.size * 100)
+    assert not pixels[50, 50]  # between the lenses
+
+    # Resized copy: mask rescaled to the image size
+    info, pixels = local_detector.detect(save_nft(tmp_path, "milady_5050.jpg", (200, 250)), "hat")
+    assert pixels.shape == (250, 200)
+    assert info["bbox"][0] == pytest.approx(40, abs=2) and info["bbox"][2] == pytest.approx(120, abs=2)
+
+    assert local_detector.detect(path, "earrings") is None
+    assert local_detector.detect(save_nft(tmp_path, "meme.png"), "hat") is None
+
+
+def test_sam_detector_falls_back_to_layers(local_detector, tmp_path, monkeypatch):
+    def replicate_down(*args, **kwargs):
+        raise ConnectionError("replicate.com unreachable")
+
+    monkeypatch.setattr(sam_detector.replicate, "run", replicate_down)
+    detector = SAMDetector(
+        cache_dir=str(tmp_path / "sam"), local_detector=local_detector,
+        region_table=AccessoryRegionTable(str(tmp_path / "regions")),
+    )
+    path = save_nft(tmp_path)
+
+    bbox, mask = detector.detect_accessory_mask(path, "hat", predefined_region=(0, 0, 10, 10))
+    assert bbox == local_detector.detect(path, "hat")[0]["bbox"]
+    assert mask.size == NFT_SIZE and np.array(mask).max() == 255
+
+    results = detector.detect_all(path, ["hat", "earrings"], {"earrings": (1, 2, 3, 4)})
+    assert results == {"hat": bbox, "earrings": (1, 2, 3, 4)}
+    assert detector.detect_accessory(save_nft(tmp_path, "meme.png"), "hat", (0, 0, 10, 10)) == (0, 0, 10, 10)
+
+
+def test_region_table_replaces_sam(local_detector, tmp_path, monkeypatch):
+    table = AccessoryRegionTable(str(tmp_path / "regions"), max_tokens=10000)
+    stats = table.build(local_detector, [5050, 1])
+    table.save()
+    assert stats["hat"] == 1 and stats["glasses"] == 1 and stats["earrings"] == 0
+
+    reloaded = AccessoryRegionTable(str(tmp_path / "regions"))
+    assert len(reloaded) == 1 and reloaded.canvas_size == NFT_SIZE
+    path = save_nft(tmp_path)
+    assert reloaded.get(5050, "glasses") == local_detector.detect(path, "glasses")[0]["bbox"]
+    assert reloaded.get(5050, "hat", (200, 250)) == tuple(2 * v for v in reloaded.get(5050, "hat"))
+    assert reloaded.get(5050, "earrings") is None and reloaded.get(1, "hat") is None
+
+    def no_sam(*args, **kwargs):
+        raise AssertionError("SAM-2 should not run")
+
+    monkeypatch.setattr(sam_detector.replicate, "run", no_sam)
+    detector = SAMDetector(cache_dir=str(tmp_path / "sam"), region_table=reloaded)
+    assert detector.detect_accessory(path, "hat") == reloaded.get(5050, "hat")
+    assert detector.detect_all(path, ["hat", "glasses"]) == {
+        "hat": reloaded.get(5050, "hat"), "glasses": reloaded.get(5050, "glasses")
+    }
+
+
+@pytest.fixture
+def region_table(local_detector, tmp_path):
+    table = AccessoryRegionTable(str(tmp_path / "regions"))
+    table.build(local_detector, [5050])
+    return table
+
+
+def test_explicit_nft_id_for_bot_base_images(local_detector, region_table, tmp_path, monkeypatch):
+    def no_sam(*args, **kwargs):
+        raise AssertionError("SAM-2 should not run")
+
+    monkeypatch.setattr(sam_detector.replicate, "run", no_sam)
+    detector = SAMDetector(cache_dir=str(tmp_path / "sam"), local_detector=local_detector,
+                           region_table=region_table)
+    # The bot renders the token to /tmp/milady_<id>_base.png at 500x500
+    path = save_nft(tmp_path, "milady_5050_base.png", (50, 50))
+    expected = region_table.get(5050, "hat", (50, 50))
+
+    assert detector.detect_accessory(path, "hat", nft_id=5050) == expected
+    assert detector.detect_all(path, ["hat"], nft_id=5050) == {"hat": expected}
+    bbox, mask = detector.detect_accessory_mask(path, "hat", nft_id=5050)
+    assert bbox == expected
+    assert np.array_equal(np.array(mask) > 0, local_detector.pixels(5050, "hat", (50, 50)))
+
+
+@pytest.fixture
+def fake_flux(local_detector, region_table, tmp_path, monkeypatch):
+    """FluxFillPro whose Replicate call records the mask and returns the input image."""
+    monkeypatch.setenv("REPLICATE_API_TOKEN", "test")
+    sent_masks = []
+
+    def run(model, input):
+        sent_masks.append(Image.open(input["mask"]).copy())
+        return "http://flux.test/result.png"
+
+    class FakeResponse:
+        content = Path(save_nft(tmp_path, "flux_result.png")).read_bytes()
+
+    monkeypatch.setattr(flux_fill_pro.replicate, "run", run)
+    monkeypatch.setattr(flux_fill_pro.requests, "get", lambda url: FakeResponse())
+
+    flux = flux_fill_pro.FluxFillPro()
+    flux.region_table = region_table
+    flux._local_detector = local_detector
+    return flux, sent_masks
+
+
+def test_replace_accessory_uses_table_and_layer_mask(local_detector, region_table, fake_flux, tmp_path):
+    flux, sent_masks = fake_flux
+    path = save_nft(tmp_path, "milady_5050_base.png")
+    flux.replace_accessory(path, "glasses", "neon shades", str(tmp_path / "out.png"), nft_id=5050)
+
+    # Mask from the layer alpha, not the feathered bbox rectangle
+    layer_mask = sam_detector.mask_image(local_detector.pixels(5050, "glasses", NFT_SIZE))
+    assert np.array_equal(np.array(sent_masks[0]), np.array(flux.create_pixel_mask(layer_mask)))
+    rectangle = flux.create_mask(NFT_SIZE, region_table.get(5050, "glasses"), feather=5)
+    assert not np.array_equal(np.array(sent_masks[0]), np.array(rectangle))
+
+
+def test_batch_replace_uses_layer_mask_on_original(local_detector, region_table, fake_flux, tmp_path):
+    flux, sent_masks = fake_flux
+    flux.use_sam = True
+    flux.sam_detector = SAMDetector(cache_dir=str(tmp_path / "sam"), local_detector=local_detector,
+                                    region_table=region_table)
+    path = save_nft(tmp_path, "milady_5050_base.png")
+    flux.batch_replace(path, {"glasses": "neon shades", "hat": "party hat"}, str(tmp_path / "out.png"), nft_id=5050)
+
+    # Step 1 edits the original NFT: exact layer mask. Step 2 edits step 1's output: rectangle.
+    layer_mask = sam_detector.mask_image(local_detector.pixels(5050, "glasses", NFT_SIZE))
+    assert np.array_equal(np.array(sent_masks[0]), np.array(flux.create_pixel_mask(layer_mask)))
+    rectangle = flux.create_mask(NFT_SIZE, region_table.get(5050, "hat"), feather=5)
+    assert np.array_equal(np.array(sent_masks[1]), np.array(rectangle))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+测试 MemegenAPI 的连接复用、模板目录条件请求、渲染缓存和本地渲染
+使用本地的假 memegen 服务
+"""
+
+import io
+import json
+import sys
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.memegen_api import MemegenAPI
+from src.meme.memegen_local import LocalMemegenRenderer
+
+
+TEMPLATES = [{"id": "drake", "name": "Drakeposting", "lines": 2}]
+ETAG = '"catalog-v1"'
+
+
+BLANK_SIZE = (400, 300)
+
+
+def png_bytes(color="red", size=(8, 8)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class FakeMemegenHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self):
+        server = self.server
+        server.paths.append(self.path)
+        server.client_ports.add(self.client_address[1])
+
+        if self.path == "/templates":
+            if self.headers.get("If-None-Match") == ETAG:
+                server.not_modified += 1
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body, content_type = json.dumps(TEMPLATES).encode(), "application/json"
+        elif self.path.count("/") == 2:
+            # 空白模板 /images/<id>.png
+            body, content_type = png_bytes("gray", BLANK_SIZE), "image/png"
+        else:
+            body, content_type = png_bytes(), "image/png"
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", ETAG)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server(fake_server):
+    return fake_server(FakeMemegenHandler, paths=[], client_ports=set(), not_modified=0)
+
+
+def make_api(server, tmp_path, local_render=False, **kwargs) -> MemegenAPI:
+    api = MemegenAPI(cache_dir=str(tmp_path / "memegen"), local_render=local_render, **kwargs)
+    api.BASE_URL = server.url
+    return api
+
+
+def test_template_catalog_revalidated_with_etag(server, tmp_path):
+    api = make_api(server, tmp_path, catalog_ttl=3600)
+    assert api.get_templates() == TEMPLATES
+    assert api.get_templates() == TEMPLATES
+    assert server.paths.count("/templates") == 1
+
+    # 重启后直接读取持久化的目录；过期后条件请求得到 304
+    restarted = make_api(server, tmp_path, catalog_ttl=0)
+    assert restarted.get_templates() == TEMPLATES
+    assert server.not_modified == 1
+
+
+def test_render_cache_by_url(server, tmp_path):
+    api = make_api(server, tmp_path)
+    first = api.generate_meme("drake", "old way", "new way", output_path=str(tmp_path / "a.png"))
+    api.generate_meme("drake", "old way", "new way", output_path=str(tmp_path / "b.png"))
+    api.generate_meme("drake", "old way", "newer way", output_path=str(tmp_path / "c.png"))
+    renders = [p for p in server.paths if p.startswith("/images/")]
+    assert len(renders) == 2
+    assert Path(first).read_bytes() == png_bytes()
+
+    # 磁盘缓存在重启后仍然有效
+    make_api(server, tmp_path).generate_meme("drake", "old way", "new way", output_path=str(tmp_path / "d.png"))
+    assert len([p for p in server.paths if p.startswith("/images/")]) == 2
+
+
+def test_requests_reuse_one_connection(server, tmp_path):
+    api = make_api(server, tmp_path, render_cache_mb=0, render_cache_disk_mb=0)
+    for i in range(5):
+        api.generate_meme("drake", f"line {i}", output_path=str(tmp_path / f"{i}.png"))
+    assert len(server.client_ports) == 1
+
+
+def test_local_render_downloads_blank_once(server, tmp_path):
+    api = make_api(server, tmp_path, local_render=True)
+    first = api.generate_meme("drake", "old way", "new way", output_path=str(tmp_path / "a.png"))
+    api.generate_meme("drake", "其他", "文字", output_path=str(tmp_path / "b.png"))
+    assert server.paths == ["/images/drake.png"]
+
+    # Drake 的文字在右半边，左半边保持底图
+    img = Image.open(first).convert("RGB")
+    assert img.size == BLANK_SIZE
+    assert img.crop((0, 0, 190, 300)).getcolors() == [(190 * 300, (128, 128, 128))]
+    assert len(img.crop((210, 0, 400, 300)).getcolors(1 << 16)) > 1
+
+    # 重启后直接读取缓存的底图
+    make_api(server, tmp_path, local_render=True).generate_meme(
+        "drake", "a", "b", output_path=str(tmp_path / "c.png"), width=200
+    )
+    assert server.paths == ["/images/drake.png"]
+    assert Image.open(tmp_path / "c.png").size == (200, 150)
+
+
+def test_local_render_falls_back_to_api(server, tmp_path):
+    api = make_api(server, tmp_path, local_render=True)
+    api.generate_meme("unknown", "a", "b", output_path=str(tmp_path / "a.png"))
+    api.generate_meme("drake", "a", "b", output_path=str(tmp_path / "b.png"), style="animated")
+    api.generate_meme("drake", "a", "b", output_path=str(tmp_path / "c.gif"), format="gif")
+    assert server.paths == [
+        "/images/unknown/a/b.png",
+        "/images/drake/a/b.png?style=animated",
+        "/images/drake/a/b.gif",
+    ]
+
+
+def test_local_render_rejects_what_it_cannot_draw(server, tmp_path):
+    api = make_api(server, tmp_path, local_render=True)
+    api.generate_meme("drake", "a", "b", output_path=str(tmp_path / "a.png"), color="notacolor,black")
+    api.generate_custom("drake", ["a", "b", "c"], output_path=str(tmp_path / "b.png"))
+    assert server.paths == [
+        "/images/drake/a/b.png?color=notacolor,black",
+        "/images/drake/a/b/c.png",
+    ]
+
+    api.generate_meme("drake", "a", "b", output_path=str(tmp_path / "c.png"), color="#ff0000,black")
+    assert server.paths[-1] == "/images/drake.png"
+
+
+def test_cjk_text_does_not_cap_font_size():
+    max_size = LocalMemegenRenderer._max_font_size("没有空格的一整句中文梗图标题", None, 100, 10, 50)
+    assert max_size == 50
+    assert LocalMemegenRenderer._max_font_size("SUPERCALIFRAGILISTIC 梗图", None, 100, 10, 50) < 50
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+测试 NFT 属性索引：本地查询、网络补充后的延迟写盘、多个进程同时写入时的合并
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+import requests
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.layer_store import LayerStore
+from src.meme.milady_composer import MiladyComposer
+from src.meme.nft_attributes import NFTAttributeIndex
+
+
+METADATA = {"attributes": [
+    {"trait_type": "Hat", "value": "cowboy hat"},
+    {"trait_type": "Race", "value": "clay"},
+    {"trait_type": "Drip Score", "value": 3},
+]}
+
+
+class FakeResponse:
+    status_code = 200
+
+    def json(self):
+        return METADATA
+
+
+def test_lookup_then_network_fallback(tmp_path, monkeypatch):
+    requested = []
+
+    def fake_get(url, timeout):
+        requested.append(url)
+        return FakeResponse()
+
+    monkeypatch.setattr(requests, "get", fake_get)
+    index = NFTAttributeIndex(index_dir=str(tmp_path / "index"))
+    index.put(1, {"Hat": "beret"})
+    composer = MiladyComposer(layer_store=LayerStore(store_dir=str(tmp_path / "store")), attribute_index=index)
+
+    assert composer.get_nft_attributes(1) == {"Hat": "beret"}
+    assert requested == []
+
+    expected = {"Hat": "cowboy hat", "Race": "clay"}
+    assert composer.get_nft_attributes(7) == expected
+    assert composer.get_nft_attributes(7) == expected
+    assert len(requested) == 1
+
+    # 写盘是延迟合并的，flush() 之后重新加载可以查到
+    index.flush()
+    reloaded = NFTAttributeIndex(index_dir=str(tmp_path / "index"))
+    assert reloaded.get(7) == expected and reloaded.get(1) == {"Hat": "beret"}
+
+
+def test_concurrent_saves_merge(tmp_path):
+    index_dir = str(tmp_path / "index")
+    first = NFTAttributeIndex(index_dir=index_dir)
+    second = NFTAttributeIndex(index_dir=index_dir)
+
+    first.put(1, {"Hat": "beret"})
+    second.put(2, {"Glasses": "heart glasses"})
+    first.save()
+    second.save()
+
+    merged = NFTAttributeIndex(index_dir=index_dir)
+    assert merged.get(1) == {"Hat": "beret"}
+    assert merged.get(2) == {"Glasses": "heart glasses"}
+    assert second.get(1) == {"Hat": "beret"}
+
+
+def test_shared_index(tmp_path):
+    shared = NFTAttributeIndex.shared(str(tmp_path / "index"))
+    assert NFTAttributeIndex.shared(str(tmp_path / "index")) is shared
+    with pytest.raises(ValueError):
+        shared.put(10000, {"Hat": "beret"})
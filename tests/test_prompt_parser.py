@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+测试关键词自动机
+与原来逐个关键词扫描的解析结果逐项对比
+"""
+
+import random
+import re
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.keyword_matcher import KeywordMatcher
+from src.meme.prompt_parser import PromptParser
+
+
+PROMPTS = [
+    "",
+    "gm 早安 建设者",
+    "生成一个戴贝雷帽和墨镜的 milady，赛博朋克风格，文字：\"WAGMI\"",
+    "milady #1234 在麦当劳打工，手上拿着枪，叼一支烟",
+    "McDonald logo with a Cap, neon glow, caption 写 LFG",
+    "a caption about capital, no hat needed",
+    "HAT and Glasses please, liminal space illusion",
+    "戴眼镜的 milady，加上爱心和星星特效",
+    "100% crazy crypto moon 钻石手 diamond hands",
+    "prescription眼镜 cobain眼镜 harajuku眼镜 光环 光晕",
+    "庆祝的帽子 派对帽 生日帽 vaporwave retrowave glitch bokeh dreamy nostalgic surreal",
+    "İstanbul mcdonald 麦当劳背景 face decoration 贴纸 earrings necklace",
+]
+
+
+def reference_parse(parser: PromptParser, prompt: str) -> dict:
+    """原来的实现: 每个关键词单独扫描一次"""
+    prompt_lower = prompt.lower()
+
+    def first(table):
+        for key, keywords in table.items():
+            if any(keyword in prompt_lower for keyword in keywords):
+                return key
+        return None
+
+    layers = defaultdict(list)
+    for layer_name, layer_path in sorted(parser.COMMON_LAYERS.items(), key=lambda x: len(x[0]), reverse=True):
+        if layer_name in prompt:
+            category, filename = layer_path.split(":", 1)
+            if filename not in layers[category]:
+                layers[category].append(filename)
+    for category, keywords in parser.LAYER_KEYWORDS.items():
+        for keyword in keywords:
+            pattern = r'\b' + re.escape(keyword) + r'\b'
+            if re.search(pattern, prompt_lower, re.IGNORECASE) and not layers[category]:
+                if category in parser.DEFAULT_CATEGORY_LAYERS:
+                    layers[category].append(parser.DEFAULT_CATEGORY_LAYERS[category])
+                break
+
+    return {
+        "template": first(parser.TEMPLATE_KEYWORDS),
+        "layers": dict(layers),
+        "font_style": first(parser.FONT_KEYWORDS) or "impact",
+        "visual_styles": [
+            style for style, keywords in parser.VISUAL_STYLE_KEYWORDS.items()
+            if any(keyword in prompt_lower for keyword in keywords)
+        ],
+        "custom_background": first(parser.BACKGROUND_KEYWORDS),
+    }
+
+
+def random_prompts(count: int, seed: int = 0):
+    """用关键词、大小写变化和分隔符随机拼出 prompt"""
+    rng = random.Random(seed)
+    vocabulary = list(PromptParser._keyword_targets) + ["caption", "capital", "hats", "milady", "的", "和"]
+    separators = ["", " ", "，", "_", "-", "的"]
+    for _ in range(count):
+        words = rng.sample(vocabulary, rng.randint(1, 6))
+        words = [w.upper() if rng.random() < 0.2 else w for w in words]
+        yield "".join(w + rng.choice(separators) for w in words)
+
+
+@pytest.mark.parametrize("prompt", PROMPTS + list(random_prompts(300)))
+def test_parse_matches_reference(prompt):
+    # 原来的实现没有图层名索引
+    parser = PromptParser(use_layer_index=False)
+    params = parser.parse(prompt)
+    result = {key: params[key] for key in ("template", "layers", "font_style", "visual_styles", "custom_background")}
+    assert result == reference_parse(parser, prompt)
+
+
+def test_word_boundary_for_layer_categories():
+    parser = PromptParser()
+    assert "Hat" not in parser.parse("write a caption")["layers"]
+    assert parser.parse("add a cap")["layers"]["Hat"] == ["Beret.png"]
+
+
+def test_category_keyword_resolved_by_modifiers():
+    parser = PromptParser()
+    layers = parser.parse("give me a cowboy hat on a black background")["layers"]
+    assert layers == {"Hat": ["Brown Cowboy Hat.png"]}
+    assert parser.parse("a white cowboy cap")["layers"]["Hat"] == ["White Cowboy Hat.png"]
+    # 修饰词不对应任何图层时仍然使用默认图层
+    assert parser.parse("give me a hat, black background")["layers"]["Hat"] == ["Beret.png"]
+
+
+@pytest.mark.parametrize("prompt", ["milady hat", "gm milady hat", "make a milady hat meme", "give me a cute hat"])
+def test_common_words_are_not_modifiers(prompt):
+    # "milady" 等几乎每个 prompt 都有的词不能选中 "Trucker Gothic Milady"
+    assert PromptParser().parse(prompt)["layers"] == {"Hat": ["Beret.png"]}
+
+
+def test_category_keyword_inside_layer_name_ignored():
+    # "party hat" 的 "hat" 已经属于 Party Hat，不再加一顶默认帽子
+    parser = PromptParser()
+    assert parser.parse("party hat")["layers"] == {"Overlay": ["Party Hat.png"]}
+    assert parser.parse("a party hat and a white cowboy hat")["layers"] == {
+        "Overlay": ["Party Hat.png"], "Hat": ["White Cowboy Hat.png"],
+    }
+
+
+def test_longest_layer_name_first():
+    layers = PromptParser().parse("在麦当劳打工，手上拿着枪")["layers"]
+    assert layers == {"Overlay": ["McDonald_Badge.png", "Gunpoint.png"]}
+
+
+def test_matcher_finds_overlapping_keywords():
+    keywords = ["he", "she", "his", "hers", "麦当劳", "麦当劳打工", "枪"]
+    text = "ushers 在麦当劳打工拿着枪 his"
+    expected = sorted(
+        (m.start(), m.start() + len(k), k)
+        for k in keywords
+        for m in re.finditer(f"(?={re.escape(k)})", text)
+    )
+    assert sorted(KeywordMatcher(keywords).find_all(text)) == expected
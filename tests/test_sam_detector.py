@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Tests for SAMDetector mask ingestion (concurrent downloads, in-memory analysis)
+using a local fake mask server instead of Replicate
+"""
+
+import io
+import sys
+import time
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme import sam_detector
+from src.meme.sam_detector import MaskSet, SAMDetector, analyze_mask
+from src.meme.sam_mask_cache import content_hash, dhash
+
+
+IMAGE_SIZE = (200, 250)
+
+
+def reference_analyze(mask_array: np.ndarray, total_pixels: int):
+    """The original per-mask analysis"""
+    rows = np.any(mask_array > 128, axis=1)
+    cols = np.any(mask_array > 128, axis=0)
+    if not rows.any() or not cols.any():
+        return None
+    y1, y2 = np.where(rows)[0][[0, -1]]
+    x1, x2 = np.where(cols)[0][[0, -1]]
+    width, height = x2 - x1 + 1, y2 - y1 + 1
+    coverage = np.sum(mask_array > 128) / total_pixels * 100
+    return {
+        'bbox': (int(x1), int(y1), int(width), int(height)),
+        'coverage': float(coverage),
+        'center': (int(x1 + width // 2), int(y1 + height // 2)),
+    }
+
+
+def make_masks(count: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    masks = []
+    for i in range(count):
+        img = Image.new("L", IMAGE_SIZE, 0)
+        draw = ImageDraw.Draw(img)
+        if i % 5 != 4:  # every fifth mask is empty
+            x, y = rng.integers(0, 150), rng.integers(0, 200)
+            draw.ellipse((x, y, x + rng.integers(2, 50), y + rng.integers(2, 50)), fill=int(rng.integers(100, 256)))
+        masks.append(img)
+    return masks
+
+
+def png_bytes(mask: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    mask.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def mask_urls(server):
+    """Every mask on the fake server plus one that 404s"""
+    return [f"{server.url}/mask_{i}.png" for i in range(len(server.masks))] + [f"{server.url}/missing.png"]
+
+
+class FakeMaskHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        time.sleep(0.02)
+        with server.lock:
+            server.active -= 1
+
+        name = self.path.strip("/")
+        if name.startswith("mask_"):
+            body, status = server.masks[int(name[5:-4])], 200
+        else:
+            body, status = b"not found", 404
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def masks():
+    return make_masks(20)
+
+
+@pytest.fixture
+def server(fake_server, masks):
+    return fake_server(FakeMaskHandler, masks=[png_bytes(mask) for mask in masks], active=0, max_active=0)
+
+
+def test_analyze_mask_matches_reference(masks):
+    total = IMAGE_SIZE[0] * IMAGE_SIZE[1]
+    for mask in masks:
+        assert analyze_mask(png_bytes(mask), total) == reference_analyze(np.array(mask), total)
+
+
+def test_run_sam_downloads_concurrently(server, masks, tmp_path, monkeypatch):
+    image_path = tmp_path / "nft.png"
+    Image.new("RGB", IMAGE_SIZE, "pink").save(image_path)
+    monkeypatch.setattr(sam_detector.replicate, "run", lambda *a, **k: {"individual_masks": mask_urls(server)})
+    monkeypatch.chdir(tmp_path)
+
+    detector = SAMDetector(cache_dir=str(tmp_path / "sam"), download_workers=8)
+    masks_info = detector._run_sam(str(image_path))
+
+    total = IMAGE_SIZE[0] * IMAGE_SIZE[1]
+    expected = [reference_analyze(np.array(m), total) for m in masks]
+    assert masks_info == [info for info in expected if info is not None]
+    assert server.max_active > 1
+    assert not (tmp_path / "temp").exists()
+
+
+def test_accessory_mask_is_exact_union_of_sam_pixels(server, masks, tmp_path, monkeypatch):
+    image_path = tmp_path / "nft.png"
+    Image.new("RGB", IMAGE_SIZE, "pink").save(image_path)
+    monkeypatch.setattr(sam_detector.replicate, "run", lambda *a, **k: {"individual_masks": mask_urls(server)})
+
+    detector = SAMDetector(cache_dir=str(tmp_path / "sam"))
+    mask_set = detector.detect_masks(str(image_path))
+    served = [np.array(m) > 128 for m in masks]
+    served = [m for m in served if m.any()]
+
+    for index in range(len(mask_set)):
+        parts = mask_set.parts_of(index)
+        assert index in parts
+        union = detector.cache.get_pixels(mask_set.source_key, parts)
+        assert np.array_equal(union, np.logical_or.reduce([served[i] for i in parts]))
+
+    bbox, pixel_mask = detector.detect_accessory_mask(str(image_path), "other")
+    assert pixel_mask is not None and pixel_mask.size == IMAGE_SIZE
+    assert Image.fromarray(np.array(pixel_mask)).getbbox() is not None
+
+    # Packed bits of the bbox only: far smaller than the decoded masks
+    stored = detector.cache._conn.execute("SELECT SUM(LENGTH(bits)) FROM sam_mask_pixels").fetchone()[0]
+    assert stored < len(served) * IMAGE_SIZE[0] * IMAGE_SIZE[1] / 8 / 10
+
+
+def test_resized_copy_reuses_mask_pixels(server, masks, tmp_path, monkeypatch):
+    image_path = tmp_path / "milady_7.png"
+    Image.new("RGB", IMAGE_SIZE, "pink").save(image_path)
+    monkeypatch.setattr(sam_detector.replicate, "run", lambda *a, **k: {"individual_masks": mask_urls(server)})
+    detector = SAMDetector(cache_dir=str(tmp_path / "sam"))
+    original = detector.detect_masks(str(image_path))
+
+    def no_sam(*args, **kwargs):
+        raise AssertionError("SAM-2 should not run")
+
+    monkeypatch.setattr(sam_detector.replicate, "run", no_sam)
+    copy_path = tmp_path / "copy" / "milady_7.png"
+    copy_path.parent.mkdir()
+    Image.new("RGB", (400, 500), "pink").save(copy_path)
+
+    copy = detector.detect_masks(str(copy_path))
+    assert copy.source_key == original.source_key
+    union = detector.cache.get_pixels(copy.source_key, [0], copy.image_size)
+    expected = Image.fromarray(detector.cache.get_pixels(original.source_key, [0])).resize(
+        (400, 500), Image.Resampling.NEAREST
+    )
+    assert np.array_equal(union, np.asarray(expected, dtype=bool))
+
+
+def reference_detect(masks_info, img_size, accessory_type, predefined_region=None, iou_weight=0.5):
+    """The original per-mask scoring loop of detect_accessory"""
+    def iou_of(box1, box2):
+        x1_1, y1_1, w1, h1 = box1
+        x1_2, y1_2, w2, h2 = box2
+        x_left, y_top = max(x1_1, x1_2), max(y1_1, y1_2)
+        x_right, y_bottom = min(x1_1 + w1, x1_2 + w2), min(y1_1 + h1, y1_2 + h2)
+        if x_right < x_left or y_bottom < y_top:
+            return 0.0
+        intersection = (x_right - x_left) * (y_bottom - y_top)
+        union = w1 * h1 + w2 * h2 - intersection
+        return intersection / union if union > 0 else 0.0
+
+    def score_range(value, low, high):
+        if low <= value <= high:
+            return 1.0
+        if value < low:
+            return max(0, 1.0 - (low - value) * 2)
+        return max(0, 1.0 - (value - high) * 2)
+
+    hints = SAMDetector.POSITION_HINTS.get(accessory_type, SAMDetector.POSITION_HINTS["other"])
+    width, height = img_size
+    best_mask, best_score, best_pos = None, 0.0, 0.0
+    for mask in [m for m in masks_info if m['coverage'] < 90]:
+        coverage = mask['coverage'] / 100.0
+        size_min, size_max = hints['size_range']
+        if size_min <= coverage <= size_max:
+            size_score = 1.0
+        elif coverage < size_min:
+            size_score = max(0, coverage / size_min)
+        else:
+            size_score = max(0, 1.0 - (coverage - size_max) * 2)
+        pos = (score_range(mask['center'][1] / height, *hints['y_range']) * 0.5
+               + size_score * 0.3
+               + score_range(mask['center'][0] / width, *hints['x_range']) * 0.2)
+        if predefined_region is not None:
+            combined = iou_of(mask['bbox'], predefined_region) * iou_weight + pos * (1 - iou_weight)
+        else:
+            combined = pos
+        if combined > best_score:
+            best_mask, best_score, best_pos = mask, combined, pos
+    if best_mask is None or best_pos < 0.3:
+        return predefined_region
+    return best_mask['bbox']
+
+
+def random_masks(rng, count, size=(1000, 1250)):
+    masks = []
+    for _ in range(count):
+        w, h = int(rng.integers(5, size[0])), int(rng.integers(5, size[1]))
+        x, y = int(rng.integers(0, size[0] - w + 1)), int(rng.integers(0, size[1] - h + 1))
+        masks.append({
+            'bbox': (x, y, w, h),
+            'coverage': float(rng.uniform(0.01, 1.0) * w * h / (size[0] * size[1]) * 100),
+            'center': (x + w // 2, y + h // 2),
+        })
+    # a background mask
+    masks.append({'bbox': (0, 0) + size, 'coverage': 95.0, 'center': (size[0] // 2, size[1] // 2)})
+    return masks
+
+
+@pytest.fixture
+def cached_detector(tmp_path, monkeypatch):
+    """A detector whose image already has cached masks; running SAM is an error."""
+    def no_sam(*args, **kwargs):
+        raise AssertionError("SAM-2 should not run")
+
+    monkeypatch.setattr(sam_detector.replicate, "run", no_sam)
+    detector = SAMDetector(cache_dir=str(tmp_path / "sam"))
+
+    def add_image(masks, size=(1000, 1250), name="nft.png"):
+        path = tmp_path / name
+        img = Image.new("RGB", size, "pink")
+        img.save(path)
+        detector.cache.put(content_hash(path.read_bytes()), masks, size, dhash(img))
+        return str(path)
+
+    detector.add_image = add_image
+    return detector
+
+
+def test_vectorized_scoring_matches_reference(cached_detector):
+    rng = np.random.default_rng(3)
+    regions = [None, (100, 30, 300, 180), (150, 170, 200, 90), (0, 0, 10, 10)]
+    for i in range(20):
+        masks = random_masks(rng, int(rng.integers(1, 40)))
+        path = cached_detector.add_image(masks, name=f"nft_{i}.png")
+        for accessory_type in list(SAMDetector.POSITION_HINTS) + ["unknown"]:
+            region = regions[i % len(regions)]
+            expected = reference_detect(masks, (1000, 1250), accessory_type, region)
+            assert cached_detector.detect_accessory(path, accessory_type, region) == expected
+
+
+def test_detect_all_scores_every_type_from_one_run(cached_detector):
+    masks = random_masks(np.random.default_rng(5), 30)
+    path = cached_detector.add_image(masks)
+    regions = {"hat": (100, 30, 300, 180), "glasses": (150, 170, 200, 90)}
+
+    results = cached_detector.detect_all(path, predefined_regions=regions)
+    assert set(results) == set(SAMDetector.POSITION_HINTS)
+    for accessory_type, region in results.items():
+        assert region == reference_detect(masks, (1000, 1250), accessory_type, regions.get(accessory_type))
+    assert cached_detector.cache.stats()["content_hits"] == 1
+
+
+def test_mask_set_iou():
+    mask_set = MaskSet(random_masks(np.random.default_rng(0), 5), (1000, 1250))
+    assert mask_set.bboxes.shape == (6, 4)
+    assert mask_set.iou(mask_set.masks[0]['bbox'])[0] == pytest.approx(1.0)
+    assert len(MaskSet([], (10, 10)).iou((0, 0, 5, 5))) == 0
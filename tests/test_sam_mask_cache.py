@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Tests for the SAM mask store: content hash, NFT id and perceptual lookups
+"""
+
+import io
+import random
+import sys
+from pathlib import Path
+
+import pytest
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme import sam_detector, sam_mask_cache
+from src.meme.sam_detector import SAMDetector
+from src.meme.sam_mask_cache import SAMMaskCache, content_hash, dhash, nft_id_from_path
+
+
+LAYER_DIR = Path(__file__).parent.parent / "assets" / "milady_layers"
+BASE_LAYERS = [
+    "UnclothedBase/Pale.png", "Eyes/Classic.png", "Eye Color/Blue.png", "Hair/Bowl Black.png",
+    "Shirt/Bear Sweater.png", "Brows/Complacent A.png", "Mouth/Cat.png",
+]
+
+MASKS = [
+    {"bbox": (100, 40, 300, 200), "coverage": 4.8, "center": (250, 140)},
+    {"bbox": (150, 330, 200, 90), "coverage": 1.44, "center": (250, 375)},
+]
+
+
+def fake_nft(seed: int, size=(1000, 1250)) -> Image.Image:
+    """A random background with random shapes, standing in for an NFT."""
+    rng = random.Random(seed)
+    img = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        w, h = rng.randrange(50, 400), rng.randrange(50, 400)
+        draw.ellipse((x, y, x + w, y + h), fill=tuple(rng.randrange(256) for _ in range(3)))
+    return img
+
+
+def encode(img: Image.Image, fmt="PNG", **params) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, **params)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = SAMMaskCache(str(tmp_path / "masks.sqlite3"))
+    yield cache
+    cache.close()
+
+
+def test_content_and_perceptual_lookups(cache, tmp_path):
+    original = fake_nft(1)
+    data = encode(original)
+    cache.put(content_hash(data), MASKS, original.size, dhash(original), nft_id=1)
+
+    hit = cache.get_exact(content_hash(data))
+    assert (hit.masks, hit.size, hit.source_key) == (MASKS, original.size, content_hash(data))
+
+    # Re-encoded, half-size copy: perceptual hit with rescaled boxes
+    copy = Image.open(io.BytesIO(encode(original.resize((500, 625)), "JPEG", quality=80)))
+    masks = cache.get("other", size=copy.size, phash=dhash(copy)).masks
+    assert masks[0]["bbox"] == (50, 20, 150, 100)
+    assert masks[0]["center"] == (125, 70)
+    assert masks[0]["coverage"] == MASKS[0]["coverage"]
+
+    # A different NFT is a miss
+    other = fake_nft(2)
+    assert cache.get(content_hash(encode(other)), size=other.size, phash=dhash(other), nft_id=2) is None
+
+    # The in-memory index is rebuilt from disk
+    reopened = SAMMaskCache(str(tmp_path / "masks.sqlite3"))
+    assert reopened.get("other", size=copy.size, phash=dhash(copy)) is not None
+    assert cache.stats()["content_hits"] == 1 and cache.stats()["perceptual_hits"] == 1
+
+
+def test_nft_id_requires_matching_image(cache):
+    original = fake_nft(5050)
+    cache.put("a", MASKS, original.size, dhash(original), nft_id=5050)
+    cache.max_distance = 0
+
+    assert cache.get("b", size=original.size, phash=dhash(original), nft_id=5050).masks == MASKS
+    edited = fake_nft(6060)
+    assert cache.get("c", size=edited.size, phash=dhash(edited), nft_id=5050) is None
+    assert nft_id_from_path("assets/milady_nfts/images/milady_5050.png") == 5050
+    assert nft_id_from_path("output/lark/meme.png") is None
+
+
+def test_expired_entries_are_misses(cache, monkeypatch):
+    original = fake_nft(3)
+    cache.put("a", MASKS, original.size, dhash(original))
+    cache.ttl_seconds = 60
+    monkeypatch.setattr(sam_mask_cache.time, "time", lambda: 1e12)
+    assert cache.get("a", size=original.size, phash=dhash(original)) is None
+    assert len(cache) == 0
+
+
+def test_detector_skips_sam_for_resized_copy(tmp_path, monkeypatch):
+    original = fake_nft(7)
+    original_path = tmp_path / "milady_7.png"
+    original.save(original_path)
+
+    detector = SAMDetector(cache_dir=str(tmp_path / "sam"))
+    detector.cache.put(content_hash(original_path.read_bytes()), MASKS, original.size, dhash(original), nft_id=7)
+
+    def no_sam(*args, **kwargs):
+        raise AssertionError("SAM-2 should not run")
+
+    monkeypatch.setattr(sam_detector.replicate, "run", no_sam)
+
+    resized_path = tmp_path / "download" / "milady_7.png"
+    resized_path.parent.mkdir()
+    original.resize((500, 625)).save(resized_path)
+    assert detector._run_sam(str(resized_path))[1]["bbox"] == (75, 165, 100, 45)
+    # The copy is now cached under its own content hash
+    assert detector.cache.get_exact(content_hash(resized_path.read_bytes())) is not None
+
+
+@pytest.fixture(scope="module")
+def compose():
+    """Composite real layer files (small, for speed) like two tokens built from the same template."""
+    cache = {}
+
+    def compose(layers, size=(250, 312)):
+        canvas = Image.new("RGBA", size, (255, 255, 255, 255))
+        for name in layers:
+            if name not in cache:
+                cache[name] = Image.open(LAYER_DIR / name).convert("RGBA").resize(size, Image.Resampling.BILINEAR)
+            canvas.alpha_composite(cache[name])
+        return canvas.convert("RGB")
+
+    return compose
+
+
+@pytest.mark.skipif(not (LAYER_DIR / "UnclothedBase").exists(), reason="layer assets not downloaded")
+def test_similar_tokens_do_not_share_masks(cache, compose):
+    base = compose(BASE_LAYERS)
+    cache.put(content_hash(encode(base)), MASKS, base.size, dhash(base), nft_id=1)
+
+    for extra in ["Earrings/Burger Earring.png", "Necklaces/ETH Necklace.png", "Face Decoration/Crescent Tattoo.png"]:
+        token = compose(BASE_LAYERS + [extra])
+        # Another token: never matched, even though its dHash is only a few bits away
+        assert cache.get(content_hash(encode(token)), size=token.size, phash=dhash(token), nft_id=2) is None
+        # Unknown token id: too far for the perceptual lookup
+        assert cache.get(content_hash(encode(token)), size=token.size, phash=dhash(token)) is None
+
+    # Copies of the same token still hit
+    copy = base.resize((500, 624))
+    assert cache.get("copy", size=copy.size, phash=dhash(copy), nft_id=1) is not None
+    resaved = encode(base, optimize=True)  # different bytes, same pixels
+    assert content_hash(resaved) != content_hash(encode(base))
+    assert cache.get(content_hash(resaved), size=base.size, phash=dhash(Image.open(io.BytesIO(resaved)))) is not None
+    assert cache.stats()["perceptual_hits"] == 1 and cache.stats()["nft_id_hits"] == 1
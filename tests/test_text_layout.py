@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+测试文字排版：拉丁文按单词换行、中日韩文字逐字换行、二分查找字号的上下界
+使用系统的 DejaVu Sans，没有时使用 Pillow 自带的 Aileron 字体
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+from PIL import ImageFont
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.text_layout import fit_text, is_cjk, layout_text, measure, tokenize, wrap_text
+
+
+FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+]
+
+
+@pytest.fixture(scope="module")
+def font_path(tmp_path_factory):
+    for candidate in FONT_CANDIDATES:
+        if Path(candidate).exists():
+            return candidate
+
+    # Pillow 自带的可缩放字体（没有文件路径，写到临时目录）
+    try:
+        bundled = ImageFont.load_default(size=20)
+    except (TypeError, ImportError):
+        pytest.skip("没有可用的 TrueType 字体")
+    if not isinstance(bundled, ImageFont.FreeTypeFont):
+        pytest.skip("没有可用的 TrueType 字体")
+    path = tmp_path_factory.mktemp("fonts") / "Aileron-Regular.otf"
+    path.write_bytes(bundled.path.getvalue())
+    return str(path)
+
+
+def line_width(font_path, size, line):
+    return sum(measure(font_path, size, token) for token in tokenize(line))
+
+
+def test_tokenize_mixed_text():
+    assert tokenize("GM 中文梗图 LFG") == ["GM", " ", "中", "文", "梗", "图", " ", "LFG"]
+    assert is_cjk("梗") and is_cjk("。") and not is_cjk("GM") and not is_cjk("")
+
+
+def test_latin_wraps_on_words(font_path):
+    text = "WHEN YOU FINALLY SHIP THE FEATURE AND IT WORKS"
+    max_width = measure(font_path, 40, "WHEN YOU FINALLY")
+    lines = wrap_text(text, font_path, 40, max_width)
+
+    assert len(lines) > 1
+    assert " ".join(lines) == text
+    assert all(line_width(font_path, 40, line) <= max_width for line in lines)
+
+
+def test_long_word_breaks_into_characters(font_path):
+    word = "SUPERCALIFRAGILISTICEXPIALIDOCIOUS"
+    max_width = measure(font_path, 40, word) / 3
+    lines = wrap_text(word, font_path, 40, max_width)
+
+    assert len(lines) >= 3
+    assert "".join(lines) == word
+    assert all(line_width(font_path, 40, line) <= max_width for line in lines)
+
+
+def test_cjk_breaks_between_characters(font_path):
+    text = "当你终于上线了这个功能然后它居然能跑"
+    max_width = measure(font_path, 40, "当") * 5.5
+    lines = wrap_text(text, font_path, 40, max_width)
+
+    assert [len(line) for line in lines] == [5, 5, 5, 3]
+    assert "".join(lines) == text
+
+
+def test_mixed_cjk_and_latin(font_path):
+    text = "GM 建设者们 keep building 永不停止"
+    max_width = measure(font_path, 40, "GM 建设者们")
+    lines = wrap_text(text, font_path, 40, max_width)
+
+    assert all(line_width(font_path, 40, line) <= max_width for line in lines)
+    # 拉丁单词不被拆开，只有空格被换行吃掉
+    assert "keep" in " ".join(lines).split() and "building" in " ".join(lines).split()
+    assert "".join(lines).replace(" ", "") == text.replace(" ", "")
+
+
+def test_existing_newlines_are_kept(font_path):
+    assert wrap_text("GM\nLFG", font_path, 40, 10_000) == ["GM", "LFG"]
+
+
+def test_fit_text_keeps_max_size_for_short_text(font_path):
+    layout = fit_text("GM", font_path, 900, 300, min_size=16, max_size=100)
+    assert layout.fits and layout.font_size == 100 and layout.lines == ["GM"]
+
+
+def test_fit_text_finds_largest_fitting_size(font_path):
+    text = "WHEN YOU FINALLY SHIP THE FEATURE AND IT WORKS ON THE FIRST TRY"
+    layout = fit_text(text, font_path, 600, 200, min_size=16, max_size=100)
+
+    assert layout.fits and 16 < layout.font_size < 100
+    assert layout.width <= 600 and layout.height <= 200
+    assert not layout_text(text, font_path, layout.font_size + 1, 600, 200).fits
+
+
+def test_fit_text_min_size_and_max_lines(font_path):
+    text = "WAGMI " * 200
+    layout = fit_text(text, font_path, 300, 100, min_size=20, max_size=60)
+    assert layout.font_size == 20 and not layout.fits
+
+    limited = fit_text("GOOD MORNING BUILDERS", font_path, 300, 1000, min_size=10, max_size=120, max_lines=1)
+    assert limited.fits and len(limited.lines) == 1
+    assert fit_text("GOOD MORNING BUILDERS", font_path, 300, 1000, min_size=10, max_size=120).font_size \
+        > limited.font_size
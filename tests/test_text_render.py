@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+测试文字贴图渲染（描边 / 发光）和 CaptionMeme 的字体、贴图缓存
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageFont
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.meme.caption_meme import CaptionMeme
+from src.meme.text_render import draw_sprite, load_font, render_glow_text, render_outlined_text
+
+
+FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+
+
+@pytest.fixture(scope="module")
+def font():
+    if Path(FONT_PATH).exists():
+        return load_font(FONT_PATH, 48)
+    try:
+        return ImageFont.load_default(size=48)
+    except TypeError:
+        pytest.skip("没有可用的 TrueType 字体")
+
+
+def colors(sprite: Image.Image) -> set:
+    """完全不透明像素的颜色"""
+    pixels = np.asarray(sprite).reshape(-1, 4)
+    return {tuple(p[:3]) for p in pixels[pixels[:, 3] == 255]}
+
+
+def test_outline_surrounds_text(font):
+    sprite, padding = render_outlined_text("GM", font, text_color="white", outline_color="black", outline_width=3)
+    assert padding == 4
+    assert {(255, 255, 255), (0, 0, 0)} <= colors(sprite)
+
+    # 描边让贴图的不透明区域比文字本体更大
+    plain, _ = render_outlined_text("GM", font, outline_width=0)
+    assert np.count_nonzero(np.asarray(sprite)[..., 3]) > np.count_nonzero(np.asarray(plain)[..., 3])
+
+
+def test_glow_layers(font):
+    sprite, padding = render_glow_text("GM", font, glow_color="#00FFFF", glow_width=8, shadow_width=3)
+    assert padding == 17
+    assert (0, 255, 255) in colors(sprite)
+    # 光晕和阴影向外渐变透明
+    alpha = np.asarray(sprite)[..., 3]
+    assert len(np.unique(alpha)) > 10 and alpha.min() == 0
+
+
+def test_draw_sprite_clips_at_edges(font):
+    sprite, padding = render_outlined_text("GM", font)
+    image = Image.new("RGB", (60, 40), "blue")
+    draw_sprite(image, sprite, (-padding - 20, -padding - 10))
+    assert image.size == (60, 40) and len(image.getcolors()) > 1
+
+
+def test_caption_sprites_cached():
+    """贴图缓存是进程内共享的：另一个 CaptionMeme 渲染同样的文字直接命中"""
+    CaptionMeme.caption_cache.clear()
+    font_path = FONT_PATH if Path(FONT_PATH).exists() else None
+    image = Image.new("RGB", (400, 500), "pink")
+
+    first = CaptionMeme(font_path=font_path).add_caption(image, "GM BUILDERS", "LFG")
+    hits = CaptionMeme.caption_cache_stats()["hits"]
+    second = CaptionMeme(font_path=font_path).add_caption(image, "GM BUILDERS", "LFG")
+
+    assert CaptionMeme.caption_cache_stats()["hits"] == hits + 2
+    assert np.array_equal(np.asarray(first), np.asarray(second))
+    assert image.getpixel((0, 0)) == (255, 192, 203)
+    assert load_font(FONT_PATH, 48) is load_font(FONT_PATH, 48)